@@ -11,7 +11,8 @@ from esphome.config import iter_components, read_config, strip_default_ids
 from esphome.const import CONF_BAUD_RATE, CONF_BROKER, CONF_LOGGER, CONF_OTA, \
     CONF_PASSWORD, CONF_PORT
 from esphome.core import CORE, EsphomeError
-from esphome.helpers import color, indent
+from esphome.helpers import color, get_bool_env
+from esphome.profiling import PROFILER
 from esphome.py_compat import IS_PY2, safe_input
 from esphome.util import run_external_command, run_external_process, safe_print
 
@@ -118,18 +119,27 @@ def run_miniterm(config, port):
 
 
 def write_cpp(config):
+    with PROFILER.phase('config_hash'):
+        config_hash = writer.get_config_hash()
+    if writer.is_code_up_to_date(config_hash):
+        _LOGGER.info("Source code is up to date, skipping code generation.")
+        return 0
+
     _LOGGER.info("Generating C++ source...")
 
-    for _, component, conf in iter_components(CORE.config):
-        if component.to_code is not None:
-            CORE.add_job(component.to_code, conf)
+    with PROFILER.phase('to_code'):
+        for _, component, conf in iter_components(CORE.config):
+            if component.to_code is not None:
+                CORE.add_job(component.to_code, conf)
 
-    CORE.flush_tasks()
+        CORE.flush_tasks()
 
-    writer.write_platformio_project()
+    with PROFILER.phase('write_platformio_project'):
+        writer.write_platformio_project()
 
-    code_s = indent(CORE.cpp_main_section)
-    writer.write_cpp(code_s)
+    with PROFILER.phase('write_cpp'):
+        writer.write_cpp()
+    writer.save_config_hash(config_hash)
     return 0
 
 
@@ -137,7 +147,8 @@ def compile_program(args, config):
     from esphome import platformio_api
 
     _LOGGER.info("Compiling app...")
-    return platformio_api.run_compile(config, args.verbose)
+    with PROFILER.phase('platformio'):
+        return platformio_api.run_compile(config, args.verbose)
 
 
 def upload_using_esptool(config, port):
@@ -163,11 +174,13 @@ def upload_program(config, args, host):
         return platformio_api.run_upload(config, args.verbose, host)
 
     from esphome import espota2
+    from esphome.storage_json import firmware_base_path
 
     ota_conf = config[CONF_OTA]
     remote_port = ota_conf[CONF_PORT]
     password = ota_conf[CONF_PASSWORD]
-    res = espota2.run_ota(host, remote_port, password, CORE.firmware_bin)
+    res = espota2.run_ota(host, remote_port, password, CORE.firmware_bin,
+                          firmware_base_path())
     return res
 
 
@@ -178,7 +191,10 @@ def show_logs(config, args, port):
         run_miniterm(config, port)
         return 0
     if get_port_type(port) == 'NETWORK' and 'api' in config:
-        from esphome.api.client import run_logs
+        if IS_PY2:
+            from esphome.api.client import run_logs
+        else:
+            from esphome.api.async_client import run_logs
 
         return run_logs(config, port)
     if get_port_type(port) == 'MQTT' and 'mqtt' in config:
@@ -287,6 +303,17 @@ def command_run(args, config):
     return show_logs(config, args, port)
 
 
+def command_size(args, config):
+    from esphome import size_report
+
+    report = size_report.create_size_report(config)
+    report.print_report()
+    if args.json:
+        report.save_json(args.json, name=CORE.name)
+        _LOGGER.info("Wrote size report to %s", args.json)
+    return 0
+
+
 def command_clean_mqtt(args, config):
     return clean_mqtt(config, args)
 
@@ -330,19 +357,50 @@ POST_CONFIG_ACTIONS = {
     'upload': command_upload,
     'logs': command_logs,
     'run': command_run,
+    'size': command_size,
     'clean-mqtt': command_clean_mqtt,
     'mqtt-fingerprint': command_mqtt_fingerprint,
     'clean': command_clean,
 }
 
 
+def _int_at_least(minimum):
+    def parse(value):
+        try:
+            result = int(value)
+        except ValueError:
+            result = None
+        if result is None or result < minimum:
+            raise argparse.ArgumentTypeError(u"must be an integer of at least {}, got '{}'"
+                                             u"".format(minimum, value))
+        return result
+    return parse
+
+
 def parse_args(argv):
     parser = argparse.ArgumentParser(prog='esphome')
     parser.add_argument('-v', '--verbose', help="Enable verbose esphome logs.",
                         action='store_true')
     parser.add_argument('--dashboard', help="Internal flag to set if the command is run from the "
                                             "dashboard.", action='store_true')
-    parser.add_argument('configuration', help='Your YAML configuration file.')
+    parser.add_argument('configuration', help='Your YAML configuration file. The compile and '
+                                              'upload commands also accept multiple files and '
+                                              'directories.',
+                        nargs='+')
+    parser.add_argument('--no-yaml-cache', help="Don't use the cache of parsed YAML files in "
+                                                "the .esphome/yaml_cache directory next to the "
+                                                "configuration. Can also be disabled with the "
+                                                "ESPHOME_DISABLE_YAML_CACHE environment variable.",
+                        action='store_true')
+    parser.add_argument('--profile', help="Print how long each phase of the command took. Can "
+                                          "also be enabled with the ESPHOME_PROFILE environment "
+                                          "variable.", action='store_true')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help="Write the per-phase and per-component timings to FILE as JSON.")
+    parser.add_argument('--profile-trace', metavar='FILE',
+                        help="Write a Chrome trace (chrome://tracing) of the run to FILE.")
+    parser.add_argument('--profile-pstats', metavar='FILE',
+                        help="Run the command under cProfile and dump the stats to FILE.")
 
     subparsers = parser.add_subparsers(help='Commands', dest='command')
     subparsers.required = True
@@ -353,11 +411,28 @@ def parse_args(argv):
     parser_compile.add_argument('--only-generate',
                                 help="Only generate source code, do not compile.",
                                 action='store_true')
+    parser_compile.add_argument('-j', '--jobs', type=_int_at_least(1), default=1,
+                                help="When compiling multiple configurations, the number of "
+                                     "builds to run at the same time.")
+    parser_compile.add_argument('--generate-jobs', type=_int_at_least(1),
+                                help="When compiling multiple configurations, the number of "
+                                     "processes to validate and generate code with. Defaults "
+                                     "to the number of CPUs.")
 
     parser_upload = subparsers.add_parser('upload', help='Validate the configuration '
                                                          'and upload the latest binary.')
     parser_upload.add_argument('--upload-port', help="Manually specify the upload port to use. "
                                                      "For example /dev/cu.SLAB_USBtoUART.")
+    parser_upload.add_argument('--ota-jobs', type=_int_at_least(1), default=8,
+                               help="When uploading to multiple nodes, the number of OTA "
+                                    "uploads to run at the same time.")
+    parser_upload.add_argument('--ota-jobs-per-subnet', type=_int_at_least(0), default=0,
+                               help="When uploading to multiple nodes, the number of OTA "
+                                    "uploads to run at the same time in each /24 subnet. "
+                                    "Defaults to no limit.")
+    parser_upload.add_argument('--ota-retries', type=_int_at_least(0), default=2,
+                               help="When uploading to multiple nodes, how often to retry a "
+                                    "failed upload.")
 
     parser_logs = subparsers.add_parser('logs', help='Validate the configuration '
                                                      'and show all MQTT logs.')
@@ -379,6 +454,11 @@ def parse_args(argv):
     parser_run.add_argument('--password', help='Manually set the MQTT password for logs.')
     parser_run.add_argument('--client-id', help='Manually set the client id for logs.')
 
+    parser_size = subparsers.add_parser('size', help="Show the flash and RAM usage of each "
+                                                     "component in the compiled firmware.")
+    parser_size.add_argument('--json', metavar='FILE',
+                             help="Also write the size report as JSON to FILE.")
+
     parser_clean = subparsers.add_parser('clean-mqtt', help="Helper to clear an MQTT topic from "
                                                             "retain messages.")
     parser_clean.add_argument('--topic', help='Manually set the topic to subscribe to.')
@@ -418,6 +498,54 @@ def run_esphome(argv):
     CORE.dashboard = args.dashboard
 
     setup_log(args.verbose)
+    if args.no_yaml_cache:
+        # Through the environment so that fleet worker processes see it too
+        os.environ['ESPHOME_DISABLE_YAML_CACHE'] = '1'
+    if not (args.profile or args.profile_json or args.profile_trace or args.profile_pstats or
+            get_bool_env('ESPHOME_PROFILE')):
+        return _run_command(args)
+    return _run_command_profiled(args)
+
+
+def _run_command_profiled(args):
+    PROFILER.enable(trace=args.profile_trace is not None)
+    if args.profile_pstats is not None:
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            exit_code = profile.runcall(_run_command, args)
+        finally:
+            profile.dump_stats(args.profile_pstats)
+            _LOGGER.info("Wrote cProfile stats to %s", args.profile_pstats)
+    else:
+        exit_code = _run_command(args)
+
+    PROFILER.print_summary()
+    if args.profile_json is not None:
+        PROFILER.save_json(args.profile_json, command=args.command,
+                           configuration=args.configuration, exit_code=exit_code,
+                           esphome_version=const.__version__)
+    if args.profile_trace is not None:
+        PROFILER.save_chrome_trace(args.profile_trace)
+    return exit_code
+
+
+def _run_command(args):
+    if args.command in ('compile', 'upload'):
+        from esphome import fleet
+
+        config_paths = fleet.expand_configurations(args.configuration)
+        if len(config_paths) != 1 or config_paths[0] != args.configuration[0]:
+            if args.command == 'upload':
+                return fleet.upload_fleet(args, config_paths)
+            return fleet.compile_fleet(args, config_paths)
+    if len(args.configuration) != 1:
+        _LOGGER.error("Multiple configurations are only supported by the compile and upload "
+                      "commands.")
+        return 1
+    args.configuration = args.configuration[0]
+
     if args.command in PRE_CONFIG_ACTIONS:
         try:
             return PRE_CONFIG_ACTIONS[args.command](args)
@@ -0,0 +1,502 @@
+"""An asyncio implementation of the native API client, Python 3 only.
+
+All connections run on one event loop instead of a thread per client. Frames are parsed
+from a single receive buffer as data arrives and requests return futures, which can be
+awaited or yielded from tornado coroutines.
+"""
+import asyncio  # pylint: disable=import-error
+from datetime import datetime
+import functools
+import logging
+import time
+
+from esphome import const
+import esphome.api.api_pb2 as pb
+from esphome.api.client import MESSAGE_TYPE_TO_PROTO, APIConnectionError, _varuint_to_bytes
+from esphome.const import CONF_PASSWORD, CONF_PORT
+from esphome.core import EsphomeError
+from esphome.helpers import color, indent, resolve_ip_address
+from esphome.py_compat import text_type
+from esphome.util import safe_print
+
+# pylint: disable=unused-import, wrong-import-order
+from typing import Callable, List, Optional  # noqa
+from google.protobuf import message  # noqa
+
+_LOGGER = logging.getLogger(__name__)
+
+PROTO_TO_MESSAGE_TYPE = {klass: message_type
+                         for message_type, klass in MESSAGE_TYPE_TO_PROTO.items()}
+
+
+def _read_varuint(buf, pos):
+    """Decode the varint at buf[pos:], returns (value, end) or None if it isn't complete."""
+    result = 0
+    bitpos = 0
+    while pos < len(buf):
+        val = buf[pos]
+        pos += 1
+        result |= (val & 0x7F) << bitpos
+        bitpos += 7
+        if (val & 0x80) == 0:
+            return result, pos
+    return None
+
+
+def _then(loop, future, func):
+    """Call func with the result of future, returns a future for what func returns.
+
+    If func returns a future its result is passed on. Exceptions of future and func are
+    set on the returned future.
+    """
+    result = loop.create_future()
+
+    def on_func_done(fut):
+        if result.done():
+            return
+        if fut.cancelled():
+            result.cancel()
+        elif fut.exception() is not None:
+            result.set_exception(fut.exception())
+        else:
+            result.set_result(fut.result())
+
+    def on_done(fut):
+        if result.done():
+            return
+        if fut.cancelled():
+            result.cancel()
+            return
+        if fut.exception() is not None:
+            result.set_exception(fut.exception())
+            return
+        try:
+            value = func(fut.result())
+        except Exception as err:  # pylint: disable=broad-except
+            result.set_exception(err)
+            return
+        if isinstance(value, asyncio.Future):
+            value.add_done_callback(on_func_done)
+        else:
+            result.set_result(value)
+
+    future.add_done_callback(on_done)
+    return result
+
+
+class APIProtocol(asyncio.Protocol):
+    """Splits the received data into frames and passes the messages to the client."""
+
+    def __init__(self, client):
+        self._client = client
+        self._buffer = bytearray()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self._buffer += data
+        buf = self._buffer
+        # Frames are sliced from a view of the buffer, the parsed frames are only removed
+        # from the buffer once at the end
+        view = memoryview(buf)
+        pos = 0
+        try:
+            while pos < len(buf) and self.transport is not None:
+                if buf[pos] != 0x00:
+                    self._client.connection_lost(self, APIConnectionError("Invalid preamble"))
+                    return
+                header = _read_varuint(buf, pos + 1)
+                if header is None:
+                    break
+                length, end = header
+                header = _read_varuint(buf, end)
+                if header is None:
+                    break
+                msg_type, start = header
+                if len(buf) - start < length:
+                    break
+                pos = start + length
+                self._client.handle_frame(msg_type, view[start:pos])
+        finally:
+            view.release()
+        del buf[:pos]
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self._client.connection_lost(self, APIConnectionError("Connection lost: {}".format(exc))
+                                     if exc is not None else None)
+
+
+# pylint: disable=too-many-instance-attributes
+class AsyncAPIClient(object):
+    """Client for the native API of a node, running on an asyncio event loop.
+
+    connect(), login(), ping(), device_info() and disconnect() return futures. The
+    on_connect, on_login and on_disconnect callbacks are called like in APIClient.
+    """
+
+    def __init__(self, address, port, password, loop=None, keepalive=5):
+        self._address = address  # type: str
+        self._port = port  # type: int
+        self._password = password  # type: Optional[str]
+        self._loop = loop or asyncio.get_event_loop()
+        self._protocol = None  # type: Optional[APIProtocol]
+        self._connected = False
+        self._authenticated = False
+        self._message_handlers = []  # type: List[Callable[[message.Message], None]]
+        self._keepalive = keepalive
+        self._keepalive_handle = None
+        self._last_activity = 0
+
+        self.on_disconnect = None
+        self.on_connect = None
+        self.on_login = None
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def connect(self):
+        if self._protocol is not None:
+            raise APIConnectionError("Already connected!")
+
+        # Resolving can block (mDNS), do it in the loop's executor
+        future = self._loop.run_in_executor(None, self._resolve)
+        future = _then(self._loop, future, self._open_connection)
+        future = _then(self._loop, future, self._on_hello)
+        result = self._loop.create_future()
+
+        def on_done(fut):
+            if fut.cancelled():
+                err = APIConnectionError("Timeout connecting to {}".format(self._address))
+            else:
+                err = fut.exception()
+            if err is None:
+                result.set_result(fut.result())
+                return
+            self._close()
+            if not isinstance(err, EsphomeError):
+                err = APIConnectionError("Error connecting to {}: {}".format(self._address, err))
+            result.set_exception(err)
+
+        future.add_done_callback(on_done)
+        return result
+
+    def _resolve(self):
+        try:
+            return resolve_ip_address(self._address)
+        except EsphomeError as err:
+            _LOGGER.warning("Error resolving IP address of %s. Is it connected to WiFi?",
+                            self._address)
+            _LOGGER.warning("(If this error persists, please set a static IP address: "
+                            "https://esphome.io/components/wifi.html#manual-ips)")
+            raise APIConnectionError(err)
+
+    def _open_connection(self, ip):
+        _LOGGER.info("Connecting to %s:%s (%s)", self._address, self._port, ip)
+        future = asyncio.ensure_future(self._loop.create_connection(
+            functools.partial(APIProtocol, self), ip, self._port), loop=self._loop)
+        timeout_handle = self._loop.call_later(10.0, future.cancel)
+        future.add_done_callback(lambda _: timeout_handle.cancel())
+        return _then(self._loop, future, self._send_hello)
+
+    def _send_hello(self, connection):
+        _, self._protocol = connection
+        hello = pb.HelloRequest()
+        hello.client_info = 'ESPHome v{}'.format(const.__version__)
+        return self.send_message_await_response(hello, pb.HelloResponse)
+
+    def _on_hello(self, resp):
+        _LOGGER.debug("Successfully connected to %s ('%s' API=%s.%s)", self._address,
+                      resp.server_info, resp.api_version_major, resp.api_version_minor)
+        self._connected = True
+        self._schedule_keepalive()
+        if self.on_connect is not None:
+            self.on_connect()
+        return resp
+
+    def _check_connected(self):
+        if not self._connected:
+            raise APIConnectionError("Must be connected!")
+
+    def login(self):
+        self._check_connected()
+        if self._authenticated:
+            raise APIConnectionError("Already logged in!")
+
+        connect = pb.ConnectRequest()
+        if self._password is not None:
+            connect.password = self._password
+        future = _then(self._loop, self.send_message_await_response(connect, pb.ConnectResponse),
+                       self._on_login)
+
+        def on_done(fut):
+            # A cancelled login leaves the connection in an unknown state too
+            if fut.cancelled() or fut.exception() is not None:
+                self._close()
+
+        future.add_done_callback(on_done)
+        return future
+
+    def _on_login(self, resp):
+        if resp.invalid_password:
+            raise APIConnectionError("Invalid password!")
+        self._authenticated = True
+        if self.on_login is not None:
+            self.on_login()
+        return resp
+
+    def _close(self):
+        if self._keepalive_handle is not None:
+            self._keepalive_handle.cancel()
+            self._keepalive_handle = None
+        if self._protocol is not None:
+            protocol, self._protocol = self._protocol, None
+            if protocol.transport is not None:
+                protocol.transport.close()
+                protocol.transport = None
+        self._connected = False
+        self._authenticated = False
+        self._message_handlers = []
+
+    def connection_lost(self, protocol, err):
+        """Called by the protocol if the connection was lost, err is None if it was closed."""
+        if protocol is self._protocol:
+            self._fatal_error(err)
+
+    def _fatal_error(self, err):
+        was_connected = self._connected
+        if err is not None:
+            _LOGGER.debug("Closing connection to %s: %s", self._address, err)
+        # Requests that are still waiting for a response fail right away
+        handlers = self._message_handlers
+        self._close()
+        for handler in handlers:
+            handler(None)
+        if was_connected and self.on_disconnect is not None:
+            self.on_disconnect()
+
+    def disconnect(self):
+        self._check_connected()
+
+        future = self.send_message_await_response(pb.DisconnectRequest(), pb.DisconnectResponse)
+
+        def on_done(fut):
+            if not fut.cancelled():
+                # Consume the exception, a missing response doesn't matter here
+                fut.exception()
+            was_connected = self._connected
+            self._close()
+            if was_connected and self.on_disconnect is not None:
+                self.on_disconnect()
+
+        future.add_done_callback(on_done)
+        return future
+
+    def send_message(self, msg):
+        # type: (message.Message) -> None
+        if self._protocol is None or self._protocol.transport is None:
+            raise APIConnectionError("Socket closed")
+        message_type = PROTO_TO_MESSAGE_TYPE.get(type(msg))
+        if message_type is None:
+            raise ValueError
+
+        encoded = msg.SerializeToString()
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Sending %s:\n%s", type(msg), indent(text_type(msg)))
+        self._protocol.transport.write(b''.join([
+            b'\x00', _varuint_to_bytes(len(encoded)), _varuint_to_bytes(message_type), encoded
+        ]))
+        self._last_activity = self._loop.time()
+
+    def send_message_await_response_complex(self, send_msg, do_append, do_stop, timeout=1):
+        """Send a message and collect the responses.
+
+        Returns a future for the list of messages do_append accepted, it is resolved when
+        do_stop returns True for a message.
+        """
+        future = self._loop.create_future()
+        responses = []
+
+        def on_message(msg):
+            if future.done():
+                return
+            if msg is None:
+                future.set_exception(APIConnectionError("Connection closed"))
+                return
+            if do_append(msg):
+                responses.append(msg)
+            if do_stop(msg):
+                future.set_result(responses)
+
+        def on_timeout():
+            if not future.done():
+                future.set_exception(
+                    APIConnectionError("Timeout while waiting for message response!"))
+
+        def on_done(_):
+            timeout_handle.cancel()
+            try:
+                self._message_handlers.remove(on_message)
+            except ValueError:
+                pass
+
+        self._message_handlers.append(on_message)
+        timeout_handle = self._loop.call_later(timeout, on_timeout)
+        future.add_done_callback(on_done)
+        try:
+            self.send_message(send_msg)
+        except APIConnectionError as err:
+            future.set_exception(err)
+        return future
+
+    def send_message_await_response(self, send_msg, response_type, timeout=1):
+        def is_response(msg):
+            return isinstance(msg, response_type)
+
+        future = self.send_message_await_response_complex(send_msg, is_response, is_response,
+                                                          timeout)
+        return _then(self._loop, future, lambda responses: responses[0])
+
+    def device_info(self):
+        self._check_connected()
+        return self.send_message_await_response(pb.DeviceInfoRequest(), pb.DeviceInfoResponse)
+
+    def ping(self):
+        self._check_connected()
+        return self.send_message_await_response(pb.PingRequest(), pb.PingResponse)
+
+    def subscribe_logs(self, on_log, log_level=None, dump_config=False):
+        if not self._authenticated:
+            raise APIConnectionError("Must login first!")
+
+        def on_msg(msg):
+            if isinstance(msg, pb.SubscribeLogsResponse):
+                on_log(msg)
+
+        self._message_handlers.append(on_msg)
+        req = pb.SubscribeLogsRequest(dump_config=dump_config)
+        if log_level is not None:
+            req.level = log_level
+        self.send_message(req)
+
+    def _schedule_keepalive(self):
+        # A single timer, it is only moved when it fires instead of for every message
+        delay = self._last_activity + self._keepalive - self._loop.time()
+        self._keepalive_handle = self._loop.call_later(max(delay, 0), self._on_keepalive)
+
+    def _on_keepalive(self):
+        self._keepalive_handle = None
+        if not self._connected:
+            return
+        if self._loop.time() - self._last_activity < self._keepalive:
+            self._schedule_keepalive()
+            return
+
+        def on_pong(fut):
+            if fut.cancelled() or fut.exception() is not None:
+                self._fatal_error(APIConnectionError("Ping failed"))
+            elif self._connected:
+                self._schedule_keepalive()
+
+        self.ping().add_done_callback(on_pong)
+
+    def handle_frame(self, msg_type, raw_msg):
+        self._last_activity = self._loop.time()
+        klass = MESSAGE_TYPE_TO_PROTO.get(msg_type)
+        if klass is None:
+            _LOGGER.debug("Skipping message type %s", msg_type)
+            return
+
+        msg = klass()
+        msg.ParseFromString(raw_msg.tobytes())
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug("Got message: %s:\n%s", type(msg), indent(str(msg)))
+        for msg_handler in self._message_handlers[:]:
+            msg_handler(msg)
+        self._handle_internal_messages(msg)
+
+    def _handle_internal_messages(self, msg):
+        if isinstance(msg, pb.DisconnectRequest):
+            self.send_message(pb.DisconnectResponse())
+            self._fatal_error(None)
+        elif isinstance(msg, pb.PingRequest):
+            self.send_message(pb.PingResponse())
+        elif isinstance(msg, pb.GetTimeRequest):
+            resp = pb.GetTimeResponse()
+            resp.epoch_seconds = int(time.time())
+            self.send_message(resp)
+
+
+def run_logs(config, address):
+    conf = config['api']
+    port = conf[CONF_PORT]
+    password = conf[CONF_PASSWORD]
+    _LOGGER.info("Starting log output from %s using esphome API", address)
+
+    loop = asyncio.get_event_loop()
+    cli = AsyncAPIClient(address, port, password, loop=loop)
+    state = {'stopping': False, 'has_connects': False, 'retry': None}
+
+    def try_connect(tries=0, is_disconnect=True):
+        state['retry'] = None
+        if state['stopping']:
+            return
+        if is_disconnect:
+            _LOGGER.warning(u"Disconnected from API.")
+
+        def on_done(fut):
+            if fut.cancelled():
+                error = APIConnectionError("Connecting was cancelled")
+            else:
+                error = fut.exception()
+            if error is None:
+                _LOGGER.info("Successfully connected to %s", address)
+                return
+            wait_time = min(2**tries, 300)
+            if not state['has_connects']:
+                _LOGGER.warning(u"Initial connection failed. The ESP might not be connected "
+                                u"to WiFi yet (%s). Re-Trying in %s seconds",
+                                error, wait_time)
+            else:
+                _LOGGER.warning(u"Couldn't connect to API (%s). Trying to reconnect in %s "
+                                u"seconds", error, wait_time)
+            state['retry'] = loop.call_later(wait_time, try_connect, tries + 1, is_disconnect)
+
+        try:
+            future = _then(loop, cli.connect(), lambda _: cli.login())
+        except (APIConnectionError, EsphomeError) as err:
+            future = loop.create_future()
+            future.set_exception(err)
+        future.add_done_callback(on_done)
+
+    def on_log(msg):
+        time_ = datetime.now().time().strftime(u'[%H:%M:%S]')
+        text = msg.message
+        if msg.send_failed:
+            text = color('white', '(Message skipped because it was too big to fit in '
+                                  'TCP buffer - This is only cosmetic)')
+        safe_print(time_ + text)
+
+    def on_login():
+        cli.subscribe_logs(on_log, dump_config=not state['has_connects'])
+        state['has_connects'] = True
+
+    cli.on_disconnect = try_connect
+    cli.on_login = on_login
+
+    try:
+        loop.call_soon(try_connect, 0, False)
+        loop.run_forever()
+    except KeyboardInterrupt:
+        state['stopping'] = True
+        if state['retry'] is not None:
+            state['retry'].cancel()
+        if cli.connected:
+            try:
+                loop.run_until_complete(cli.disconnect())
+            except APIConnectionError:
+                pass
+    return 0
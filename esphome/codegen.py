@@ -10,7 +10,7 @@
 # pylint: disable=unused-import
 from esphome.cpp_generator import (  # noqa
     Expression, RawExpression, TemplateArguments,
-    StructInitializer, ArrayInitializer, safe_exp, Statement,
+    StructInitializer, ArrayInitializer, IntArrayInitializer, safe_exp, Statement,
     progmem_array, statement, variable, Pvariable, new_Pvariable,
     add, add_global, add_library, add_build_flag, add_define,
     get_variable, process_lambda, is_template, templatable, MockObj,
@@ -1,15 +1,23 @@
 # coding=utf-8
-from esphome import core
+import binascii
+import codecs
+import hashlib
+import json
+import logging
+
 from esphome.components import display
 import esphome.config_validation as cv
 import esphome.codegen as cg
 from esphome.const import CONF_FILE, CONF_GLYPHS, CONF_ID, CONF_SIZE
-from esphome.core import CORE, HexInt
+from esphome.core import CORE, EsphomeError
+from esphome.helpers import write_file
 from esphome.py_compat import sort_by_cmp
 
 DEPENDENCIES = ['display']
 MULTI_CONF = True
 
+_LOGGER = logging.getLogger(__name__)
+
 Font = display.display_ns.class_('Font')
 Glyph = display.display_ns.class_('Glyph')
 
@@ -46,7 +54,7 @@ def validate_pillow_installed(value):
         raise cv.Invalid("Please install the pillow python package to use this feature. "
                          "(pip install pillow)")
 
-    if PIL.__version__[0] < '4':
+    if int(PIL.__version__.split('.')[0]) < 4:
         raise cv.Invalid("Please update your pillow installation to at least 4.0.x. "
                          "(pip install -U pillow)")
 
@@ -77,36 +85,88 @@ FONT_SCHEMA = cv.Schema({
 CONFIG_SCHEMA = cv.All(validate_pillow_installed, FONT_SCHEMA)
 
 
-def to_code(config):
-    from PIL import ImageFont
+FONT_CACHE_VERSION = 1
+
+
+def _font_cache_path(path, config):
+    import PIL
+
+    key = hashlib.sha256()
+    with open(path, 'rb') as f_handle:
+        key.update(f_handle.read())
+    key.update(u'\0'.join([str(FONT_CACHE_VERSION), PIL.__version__, str(config[CONF_SIZE])] +
+                          config[CONF_GLYPHS]).encode('utf-8'))
+    return CORE.relative_path('.esphome', 'font_cache', u'{}.json'.format(key.hexdigest()))
+
+
+def _load_font_cache(cache_path):
+    try:
+        with codecs.open(cache_path, 'r', encoding='utf-8') as f_handle:
+            cached = json.load(f_handle)
+        return (cached['ascent'], cached['descent'], cached['glyphs'],
+                bytearray(binascii.unhexlify(cached['data'])))
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _save_font_cache(cache_path, ascent, descent, glyph_args, data):
+    content = json.dumps({
+        'ascent': ascent,
+        'descent': descent,
+        'glyphs': glyph_args,
+        'data': binascii.hexlify(data).decode('ascii'),
+    })
+    try:
+        write_file(cache_path, content)
+    except EsphomeError as err:
+        _LOGGER.debug(u"Could not write font cache: %s", err)
+
+
+def _rasterize_font(path, config):
+    from PIL import Image, ImageFont
 
-    path = CORE.relative_path(config[CONF_FILE])
     try:
         font = ImageFont.truetype(path, config[CONF_SIZE])
     except Exception as e:
-        raise core.EsphomeError(u"Could not load truetype file {}: {}".format(path, e))
+        raise EsphomeError(u"Could not load truetype file {}: {}".format(path, e))
 
     ascent, descent = font.getmetrics()
 
+    # Every pixel that is not zero is set
+    table = [0] + [255] * 255
     glyph_args = {}
-    data = []
+    data = bytearray()
     for glyph in config[CONF_GLYPHS]:
         mask = font.getmask(glyph, mode='1')
         _, (offset_x, offset_y) = font.font.getsize(glyph)
         width, height = mask.size
-        width8 = ((width + 7) // 8) * 8
-        glyph_data = [0 for _ in range(height * width8 // 8)]  # noqa: F812
-        for y in range(height):
-            for x in range(width):
-                if not mask.getpixel((x, y)):
-                    continue
-                pos = x + y * width8
-                glyph_data[pos // 8] |= 0x80 >> (pos % 8)
+        # Packing a mode 1 image gives each row MSB first and padded to a full byte. The mask
+        # goes through bytearray() because Python 2's bytes() would be its str()
+        image = Image.frombytes('L', mask.size, bytes(bytearray(mask)))
+        glyph_data = image.point(table, '1').tobytes()
         glyph_args[glyph] = (len(data), offset_x, offset_y, width, height)
         data += glyph_data
+    return ascent, descent, glyph_args, data
+
+
+def get_font_data(config):
+    """Rasterize the glyphs, or load them from the cache if the font, size and glyphs match.
 
-    rhs = [HexInt(x) for x in data]
-    prog_arr = cg.progmem_array(config[CONF_RAW_DATA_ID], rhs)
+    Returns the ascent, descent, the glyph data arguments by glyph and the packed bitmaps.
+    """
+    path = CORE.relative_path(config[CONF_FILE])
+    cache_path = _font_cache_path(path, config)
+    cached = _load_font_cache(cache_path)
+    if cached is not None:
+        return cached
+    ascent, descent, glyph_args, data = _rasterize_font(path, config)
+    _save_font_cache(cache_path, ascent, descent, glyph_args, data)
+    return ascent, descent, glyph_args, data
+
+
+def to_code(config):
+    ascent, descent, glyph_args, data = get_font_data(config)
+    prog_arr = cg.progmem_array(config[CONF_RAW_DATA_ID], data)
 
     glyphs = []
     for glyph in config[CONF_GLYPHS]:
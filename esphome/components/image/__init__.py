@@ -1,57 +1,156 @@
 # coding=utf-8
+import binascii
+import codecs
+import hashlib
+import json
 import logging
 
-from esphome import core
 from esphome.components import display, font
 import esphome.config_validation as cv
 import esphome.codegen as cg
-from esphome.const import CONF_FILE, CONF_ID, CONF_RESIZE
-from esphome.core import CORE, HexInt
+from esphome.const import CONF_FILE, CONF_ID, CONF_RESIZE, CONF_TYPE
+from esphome.core import CORE, EsphomeError
+from esphome.helpers import write_file
 _LOGGER = logging.getLogger(__name__)
 
 DEPENDENCIES = ['display']
 MULTI_CONF = True
 
 Image_ = display.display_ns.class_('Image')
+ImageType = display.display_ns.enum('ImageType')
+IMAGE_TYPE = {
+    'BINARY': ImageType.IMAGE_TYPE_BINARY,
+    'GRAYSCALE4': ImageType.IMAGE_TYPE_GRAYSCALE4,
+    'GRAYSCALE': ImageType.IMAGE_TYPE_GRAYSCALE,
+    'RGB565': ImageType.IMAGE_TYPE_RGB565,
+}
 
 CONF_RAW_DATA_ID = 'raw_data_id'
+CONF_DITHER = 'dither'
 
 IMAGE_SCHEMA = cv.Schema({
     cv.Required(CONF_ID): cv.declare_variable_id(Image_),
     cv.Required(CONF_FILE): cv.file_,
     cv.Optional(CONF_RESIZE): cv.dimensions,
+    cv.Optional(CONF_TYPE, default='BINARY'): cv.one_of(*IMAGE_TYPE, upper=True),
+    cv.Optional(CONF_DITHER, default='NONE'): cv.one_of('NONE', 'FLOYDSTEINBERG', upper=True),
     cv.GenerateID(CONF_RAW_DATA_ID): cv.declare_variable_id(cg.uint8),
 })
 
 CONFIG_SCHEMA = cv.All(font.validate_pillow_installed, IMAGE_SCHEMA)
 
+IMAGE_CACHE_VERSION = 1
 
-def to_code(config):
+
+def _image_cache_path(path, config):
+    import PIL
+
+    key = hashlib.sha256()
+    with open(path, 'rb') as f_handle:
+        key.update(f_handle.read())
+    key.update(u'\0'.join([str(IMAGE_CACHE_VERSION), PIL.__version__,
+                           str(config.get(CONF_RESIZE)), config[CONF_TYPE],
+                           config[CONF_DITHER]]).encode('utf-8'))
+    return CORE.relative_path('.esphome', 'image_cache', u'{}.json'.format(key.hexdigest()))
+
+
+def _load_image_cache(cache_path):
+    try:
+        with codecs.open(cache_path, 'r', encoding='utf-8') as f_handle:
+            cached = json.load(f_handle)
+        return cached['width'], cached['height'], bytearray(binascii.unhexlify(cached['data']))
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def _save_image_cache(cache_path, width, height, data):
+    content = json.dumps({
+        'width': width,
+        'height': height,
+        'data': binascii.hexlify(data).decode('ascii'),
+    })
+    try:
+        write_file(cache_path, content)
+    except EsphomeError as err:
+        _LOGGER.debug(u"Could not write image cache: %s", err)
+
+
+def _convert_binary(image, dither):
+    from PIL import Image, ImageChops
+
+    dither = Image.FLOYDSTEINBERG if dither == 'FLOYDSTEINBERG' else Image.NONE
+    image = image.convert('1', dither=dither)
+    # Black pixels are set. Packing a mode 1 image gives each row MSB first and padded
+    # to a full byte.
+    return ImageChops.invert(image).tobytes()
+
+
+def _convert_grayscale4(image):
+    from PIL import Image, ImageChops
+
+    data = image.convert('L').tobytes()
+    if len(data) % 2:
+        data += b'\0'
+    # Two pixels per byte, the first one in the high nibble
+    size = (len(data) // 2, 1)
+    high = Image.frombytes('L', size, data[0::2]).point(lambda x: x & 0xF0)
+    low = Image.frombytes('L', size, data[1::2]).point(lambda x: x >> 4)
+    return ImageChops.add(high, low).tobytes()
+
+
+def _convert_rgb565(image):
+    from PIL import Image, ImageChops
+
+    red, green, blue = image.convert('RGB').split()
+    # Big endian RRRRRGGG GGGBBBBB
+    high = ImageChops.add(red.point(lambda x: x & 0xF8), green.point(lambda x: x >> 5))
+    low = ImageChops.add(green.point(lambda x: (x << 3) & 0xE0), blue.point(lambda x: x >> 3))
+    return Image.merge('LA', (high, low)).tobytes()
+
+
+def _convert_image(path, config):
     from PIL import Image
 
-    path = CORE.relative_path(config[CONF_FILE])
     try:
         image = Image.open(path)
     except Exception as e:
-        raise core.EsphomeError(u"Could not load image file {}: {}".format(path, e))
+        raise EsphomeError(u"Could not load image file {}: {}".format(path, e))
 
     if CONF_RESIZE in config:
         image.thumbnail(config[CONF_RESIZE])
 
-    image = image.convert('1', dither=Image.NONE)
     width, height = image.size
     if width > 500 or height > 500:
         _LOGGER.warning("The image you requested is very big. Please consider using the resize "
                         "parameter")
-    width8 = ((width + 7) // 8) * 8
-    data = [0 for _ in range(height * width8 // 8)]
-    for y in range(height):
-        for x in range(width):
-            if image.getpixel((x, y)):
-                continue
-            pos = x + y * width8
-            data[pos // 8] |= 0x80 >> (pos % 8)
-
-    rhs = [HexInt(x) for x in data]
-    prog_arr = cg.progmem_array(config[CONF_RAW_DATA_ID], rhs)
-    cg.new_Pvariable(config[CONF_ID], prog_arr, width, height)
+    image_type = config[CONF_TYPE]
+    if image_type == 'GRAYSCALE4':
+        data = _convert_grayscale4(image)
+    elif image_type == 'GRAYSCALE':
+        data = image.convert('L').tobytes()
+    elif image_type == 'RGB565':
+        data = _convert_rgb565(image)
+    else:
+        data = _convert_binary(image, config[CONF_DITHER])
+    return width, height, bytearray(data)
+
+
+def get_image_data(config):
+    """Convert the image, or load it from the cache if the file and options match.
+
+    Returns the width, height and the packed pixel data.
+    """
+    path = CORE.relative_path(config[CONF_FILE])
+    cache_path = _image_cache_path(path, config)
+    cached = _load_image_cache(cache_path)
+    if cached is not None:
+        return cached
+    width, height, data = _convert_image(path, config)
+    _save_image_cache(cache_path, width, height, data)
+    return width, height, data
+
+
+def to_code(config):
+    width, height, data = get_image_data(config)
+    prog_arr = cg.progmem_array(config[CONF_RAW_DATA_ID], data)
+    cg.new_Pvariable(config[CONF_ID], prog_arr, width, height, IMAGE_TYPE[config[CONF_TYPE]])
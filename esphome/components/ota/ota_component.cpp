@@ -10,6 +10,8 @@
 #include <MD5Builder.h>
 #ifdef ARDUINO_ARCH_ESP32
 #include <Update.h>
+#include <esp_ota_ops.h>
+#include <esp_partition.h>
 #endif
 #include <StreamString.h>
 
@@ -20,6 +22,38 @@ static const char *TAG = "ota";
 
 uint8_t OTA_VERSION_1_0 = 1;
 
+/// Read up to 256 bytes of the firmware that is currently running.
+static bool read_running_firmware(uint32_t offset, uint8_t *data, size_t len) {
+#ifdef ARDUINO_ARCH_ESP8266
+  // The sketch starts at the beginning of the flash, reads have to be 4 byte aligned
+  uint32_t words[66];
+  uint32_t start = offset & ~3u;
+  uint32_t end = (offset + len + 3) & ~3u;
+  if (!ESP.flashRead(start, words, end - start))
+    return false;
+  memcpy(data, reinterpret_cast<uint8_t *>(words) + (offset - start), len);
+  return true;
+#endif
+#ifdef ARDUINO_ARCH_ESP32
+  return esp_partition_read(esp_ota_get_running_partition(), offset, data, len) == ESP_OK;
+#endif
+}
+
+/// Decode 4 bytes MSB first.
+static uint32_t decode_uint32(const uint8_t *data) {
+  return (uint32_t(data[0]) << 24) | (uint32_t(data[1]) << 16) | (uint32_t(data[2]) << 8) | uint32_t(data[3]);
+}
+
+/// The size of the flash area the running firmware can be read from.
+static uint32_t running_firmware_size() {
+#ifdef ARDUINO_ARCH_ESP8266
+  return ESP.getSketchSize();
+#endif
+#ifdef ARDUINO_ARCH_ESP32
+  return esp_ota_get_running_partition()->size;
+#endif
+}
+
 void OTAComponent::setup() {
   this->server_ = new WiFiServer(this->port_);
   this->server_->begin();
@@ -58,7 +92,13 @@ void OTAComponent::handle_() {
   char *sbuf = reinterpret_cast<char *>(buf);
   uint32_t ota_size;
   uint8_t ota_features;
-  (void) ota_features;
+  bool compressed = false;
+  bool delta = false;
+  uint32_t base_size = 0;
+  OTADeltaPatcher *patcher = nullptr;
+#ifdef ARDUINO_ARCH_ESP32
+  OTADecompressor *decompressor = nullptr;
+#endif
 
   if (!this->client_.connected()) {
     this->client_ = this->server_->available();
@@ -96,9 +136,20 @@ void OTAComponent::handle_() {
   }
   ota_features = buf[0];  // NOLINT
   ESP_LOGV(TAG, "OTA features is 0x%02X", ota_features);
+#ifdef ARDUINO_ARCH_ESP32
+  // Decompression uses the inflater in the ESP32 ROM, the ESP8266 only accepts uncompressed uploads
+  compressed = ota_features & FEATURE_SUPPORTS_COMPRESSION;
+#endif
+  delta = ota_features & FEATURE_SUPPORTS_DELTA;
 
   // Acknowledge header - 1 byte
-  this->client_.write(OTA_RESPONSE_HEADER_OK);
+  if (compressed && delta) {
+    this->client_.write(OTA_RESPONSE_SUPPORTS_COMPRESSION_AND_DELTA);
+  } else if (delta) {
+    this->client_.write(OTA_RESPONSE_SUPPORTS_DELTA);
+  } else {
+    this->client_.write(compressed ? OTA_RESPONSE_SUPPORTS_COMPRESSION : OTA_RESPONSE_HEADER_OK);
+  }
 
   if (!this->password_.empty()) {
     this->client_.write(OTA_RESPONSE_REQUEST_AUTH);
@@ -159,6 +210,37 @@ void OTAComponent::handle_() {
   // Acknowledge auth OK - 1 byte
   this->client_.write(OTA_RESPONSE_AUTH_OK);
 
+  if (delta) {
+    // Read size of the client's base firmware, 4 bytes MSB first
+    if (!this->wait_receive_(buf, 4)) {
+      ESP_LOGW(TAG, "Reading base size failed!");
+      goto error;
+    }
+    base_size = 0;
+    for (uint8_t i = 0; i < 4; i++) {
+      base_size <<= 8;
+      base_size |= buf[i];
+    }
+
+    // Send MD5 of the running firmware over that size, 32 bytes hex. All zeros if it can't be computed, the client
+    // then sends the full firmware.
+    if (!this->firmware_md5_(base_size, sbuf)) {
+      memset(sbuf, '0', 32);
+    }
+    ESP_LOGV(TAG, "Delta: Running firmware MD5 is %.32s", sbuf);
+    if (this->client_.write(buf, 32) != 32) {
+      ESP_LOGW(TAG, "Delta: Writing firmware MD5 failed!");
+      goto error;
+    }
+
+    // Read mode - 1 byte
+    if (!this->wait_receive_(buf, 1)) {
+      ESP_LOGW(TAG, "Reading delta mode failed!");
+      goto error;
+    }
+    delta = buf[0] == OTA_DELTA_MODE_PATCH;
+  }
+
   // Read size, 4 bytes MSB first
   if (!this->wait_receive_(buf, 4)) {
     ESP_LOGW(TAG, "Reading size failed!");
@@ -223,27 +305,76 @@ void OTAComponent::handle_() {
   // Acknowledge MD5 OK - 1 byte
   this->client_.write(OTA_RESPONSE_BIN_MD5_OK);
 
+  if (delta) {
+    ESP_LOGD(TAG, "Receiving patch against the running firmware");
+    patcher = new OTADeltaPatcher(base_size);
+  }
+#ifdef ARDUINO_ARCH_ESP32
+  if (compressed) {
+    ESP_LOGD(TAG, "Receiving compressed firmware");
+    if (delta) {
+      decompressor = new OTADecompressor([patcher](uint8_t *data, size_t len) { return patcher->write(data, len); });
+    } else {
+      decompressor = new OTADecompressor([](uint8_t *data, size_t len) { return Update.write(data, len) == len; });
+    }
+  }
+#endif
+
+  // The size and MD5 are the ones of the new firmware, a compressed upload ends with the zlib stream and a patch
+  // ends when it has produced the whole firmware
+#ifdef ARDUINO_ARCH_ESP32
+  while (compressed ? !decompressor->is_done() : !Update.isFinished()) {
+#else
   while (!Update.isFinished()) {
+#endif
     size_t available = this->wait_receive_(buf, 0);
     if (!available) {
       goto error;
     }
 
-    uint32_t written = Update.write(buf, available);
-    if (written != available) {
-      ESP_LOGW(TAG, "Error writing binary data to flash: %u != %u!", written, available);  // NOLINT
-      error_code = OTA_RESPONSE_ERROR_WRITING_FLASH;
-      goto error;
+#ifdef ARDUINO_ARCH_ESP32
+    if (compressed) {
+      if (!decompressor->write(buf, available)) {
+        ESP_LOGW(TAG, "Error decompressing binary data or writing it to flash!");
+        error_code = OTA_RESPONSE_ERROR_WRITING_FLASH;
+        goto error;
+      }
+      total += available;
+    } else
+#endif
+    if (delta) {
+      if (!patcher->write(buf, available)) {
+        ESP_LOGW(TAG, "Error applying patch or writing it to flash!");
+        error_code = OTA_RESPONSE_ERROR_WRITING_FLASH;
+        goto error;
+      }
+      total += available;
+    } else {
+      uint32_t written = Update.write(buf, available);
+      if (written != available) {
+        ESP_LOGW(TAG, "Error writing binary data to flash: %u != %u!", written, available);  // NOLINT
+        error_code = OTA_RESPONSE_ERROR_WRITING_FLASH;
+        goto error;
+      }
+      total += written;
     }
-    total += written;
 
     uint32_t now = millis();
     if (now - last_progress > 1000) {
       last_progress = now;
-      float percentage = (total * 100.0f) / ota_size;
+      float percentage = (Update.progress() * 100.0f) / ota_size;
       ESP_LOGD(TAG, "OTA in progress: %0.1f%%", percentage);
     }
   }
+  if (compressed || delta) {
+    ESP_LOGD(TAG, "Received %u bytes for %u bytes of firmware", total, ota_size);  // NOLINT
+  }
+#ifdef ARDUINO_ARCH_ESP32
+  delete decompressor;
+  decompressor = nullptr;
+#endif
+  delete patcher;
+  patcher = nullptr;
 
   // Acknowledge receive OK - 1 byte
   this->client_.write(OTA_RESPONSE_RECEIVE_OK);
@@ -271,6 +402,10 @@ void OTAComponent::handle_() {
   App.safe_reboot();
 
 error:
+#ifdef ARDUINO_ARCH_ESP32
+  delete decompressor;
+#endif
+  delete patcher;
   if (update_started) {
     StreamString ss;
     Update.printError(ss);
@@ -349,6 +484,111 @@ size_t OTAComponent::wait_receive_(uint8_t *buf, size_t bytes, bool check_discon
   return bytes;
 }
 
+bool OTAComponent::firmware_md5_(uint32_t size, char *md5) {
+  if (size == 0 || size > running_firmware_size())
+    return false;
+  uint8_t buf[256];
+  MD5Builder md5_builder{};
+  md5_builder.begin();
+  for (uint32_t offset = 0; offset < size; offset += sizeof(buf)) {
+    size_t len = std::min(size - offset, uint32_t(sizeof(buf)));
+    if (!read_running_firmware(offset, buf, len))
+      return false;
+    md5_builder.add(buf, len);
+    App.feed_wdt();
+  }
+  md5_builder.calculate();
+  md5_builder.getChars(md5);
+  return true;
+}
+
+OTADeltaPatcher::OTADeltaPatcher(uint32_t base_size) : base_size_(base_size) {}
+bool OTADeltaPatcher::write(uint8_t *data, size_t len) {
+  while (len > 0) {
+    if (this->insert_remaining_ > 0) {
+      size_t n = std::min(len, size_t(this->insert_remaining_));
+      if (Update.write(data, n) != n)
+        return false;
+      data += n;
+      len -= n;
+      this->insert_remaining_ -= n;
+      continue;
+    }
+
+    this->op_[this->op_len_++] = *data++;
+    len--;
+    uint8_t op_size;
+    if (this->op_[0] == OTA_DELTA_OP_COPY) {
+      op_size = 9;
+    } else if (this->op_[0] == OTA_DELTA_OP_INSERT) {
+      op_size = 5;
+    } else {
+      ESP_LOGW(TAG, "Delta: Unknown operation 0x%02X!", this->op_[0]);
+      return false;
+    }
+    if (this->op_len_ < op_size)
+      continue;
+    this->op_len_ = 0;
+
+    uint32_t value = decode_uint32(this->op_ + 1);
+    if (this->op_[0] == OTA_DELTA_OP_INSERT) {
+      this->insert_remaining_ = value;
+    } else if (!this->copy_(value, decode_uint32(this->op_ + 5))) {
+      return false;
+    }
+  }
+  return true;
+}
+bool OTADeltaPatcher::copy_(uint32_t offset, uint32_t len) {
+  if (offset > this->base_size_ || len > this->base_size_ - offset) {
+    ESP_LOGW(TAG, "Delta: Copy of %u bytes at 0x%08X is out of range!", len, offset);  // NOLINT
+    return false;
+  }
+  uint8_t buf[256];
+  while (len > 0) {
+    size_t n = std::min(len, uint32_t(sizeof(buf)));
+    if (!read_running_firmware(offset, buf, n) || Update.write(buf, n) != n)
+      return false;
+    offset += n;
+    len -= n;
+    App.feed_wdt();
+  }
+  return true;
+}
+
+#ifdef ARDUINO_ARCH_ESP32
+OTADecompressor::OTADecompressor(std::function<bool(uint8_t *, size_t)> &&writer)
+    : writer_(std::move(writer)), dict_(new uint8_t[TINFL_LZ_DICT_SIZE]) {
+  tinfl_init(&this->decompressor_);
+}
+OTADecompressor::~OTADecompressor() { delete[] this->dict_; }
+bool OTADecompressor::write(const uint8_t *data, size_t len) {
+  while (!this->done_) {
+    size_t in_bytes = len;
+    size_t out_bytes = TINFL_LZ_DICT_SIZE - this->dict_offset_;
+    tinfl_status status = tinfl_decompress(&this->decompressor_, data, &in_bytes, this->dict_,
+                                           this->dict_ + this->dict_offset_, &out_bytes,
+                                           TINFL_FLAG_HAS_MORE_INPUT | TINFL_FLAG_PARSE_ZLIB_HEADER);
+    data += in_bytes;
+    len -= in_bytes;
+    if (out_bytes > 0) {
+      if (!this->writer_(this->dict_ + this->dict_offset_, out_bytes))
+        return false;
+      // The output buffer wraps around, it has to be a power of two
+      this->dict_offset_ = (this->dict_offset_ + out_bytes) & (TINFL_LZ_DICT_SIZE - 1);
+    }
+    if (status < TINFL_STATUS_DONE)
+      return false;
+    if (status == TINFL_STATUS_DONE)
+      this->done_ = true;
+    else if (status == TINFL_STATUS_NEEDS_MORE_INPUT && len == 0)
+      break;
+  }
+  return true;
+}
+bool OTADecompressor::is_done() const { return this->done_; }
+#endif
+
 OTAComponent::OTAComponent(uint16_t port) : port_(port) {}
 
 void OTAComponent::set_auth_password(const std::string &password) { this->password_ = password; }
@@ -4,6 +4,10 @@
 #include "esphome/core/preferences.h"
 #include <WiFiServer.h>
 #include <WiFiClient.h>
+#include <functional>
+#ifdef ARDUINO_ARCH_ESP32
+#include <rom/miniz.h>
+#endif
 
 namespace esphome {
 namespace ota {
@@ -18,6 +22,9 @@ enum OTAResponseTypes {
   OTA_RESPONSE_BIN_MD5_OK = 67,
   OTA_RESPONSE_RECEIVE_OK = 68,
   OTA_RESPONSE_UPDATE_END_OK = 69,
+  OTA_RESPONSE_SUPPORTS_COMPRESSION = 70,
+  OTA_RESPONSE_SUPPORTS_DELTA = 71,
+  OTA_RESPONSE_SUPPORTS_COMPRESSION_AND_DELTA = 72,
 
   OTA_RESPONSE_ERROR_MAGIC = 128,
   OTA_RESPONSE_ERROR_UPDATE_PREPARE = 129,
@@ -32,6 +39,65 @@ enum OTAResponseTypes {
   OTA_RESPONSE_ERROR_UNKNOWN = 255,
 };
 
+enum OTAFeatures {
+  /// The client can send the firmware as a zlib stream.
+  FEATURE_SUPPORTS_COMPRESSION = 0x01,
+  /// The client can send a patch against the firmware the device is running.
+  FEATURE_SUPPORTS_DELTA = 0x02,
+};
+
+enum OTADeltaMode {
+  OTA_DELTA_MODE_FULL = 0,
+  OTA_DELTA_MODE_PATCH = 1,
+};
+
+enum OTADeltaOps {
+  /// Copy a range of the running firmware: 4 bytes offset, 4 bytes length, MSB first.
+  OTA_DELTA_OP_COPY = 0x01,
+  /// Insert bytes: 4 bytes length MSB first, followed by the bytes.
+  OTA_DELTA_OP_INSERT = 0x02,
+};
+
+/// Rebuilds the new firmware from a patch against the running firmware and writes it to the update partition.
+class OTADeltaPatcher {
+ public:
+  explicit OTADeltaPatcher(uint32_t base_size);
+
+  /// Apply the next part of the patch, false on errors.
+  bool write(uint8_t *data, size_t len);
+
+ protected:
+  bool copy_(uint32_t offset, uint32_t len);
+
+  uint32_t base_size_;
+  uint8_t op_[9];
+  uint8_t op_len_{0};
+  uint32_t insert_remaining_{0};
+};
+
+#ifdef ARDUINO_ARCH_ESP32
+/// Inflates a zlib compressed firmware while it is received.
+class OTADecompressor {
+ public:
+  /// The decompressed data is passed to writer, which writes it to flash.
+  explicit OTADecompressor(std::function<bool(uint8_t *, size_t)> &&writer);
+  ~OTADecompressor();
+
+  /// Decompress the next part of the stream and write it, false on errors.
+  bool write(const uint8_t *data, size_t len);
+  /// Whether the end of the compressed stream was reached.
+  bool is_done() const;
+
+ protected:
+  std::function<bool(uint8_t *, size_t)> writer_;
+  tinfl_decompressor decompressor_;
+  /// The output buffer, also the dictionary of the last 32KB decompressed.
+  uint8_t *dict_;
+  size_t dict_offset_{0};
+  bool done_{false};
+};
+#endif
+
 /// OTAComponent provides a simple way to integrate Over-the-Air updates into your app using ArduinoOTA.
 class OTAComponent : public Component {
  public:
@@ -74,6 +140,8 @@ class OTAComponent : public Component {
 
   void handle_();
   size_t wait_receive_(uint8_t *buf, size_t bytes, bool check_disconnected = true);
+  /// Compute the hex MD5 of the first size bytes of the running firmware, false if it is smaller.
+  bool firmware_md5_(uint32_t size, char *md5);
 
   std::string password_;
 
@@ -7,7 +7,7 @@ from esphome.const import CONF_DATA, CONF_ID, CONF_TRIGGER_ID, CONF_NBITS, CONF_
     CONF_COMMAND, CONF_CODE, CONF_PULSE_LENGTH, CONF_SYNC, CONF_ZERO, CONF_ONE, CONF_INVERTED, \
     CONF_PROTOCOL, CONF_GROUP, CONF_DEVICE, CONF_STATE, CONF_CHANNEL, CONF_FAMILY, CONF_REPEAT, \
     CONF_WAIT_TIME, CONF_TIMES
-from esphome.core import coroutine
+from esphome.core import TimePeriod, coroutine
 from esphome.py_compat import string_types, text_type
 from esphome.util import ServiceRegistry
 
@@ -358,10 +358,15 @@ RAW_SCHEMA = cv.Schema({
 })
 
 
+def raw_code_array(code):
+    return cg.IntArrayInitializer([int(x.total_microseconds) if isinstance(x, TimePeriod) else x
+                                   for x in code])
+
+
 @register_binary_sensor('raw', RawBinarySensor, RAW_SCHEMA)
 def raw_binary_sensor(var, config):
     code_ = config[CONF_CODE]
-    arr = cg.progmem_array(config[CONF_ID], code_)
+    arr = cg.progmem_array(config[CONF_ID], raw_code_array(code_))
     cg.add(var.set_data(arr))
     cg.add(var.set_len(len(code_)))
 
@@ -384,7 +389,7 @@ def raw_action(var, config, args):
         cg.add(var.set_code_template(template_))
     else:
         code_ = config[CONF_CODE]
-        arr = cg.progmem_array(config[CONF_CODE_STORAGE_ID], code_)
+        arr = cg.progmem_array(config[CONF_CODE_STORAGE_ID], raw_code_array(code_))
         cg.add(var.set_code_static(arr, len(code_)))
 
 
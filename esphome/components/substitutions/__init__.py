@@ -42,65 +42,128 @@ def to_code(config):
 VARIABLE_PROG = re.compile('\\$([{0}]+|\\{{[{0}]*\\}})'.format(VALID_SUBSTITUTIONS_CHARACTERS))
 
 
-def _expand_substitutions(substitutions, value, path):
-    if u'$' not in value:
+def _format_path(path):
+    # Paths are (parent, key) pairs so that recursing into the config doesn't create a list
+    # for every node, only build the full path when it's needed for a warning
+    keys = []
+    while path is not None:
+        path, key = path
+        keys.append(key)
+    return u'->'.join(str(x) for x in reversed(keys))
+
+
+class Substituter(object):
+    """Expands substitutions in strings.
+
+    Each distinct string is only tokenized and expanded once, the result is cached for
+    strings that appear again.
+    """
+
+    def __init__(self, substitutions):
+        self.substitutions = substitutions
+        self._cache = {}
+
+    def _expand(self, value):
+        # split() returns the literal text at even and the matched names at odd indices
+        tokens = VARIABLE_PROG.split(value)
+        undeclared = []
+        for i in range(1, len(tokens), 2):
+            name = tokens[i]
+            if name.startswith(u'{'):
+                name = name[1:-1]
+            if name in self.substitutions:
+                tokens[i] = self.substitutions[name]
+            else:
+                undeclared.append(name)
+                tokens[i] = u'$' + tokens[i]
+        return u''.join(tokens), undeclared
+
+    def expand(self, value, path):
+        if u'$' not in value:
+            return value
+
+        cached = self._cache.get(value)
+        if cached is None:
+            cached = self._cache[value] = self._expand(value)
+        result, undeclared = cached
+        for name in undeclared:
+            _LOGGER.warning(u"Found '%s' (see %s) which looks like a substitution, but '%s' was "
+                            u"not declared", value, _format_path(path), name)
+        return result
+
+
+def _resolve_substitutions(substitutions):
+    """Expand substitutions that reference other substitutions."""
+    resolved = {}
+    resolving = []
+
+    def resolve(name):
+        if name in resolved:
+            return resolved[name]
+        if name in resolving:
+            chain = resolving[resolving.index(name):] + [name]
+            raise EsphomeError(u"Circular reference in substitutions: {}"
+                               u"".format(u' -> '.join(chain)))
+        value = substitutions[name]
+        if u'$' in value:
+            resolving.append(name)
+            tokens = VARIABLE_PROG.split(value)
+            for i in range(1, len(tokens), 2):
+                ref = tokens[i]
+                if ref.startswith(u'{'):
+                    ref = ref[1:-1]
+                if ref in substitutions:
+                    tokens[i] = resolve(ref)
+                else:
+                    _LOGGER.warning(u"Found '%s' (see %s->%s) which looks like a substitution, "
+                                    u"but '%s' was not declared", value, CONF_SUBSTITUTIONS,
+                                    name, ref)
+                    tokens[i] = u'$' + tokens[i]
+            value = u''.join(tokens)
+            resolving.pop()
+        resolved[name] = value
         return value
 
-    orig_value = value
-
-    i = 0
-    while True:
-        m = VARIABLE_PROG.search(value, i)
-        if not m:
-            # Nothing more to match. Done
-            break
-
-        i, j = m.span(0)
-        name = m.group(1)
-        if name.startswith(u'{') and name.endswith(u'}'):
-            name = name[1:-1]
-        if name not in substitutions:
-            _LOGGER.warning(u"Found '%s' (see %s) which looks like a substitution, but '%s' was "
-                            u"not declared", orig_value, u'->'.join(str(x) for x in path), name)
-            i = j
-            continue
-
-        sub = substitutions[name]
-        tail = value[j:]
-        value = value[:i] + sub
-        i = len(value)
-        value += tail
-    return value
+    for key in substitutions:
+        substitutions[key] = resolve(key)
 
 
-def _substitute_item(substitutions, item, path):
+def _substitute_item(substituter, item, path):
+    # Most of the config is strings without a '$', those are skipped without a call
     if isinstance(item, list):
         for i, it in enumerate(item):
-            sub = _substitute_item(substitutions, it, path + [i])
-            if sub is not None:
-                item[i] = sub
+            if isinstance(it, string_types):
+                if u'$' in it:
+                    sub = substituter.expand(it, (path, i))
+                    if sub != it:
+                        item[i] = sub
+            else:
+                _substitute_item(substituter, it, (path, i))
     elif isinstance(item, dict):
         replace_keys = []
         for k, v in item.items():
-            if path or k != CONF_SUBSTITUTIONS:
-                sub = _substitute_item(substitutions, k, path + [k])
-                if sub is not None:
+            if path is None and k == CONF_SUBSTITUTIONS:
+                # Already expanded by _resolve_substitutions
+                continue
+            if isinstance(k, string_types) and u'$' in k:
+                sub = substituter.expand(k, (path, k))
+                if sub != k:
                     replace_keys.append((k, sub))
-            sub = _substitute_item(substitutions, v, path + [k])
-            if sub is not None:
-                item[k] = sub
+            if isinstance(v, string_types):
+                if u'$' in v:
+                    sub = substituter.expand(v, (path, k))
+                    if sub != v:
+                        item[k] = sub
+            else:
+                _substitute_item(substituter, v, (path, k))
         for old, new in replace_keys:
             item[new] = item[old]
             del item[old]
-    elif isinstance(item, string_types):
-        sub = _expand_substitutions(substitutions, item, path)
-        if sub != item:
-            return sub
     elif isinstance(item, core.Lambda):
-        sub = _expand_substitutions(substitutions, item.value, path)
-        if sub != item:
-            item.value = sub
-    return None
+        if u'$' in item.value:
+            sub = substituter.expand(item.value, path)
+            if sub != item.value:
+                item.value = sub
 
 
 def do_substitution_pass(config):
@@ -128,7 +191,8 @@ def do_substitution_pass(config):
 
         raise EsphomeError(u"Error while parsing substitutions: {}".format(err))
 
+    _resolve_substitutions(substitutions)
     config[CONF_SUBSTITUTIONS] = substitutions
-    _substitute_item(substitutions, config, [])
+    _substitute_item(Substituter(substitutions), config, None)
 
     return config
@@ -13,11 +13,12 @@ from esphome.components import substitutions
 from esphome.const import CONF_ESPHOME, CONF_PLATFORM, ESP_PLATFORMS
 from esphome.core import CORE, EsphomeError
 from esphome.helpers import color, indent
+from esphome.profiling import PROFILER
 from esphome.py_compat import text_type
 from esphome.util import safe_print, OrderedDict
 
 # pylint: disable=unused-import, wrong-import-order
-from typing import List, Optional, Tuple, Union  # noqa
+from typing import Any, Dict, List, Optional, Tuple, Union  # noqa
 from esphome.core import ConfigType  # noqa
 from esphome.yaml_util import is_secret
 from esphome.voluptuous_schema import ExtraKeysInvalid
@@ -254,28 +255,77 @@ def iter_ids(config, path=None):
                 yield result
 
 
+def _resolve_default_ids(declare_ids):
+    # type: (List[Tuple[core.ID, ConfigPath]]) -> None
+    """Resolve all declared IDs without a manual name, in declaration order.
+
+    Gives the same names as calling ID.resolve() with all declared IDs one after
+    another, but keeps the set of used names and the last suffix tried for each
+    default name around instead of rebuilding them for each ID.
+    """
+    from esphome.config_validation import RESERVED_IDS
+
+    used = set(RESERVED_IDS)
+    used.update(id.id for id, _ in declare_ids if id.id is not None)
+    tries_by_name = {}
+    for id, _ in declare_ids:
+        if id.id is not None:
+            continue
+        name = id.default_name
+        # Names tried before for this default name are still taken, continue from there
+        tries = tries_by_name.get(name, 1)
+        test_string = name if tries == 1 else u"{}_{}".format(name, tries)
+        while test_string in used:
+            tries += 1
+            test_string = u"{}_{}".format(name, tries)
+        tries_by_name[name] = tries
+        used.add(test_string)
+        id.id = test_string
+
+
+def _build_type_index(declare_ids):
+    # type: (List[Tuple[core.ID, ConfigPath]]) -> Dict[Any, core.ID]
+    """Map each class (and all its parents) to the first declared ID inheriting from it."""
+    from esphome.cpp_generator import MockObjClass
+
+    index = {}
+    for id, _ in declare_ids:
+        if not isinstance(id.type, MockObjClass):
+            continue
+        index.setdefault(id.type, id)
+        # pylint: disable=protected-access
+        for parent in id.type._parents:
+            index.setdefault(parent, id)
+    return index
+
+
 def do_id_pass(result):  # type: (Config) -> None
     from esphome.cpp_generator import MockObjClass
 
     declare_ids = []  # type: List[Tuple[core.ID, ConfigPath]]
+    declare_ids_by_name = {}  # type: Dict[str, core.ID]
     searching_ids = []  # type: List[Tuple[core.ID, ConfigPath]]
     for id, path in iter_ids(result):
         if id.is_declaration:
-            if id.id is not None and any(v[0].id == id.id for v in declare_ids):
+            if id.id is not None and id.id in declare_ids_by_name:
                 result.add_error(u"ID {} redefined!".format(id.id), path)
                 continue
             declare_ids.append((id, path))
+            if id.id is not None:
+                declare_ids_by_name[id.id] = id
         else:
             searching_ids.append((id, path))
     # Resolve default ids after manual IDs
+    _resolve_default_ids(declare_ids)
     for id, _ in declare_ids:
-        id.resolve([v[0].id for v in declare_ids])
+        declare_ids_by_name.setdefault(id.id, id)
+    type_index = None
 
     # Check searched IDs
     for id, path in searching_ids:
         if id.id is not None:
             # manually declared
-            match = next((v[0] for v in declare_ids if v[0].id == id.id), None)
+            match = declare_ids_by_name.get(id.id)
             if match is None:
                 # No declared ID with this name
                 result.add_error("Couldn't find ID '{}'".format(id.id), path)
@@ -288,13 +338,11 @@ def do_id_pass(result):  # type: (Config) -> None
                                  "".format(id.id, match.type, id.type), path)
 
         if id.id is None and id.type is not None:
-            for v in declare_ids:
-                if v[0] is None or not isinstance(v[0].type, MockObjClass):
-                    continue
-                inherits = v[0].type.inherits_from(id.type)
-                if inherits:
-                    id.id = v[0].id
-                    break
+            if type_index is None:
+                type_index = _build_type_index(declare_ids)
+            match = type_index.get(id.type)
+            if match is not None:
+                id.id = match.id
             else:
                 result.add_error("Couldn't resolve ID for type '{}'".format(id.type), path)
 
@@ -443,7 +491,8 @@ def validate_config(config):
 
     # Step 2: Validate configuration
     try:
-        result[CONF_ESPHOME] = core_config.CONFIG_SCHEMA(result[CONF_ESPHOME])
+        with PROFILER.domain('validate', CONF_ESPHOME):
+            result[CONF_ESPHOME] = core_config.CONFIG_SCHEMA(result[CONF_ESPHOME])
     except vol.Invalid as ex:
         _comp_error(ex, [CONF_ESPHOME])
 
@@ -460,13 +509,15 @@ def validate_config(config):
             if component.is_multi_conf:
                 for i, conf_ in enumerate(conf):
                     try:
-                        validated = component.config_schema(conf_)
+                        with PROFILER.domain('validate', domain):
+                            validated = component.config_schema(conf_)
                         result[domain][i] = validated
                     except vol.Invalid as ex:
                         _comp_error(ex, [domain, i])
             else:
                 try:
-                    validated = component.config_schema(conf)
+                    with PROFILER.domain('validate', domain):
+                        validated = component.config_schema(conf)
                     result[domain] = validated
                 except vol.Invalid as ex:
                     _comp_error(ex, [domain])
@@ -484,7 +535,8 @@ def validate_config(config):
                 input_conf = OrderedDict(p_config)
                 platform_val = input_conf.pop('platform')
                 try:
-                    p_validated = platform.config_schema(input_conf)
+                    with PROFILER.domain('validate', u'{}.{}'.format(domain, p_name)):
+                        p_validated = platform.config_schema(input_conf)
                 except vol.Invalid as ex:
                     _comp_error(ex, [domain, i])
                     continue
@@ -497,7 +549,8 @@ def validate_config(config):
     if not result.errors:
         # Only parse IDs if no validation error. Otherwise
         # user gets confusing messages
-        do_id_pass(result)
+        with PROFILER.phase('do_id_pass'):
+            do_id_pass(result)
     return result
 
 
@@ -554,16 +607,19 @@ def _format_vol_invalid(ex, config, path, domain):
 
 def load_config():
     try:
-        config = yaml_util.load_yaml(CORE.config_path)
+        with PROFILER.phase('load_yaml'):
+            config = yaml_util.load_yaml(CORE.config_path)
     except OSError:
         raise EsphomeError(u"Invalid YAML at {}. Please see YAML syntax reference or use an online "
                            u"YAML syntax validator".format(CORE.config_path))
     CORE.raw_config = config
-    config = substitutions.do_substitution_pass(config)
+    with PROFILER.phase('substitutions'):
+        config = substitutions.do_substitution_pass(config)
     core_config.preload_core_config(config)
 
     try:
-        result = validate_config(config)
+        with PROFILER.phase('validate_config'):
+            result = validate_config(config)
     except EsphomeError:
         raise
     except Exception:
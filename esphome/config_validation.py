@@ -127,7 +127,7 @@ def boolean(value):
 
 def ensure_list(*validators):
     """Wrap value in list if it is not one."""
-    user = All(*validators)
+    user = Schema(All(*validators))
 
     def validator(value):
         if value is None or (isinstance(value, dict) and not value):
@@ -7,16 +7,20 @@ import os
 import re
 
 # pylint: disable=unused-import, wrong-import-order
-from typing import Any, Dict, List  # noqa
+from typing import Any, Dict, List, Tuple  # noqa
 
 from esphome.const import CONF_ARDUINO_VERSION, CONF_ESPHOME, CONF_USE_ADDRESS, CONF_WIFI, \
     SOURCE_FILE_EXTENSIONS
 from esphome.helpers import ensure_unique_string, is_hassio
+from esphome.profiling import PROFILER
 from esphome.py_compat import IS_PY2, integer_types, text_type, string_types
 from esphome.util import OrderedDict
 
 _LOGGER = logging.getLogger(__name__)
 
+# How many passes over the runnable tasks flush_tasks() allows without any progress
+MAX_IDLE_TASK_PASSES = 1000
+
 
 class EsphomeError(Exception):
     """General ESPHome exception occurred."""
@@ -265,14 +269,18 @@ class ID(object):
         self.is_declaration = is_declaration
         self.type = type
 
+    @property
+    def default_name(self):
+        """The preferred name for this ID if none was set manually, derived from the type."""
+        base = str(self.type).replace('::', '_').lower()
+        return ''.join(c for c in base if c.isalnum() or c == '_')
+
     def resolve(self, registered_ids):
         from esphome.config_validation import RESERVED_IDS
 
         if self.id is None:
-            base = str(self.type).replace('::', '_').lower()
-            name = ''.join(c for c in base if c.isalnum() or c == '_')
             used = set(registered_ids) | set(RESERVED_IDS)
-            self.id = ensure_unique_string(name, used)
+            self.id = ensure_unique_string(self.default_name, used)
         return self.id
 
     def __str__(self):
@@ -422,8 +430,15 @@ class EsphomeCore(object):
         self.pending_tasks = []
         # Task counter for pending tasks
         self.task_counter = 0
+        # Tasks that are waiting for an ID to be registered, keyed by that ID.
+        # Each item is a list of (priority, unique number, task) tuples
+        self.blocked_tasks = {}  # type: Dict[ID, List[Tuple[float, int, Any]]]
+        # The ID the currently running task is waiting for, set by get_variable()
+        self.waiting_for_id = None  # type: ID
         # The variable cache, for each ID this holds a MockObj of the variable obj
         self.variables = {}  # type: Dict[str, MockObj]
+        # The registered variables by ID name, together with the full ID they were registered with
+        self.variables_by_name = {}  # type: Dict[str, Tuple[ID, MockObj]]
         # A list of statements that go in the main setup() block
         self.main_statements = []  # type: List[Statement]
         # A list of statements to insert in the global block (includes and global variables)
@@ -446,7 +461,10 @@ class EsphomeCore(object):
         self.config = None
         self.pending_tasks = []
         self.task_counter = 0
+        self.blocked_tasks = {}
+        self.waiting_for_id = None
         self.variables = {}
+        self.variables_by_name = {}
         self.main_statements = []
         self.global_statements = []
         self.libraries = set()
@@ -515,31 +533,67 @@ class EsphomeCore(object):
     def add_job(self, func, *args, **kwargs):
         coro = coroutine(func)
         task = coro(*args, **kwargs)
+        if PROFILER.enabled:
+            PROFILER.register_task(task, func)
         item = (-coro.priority, self.task_counter, task)
         self.task_counter += 1
         heapq.heappush(self.pending_tasks, item)
         return task
 
+    def _task_progress(self, finished):
+        return (finished, len(self.variables), len(self.main_statements),
+                len(self.global_statements))
+
     def flush_tasks(self):
-        i = 0
+        # A pass runs each runnable task once. Tasks that keep yielding without finishing,
+        # registering a variable or adding code make no progress, give up after many such
+        # passes in a row.
+        finished = 0
+        idle_passes = 0
+        pass_remaining = len(self.pending_tasks)
+        progress = self._task_progress(finished)
         while self.pending_tasks:
-            i += 1
-            if i > 1000000:
-                raise EsphomeError("Circular dependency detected!")
+            if pass_remaining == 0:
+                new_progress = self._task_progress(finished)
+                idle_passes = idle_passes + 1 if new_progress == progress else 0
+                if idle_passes >= MAX_IDLE_TASK_PASSES:
+                    names = sorted(set(getattr(task, '__name__', text_type(task))
+                                       for _, _, task in self.pending_tasks))
+                    raise EsphomeError(u"Circular dependency detected! The following tasks "
+                                       u"keep running without making progress: {}"
+                                       u"".format(u', '.join(names)))
+                progress = new_progress
+                pass_remaining = len(self.pending_tasks)
+            pass_remaining -= 1
 
             inv_priority, num, task = heapq.heappop(self.pending_tasks)
             priority = -inv_priority
             _LOGGER.debug("Running %s (num %s)", task, num)
+            self.waiting_for_id = None
             try:
-                next(task)
-                # Decrease priority over time, so that if this task is blocked
-                # due to a dependency others will clear the dependency
-                # This could be improved with a less naive approach
-                priority -= 1
-                item = (-priority, num, task)
-                heapq.heappush(self.pending_tasks, item)
+                if PROFILER.enabled:
+                    with PROFILER.task_step(task):
+                        next(task)
+                else:
+                    next(task)
             except StopIteration:
                 _LOGGER.debug(" -> finished")
+                finished += 1
+                continue
+            # Decrease priority over time, so that tasks with the same priority
+            # take turns
+            priority -= 1
+            if self.waiting_for_id is not None:
+                # Task is blocked on an ID, park it until register_variable() wakes it up
+                self.blocked_tasks.setdefault(self.waiting_for_id, []).append(
+                    (priority, num, task))
+                continue
+            heapq.heappush(self.pending_tasks, (-priority, num, task))
+
+        if self.blocked_tasks:
+            ids = sorted(text_type(id) for id in self.blocked_tasks)
+            raise EsphomeError(u"Circular dependency detected! The following IDs are "
+                               u"waited for but never registered: {}".format(u', '.join(ids)))
 
     def add(self, expression):
         from esphome.cpp_generator import Expression, Statement, statement
@@ -599,16 +653,16 @@ class EsphomeCore(object):
                 yield self.variables[id]
                 return
             _LOGGER.debug("Waiting for variable %s (%r)", id, id)
+            self.waiting_for_id = id
             yield None
 
     def get_variable_with_full_id(self, id):
         while True:
-            if id in self.variables:
-                for k, v in self.variables.items():
-                    if k == id:
-                        yield (k, v)
-                        return
+            if id.id in self.variables_by_name:
+                yield self.variables_by_name[id.id]
+                return
             _LOGGER.debug("Waiting for variable %s", id)
+            self.waiting_for_id = id
             yield None, None
 
     def register_variable(self, id, obj):
@@ -616,6 +670,11 @@ class EsphomeCore(object):
             raise EsphomeError("ID {} is already registered".format(id))
         _LOGGER.debug("Registered variable %s of type %s", id.id, id.type)
         self.variables[id] = obj
+        self.variables_by_name[id.id] = (id, obj)
+        # Wake up all tasks that were waiting for this variable
+        for inv_item in self.blocked_tasks.pop(id, []):
+            priority, num, task = inv_item
+            heapq.heappush(self.pending_tasks, (-priority, num, task))
 
     def has_id(self, id):
         return id in self.variables
@@ -7,7 +7,7 @@ from esphome.core import (  # noqa
     CORE, HexInt, ID, Lambda, TimePeriod, TimePeriodMicroseconds,
     TimePeriodMilliseconds, TimePeriodMinutes, TimePeriodSeconds, coroutine, Library, Define)
 from esphome.helpers import cpp_string_escape, indent_all_but_first_and_last
-from esphome.py_compat import integer_types, string_types, text_type
+from esphome.py_compat import IS_PY2, binary_type, integer_types, string_types, text_type
 from esphome.util import OrderedDict
 
 
@@ -141,6 +141,34 @@ class ArrayInitializer(Expression):
         return cpp
 
 
+_HEX_BYTES = [u'0x{:02X}'.format(x) for x in range(256)]
+
+
+class IntArrayInitializer(Expression):
+    """An array initializer for large amounts of integer data, like font and image data.
+
+    The values are stored as they are instead of as one expression per element and are
+    formatted all at once, 16 values per line. bytes/bytearray/memoryview values are written as
+    hex.
+    """
+
+    def __init__(self, values, per_line=16):  # type: (Union[bytes, List[int]], int) -> None
+        super(IntArrayInitializer, self).__init__()
+        self.hex = isinstance(values, (bytes, bytearray, memoryview))
+        if self.hex:
+            values = bytearray(values)
+        self.values = values
+        self.per_line = per_line
+
+    def __str__(self):
+        if not self.values:
+            return u'{}'
+        format_ = _HEX_BYTES.__getitem__ if self.hex else text_type
+        lines = [u', '.join(map(format_, self.values[i:i + self.per_line]))
+                 for i in range(0, len(self.values), self.per_line)]
+        return u'{\n  ' + u',\n  '.join(lines) + u',\n}'
+
+
 class ParameterExpression(Expression):
     def __init__(self, type, id):
         super(ParameterExpression, self).__init__()
@@ -255,6 +283,9 @@ def safe_exp(
         return obj
     if isinstance(obj, bool):
         return BoolLiteral(obj)
+    if isinstance(obj, (bytearray, memoryview)) or (isinstance(obj, binary_type) and not IS_PY2):
+        # Raw data, but a Python 2 str is a string
+        return IntArrayInitializer(obj)
     if isinstance(obj, string_types):
         return StringLiteral(obj)
     if isinstance(obj, HexInt):
@@ -1,12 +1,17 @@
 import hashlib
 import logging
+import mmap
+import os
 import random
+import shutil
 import socket
+import struct
 import sys
 import time
+import zlib
 
 from esphome.core import EsphomeError
-from esphome.helpers import is_ip_address, resolve_ip_address
+from esphome.helpers import is_ip_address, mkdir_p, resolve_ip_address
 from esphome.py_compat import IS_PY2, char_to_byte
 
 RESPONSE_OK = 0
@@ -18,6 +23,9 @@ RESPONSE_UPDATE_PREPARE_OK = 66
 RESPONSE_BIN_MD5_OK = 67
 RESPONSE_RECEIVE_OK = 68
 RESPONSE_UPDATE_END_OK = 69
+RESPONSE_SUPPORTS_COMPRESSION = 70
+RESPONSE_SUPPORTS_DELTA = 71
+RESPONSE_SUPPORTS_COMPRESSION_AND_DELTA = 72
 
 RESPONSE_ERROR_MAGIC = 128
 RESPONSE_ERROR_UPDATE_PREPARE = 129
@@ -33,14 +41,36 @@ RESPONSE_ERROR_UNKNOWN = 255
 
 OTA_VERSION_1_0 = 1
 
+FEATURE_SUPPORTS_COMPRESSION = 0x01
+FEATURE_SUPPORTS_DELTA = 0x02
+
+DELTA_MODE_FULL = 0
+DELTA_MODE_PATCH = 1
+
+# Copy a range of the running firmware: offset and length, 4 bytes MSB first each
+DELTA_OP_COPY = 0x01
+# Insert bytes: length, 4 bytes MSB first, followed by the bytes
+DELTA_OP_INSERT = 0x02
+# Size of the blocks of the base firmware that are looked up in the new firmware
+DELTA_BLOCK_SIZE = 16
+
 MAGIC_BYTES = [0x6C, 0x26, 0xF7, 0x5C, 0x45]
 
+# Size of the pieces the firmware is sent in
+OTA_CHUNK_SIZE = 8192
+# Send buffer while a progress bar is shown. The OS default is usually around 100kB, with
+# a smaller buffer the progress bar shows what the ESP actually received.
+OTA_PROGRESS_SEND_BUFFER = 8192
+
 _LOGGER = logging.getLogger(__name__)
 
 
 class ProgressBar(object):
-    def __init__(self):
+    def __init__(self, interval=0.1):
         self.last_progress = None
+        # Redraw at most every interval seconds, writing to the terminal is slow
+        self.interval = interval
+        self.last_update = 0
 
     def update(self, progress):
         bar_length = 60
@@ -51,7 +81,11 @@ class ProgressBar(object):
         new_progress = int(progress * 100)
         if new_progress == self.last_progress:
             return
+        now = time.time()
+        if progress < 1 and now - self.last_update < self.interval:
+            return
         self.last_progress = new_progress
+        self.last_update = now
         block = int(round(bar_length * progress))
         text = "\rUploading: [{0}] {1}% {2}".format("=" * block + " " * (bar_length - block),
                                                     new_progress, status)
@@ -70,6 +104,8 @@ class OTAError(EsphomeError):
 
 def recv_decode(sock, amount, decode=True):
     data = sock.recv(amount)
+    if not data:
+        raise socket.error("Connection closed")
     if not decode:
         return data
     return [char_to_byte(x) for x in data]
@@ -103,7 +139,7 @@ def receive_exactly(sock, amount, msg, expect, decode=True):
 
 
 def check_error(data, expect):
-    if not expect:
+    if expect is None or expect == []:
         return
     dat = data[0]
     if dat == RESPONSE_ERROR_MAGIC:
@@ -162,11 +198,165 @@ def send_check(sock, data, msg):
         raise OTAError("Error sending {}: {}".format(msg, err))
 
 
-def perform_ota(sock, password, file_handle, filename):
-    file_md5 = hashlib.md5(file_handle.read()).hexdigest()
-    file_size = file_handle.tell()
+def _encode_size(value):
+    return [(value >> 24) & 0xFF, (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF]
+
+
+def _match_length(data, data_start, base, base_start):
+    """Get the length of the common prefix of data[data_start:] and base[base_start:]."""
+    limit = min(len(data) - data_start, len(base) - base_start)
+    length = 0
+    step = 256
+    # Compare in large steps first, comparing slices is much faster than single bytes
+    while step:
+        while length + step <= limit and \
+                data[data_start + length:data_start + length + step] == \
+                base[base_start + length:base_start + length + step]:
+            length += step
+        step //= 4
+    return length
+
+
+def _add_insert(patch, data, start, end):
+    if end > start:
+        patch += struct.pack('>BI', DELTA_OP_INSERT, end - start)
+        patch += data[start:end]
+
+
+def compute_delta(base, data, block_size=DELTA_BLOCK_SIZE):
+    """Compute a patch that turns the firmware base into data.
+
+    The blocks of base at multiples of block_size are indexed, every range of data that
+    contains one of them becomes a copy from base that is extended in both directions. Data
+    in between is inserted. The patch ends when it has produced all of data.
+
+    Ranges of data that aren't in base are scanned one byte at a time, with a slice and a
+    dict lookup per byte. That's the slow part: about 0.25s per MiB of new data on a desktop
+    CPU, while copied ranges are skipped in one step. A rolling hash wouldn't avoid the
+    per-byte Python loop, firmwares are small enough that this doesn't matter.
+    """
+    blocks = {}
+    # Backwards so that the first occurrence of a block wins
+    for offset in range(len(base) - len(base) % block_size - block_size, -1, -block_size):
+        blocks[base[offset:offset + block_size]] = offset
+
+    patch = bytearray()
+    insert_start = 0
+    i = 0
+    while i <= len(data) - block_size:
+        offset = blocks.get(data[i:i + block_size])
+        if offset is None:
+            i += 1
+            continue
+        start, base_start = i, offset
+        while start > insert_start and base_start > 0 and data[start - 1] == base[base_start - 1]:
+            start -= 1
+            base_start -= 1
+        end = i + block_size + _match_length(data, i + block_size, base, offset + block_size)
+        _add_insert(patch, data, insert_start, start)
+        patch += struct.pack('>BII', DELTA_OP_COPY, base_start, end - start)
+        i = insert_start = end
+    _add_insert(patch, data, insert_start, len(data))
+    return bytes(patch)
+
+
+def _negotiate_delta(sock, base, data):
+    """Check that the device runs base and compute the patch for data.
+
+    Returns None if the full firmware should be sent.
+    """
+    send_check(sock, _encode_size(len(base)), 'base size')
+    device_md5 = receive_exactly(sock, 32, 'firmware checksum', [], decode=False)
+    if not IS_PY2:
+        device_md5 = device_md5.decode()
+    _LOGGER.debug("MD5 of the running firmware is %s", device_md5)
+
+    patch = None
+    if device_md5 != hashlib.md5(base).hexdigest():
+        _LOGGER.info("The device doesn't run the last uploaded firmware, sending the full "
+                     "firmware")
+    else:
+        patch = compute_delta(base, data)
+        if len(patch) >= len(data):
+            patch = None
+    send_check(sock, DELTA_MODE_FULL if patch is None else DELTA_MODE_PATCH, 'delta mode')
+    return patch
+
+
+def _map_file(file_handle):
+    """Memory-map a file, empty files (which can't be mapped) are read instead."""
+    try:
+        return mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, mmap.error):
+        return file_handle.read()
+
+
+def perform_ota(sock, password, file_handle, filename, show_progress=True, wait=True,
+                chunk_size=OTA_CHUNK_SIZE, send_buffer=None, compression=True, base=None):
+    """Upload the firmware in file_handle over the connected socket.
+
+    send_buffer sets the socket's send buffer for the transfer. It defaults to a small
+    buffer if the progress bar is shown and to the OS default otherwise.
+
+    With compression the firmware is sent as a zlib stream if the device supports it.
+    Devices that don't will answer the features byte like before and get the firmware
+    uncompressed.
+
+    base is the firmware that was last uploaded to the device. If the device still runs it
+    and supports delta updates only a patch against it is sent.
+    """
+    data = _map_file(file_handle)
+    try:
+        _perform_ota(sock, password, data, filename, show_progress, wait, chunk_size,
+                     send_buffer, compression, base)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def _send_payload(sock, payload, chunk_size, compress, progress):
+    """Send payload in chunks of chunk_size, as a zlib stream if compress is set.
+
+    Chunks are compressed just before they are sent, so no compressed copy of the firmware
+    is kept in memory. Returns the number of bytes sent.
+    """
+    compressor = zlib.compressobj(9) if compress else None
+    payload_size = len(payload)
+    sent = 0
+    # Slices of a memoryview don't copy the data (Python 2 mmaps don't support memoryview)
+    view = payload if IS_PY2 else memoryview(payload)
+    try:
+        for offset in range(0, payload_size, chunk_size):
+            chunk = view[offset:offset + chunk_size]
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            sent += _send_chunk(sock, chunk, progress)
+            if progress is not None:
+                progress.update(min(offset + chunk_size, payload_size) / float(payload_size))
+        if compressor is not None:
+            sent += _send_chunk(sock, compressor.flush(), progress)
+    finally:
+        if not IS_PY2:
+            view.release()
+    return sent
+
+
+def _send_chunk(sock, chunk, progress):
+    try:
+        sock.sendall(chunk)
+    except socket.error as err:
+        if progress is not None:
+            sys.stderr.write('\n')
+        raise OTAError("Error sending data: {}".format(err))
+    return len(chunk)
+
+
+# pylint: disable=too-many-locals
+def _perform_ota(sock, password, data, filename, show_progress, wait, chunk_size, send_buffer,
+                 compression, base):
+    file_md5 = hashlib.md5(data).hexdigest()
+    file_size = len(data)
     _LOGGER.info('Uploading %s (%s bytes)', filename, file_size)
-    file_handle.seek(0)
     _LOGGER.debug("MD5 of binary is %s", file_md5)
 
     # Enable nodelay, we need it for phase 1
@@ -178,8 +368,21 @@ def perform_ota(sock, password, file_handle, filename):
         raise OTAError("Unsupported OTA version {}".format(version))
 
     # Features
-    send_check(sock, 0x00, 'features')
-    receive_exactly(sock, 1, 'features', RESPONSE_HEADER_OK)
+    features = 0x00
+    expect = [RESPONSE_HEADER_OK]
+    if compression:
+        features |= FEATURE_SUPPORTS_COMPRESSION
+        expect.append(RESPONSE_SUPPORTS_COMPRESSION)
+    if base is not None:
+        features |= FEATURE_SUPPORTS_DELTA
+        expect.append(RESPONSE_SUPPORTS_DELTA)
+        if compression:
+            expect.append(RESPONSE_SUPPORTS_COMPRESSION_AND_DELTA)
+    send_check(sock, features, 'features')
+    features, = receive_exactly(sock, 1, 'features', expect)
+    use_compression = features in (RESPONSE_SUPPORTS_COMPRESSION,
+                                   RESPONSE_SUPPORTS_COMPRESSION_AND_DELTA)
+    use_delta = features in (RESPONSE_SUPPORTS_DELTA, RESPONSE_SUPPORTS_COMPRESSION_AND_DELTA)
 
     auth, = receive_exactly(sock, 1, 'auth', [RESPONSE_REQUEST_AUTH, RESPONSE_AUTH_OK])
     if auth == RESPONSE_REQUEST_AUTH:
@@ -204,40 +407,37 @@ def perform_ota(sock, password, file_handle, filename):
         send_check(sock, result, 'auth result')
         receive_exactly(sock, 1, 'auth result', RESPONSE_AUTH_OK)
 
-    file_size_encoded = [
-        (file_size >> 24) & 0xFF,
-        (file_size >> 16) & 0xFF,
-        (file_size >> 8) & 0xFF,
-        (file_size >> 0) & 0xFF,
-    ]
-    send_check(sock, file_size_encoded, 'binary size')
+    patch = None
+    if use_delta:
+        patch = _negotiate_delta(sock, base, data)
+
+    send_check(sock, _encode_size(file_size), 'binary size')
     receive_exactly(sock, 1, 'binary size', RESPONSE_UPDATE_PREPARE_OK)
 
     send_check(sock, file_md5, 'file checksum')
     receive_exactly(sock, 1, 'file checksum', RESPONSE_BIN_MD5_OK)
 
+    # The size and checksum sent above are the ones of the new firmware
+    payload = data
+    if patch is not None:
+        payload = patch
+        _LOGGER.info("Sending patch against the last uploaded firmware (%s bytes, %.0f%%)",
+                     len(patch), 100.0 * len(patch) / file_size)
+
     # Disable nodelay for transfer
     sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0)
-    # Limit send buffer (usually around 100kB) in order to have progress bar
-    # show the actual progress
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8192)
-
-    offset = 0
-    progress = ProgressBar()
-    while True:
-        chunk = file_handle.read(1024)
-        if not chunk:
-            break
-        offset += len(chunk)
-
-        try:
-            sock.sendall(chunk)
-        except socket.error as err:
-            sys.stderr.write('\n')
-            raise OTAError("Error sending data: {}".format(err))
-
-        progress.update(offset / float(file_size))
-    progress.done()
+    if send_buffer is None and show_progress:
+        send_buffer = OTA_PROGRESS_SEND_BUFFER
+    if send_buffer is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+
+    progress = ProgressBar() if show_progress else None
+    sent = _send_payload(sock, payload, chunk_size, use_compression, progress)
+    if progress is not None:
+        progress.done()
+    if use_compression:
+        _LOGGER.info("Sent %s compressed bytes (%.0f%%)", sent,
+                     100.0 * sent / max(file_size, 1))
 
     # Enable nodelay for last checks
     sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -250,11 +450,35 @@ def perform_ota(sock, password, file_handle, filename):
 
     _LOGGER.info("OTA successful")
 
-    # Do not connect logs until it is fully on
-    time.sleep(1)
+    if wait:
+        # Do not connect logs until it is fully on
+        time.sleep(1)
+
+
+def read_base_firmware(base_path):
+    """Read the firmware last uploaded to a device, None if there is none."""
+    if base_path is None or not os.path.isfile(base_path):
+        return None
+    try:
+        with open(base_path, 'rb') as f_handle:
+            return f_handle.read()
+    except (IOError, OSError) as err:
+        _LOGGER.debug("Could not read %s: %s", base_path, err)
+        return None
+
+
+def store_base_firmware(filename, base_path):
+    """Keep a copy of an uploaded firmware to send a patch against it next time."""
+    if base_path is None:
+        return
+    try:
+        mkdir_p(os.path.dirname(base_path))
+        shutil.copyfile(filename, base_path)
+    except (IOError, OSError) as err:
+        _LOGGER.warning("Could not store a copy of the firmware at %s: %s", base_path, err)
 
 
-def run_ota_impl_(remote_host, remote_port, password, filename):
+def run_ota_impl_(remote_host, remote_port, password, filename, base_path=None):
     if is_ip_address(remote_host):
         _LOGGER.info("Connecting to %s", remote_host)
         ip = remote_host
@@ -281,7 +505,7 @@ def run_ota_impl_(remote_host, remote_port, password, filename):
 
     file_handle = open(filename, 'rb')
     try:
-        perform_ota(sock, password, file_handle, filename)
+        perform_ota(sock, password, file_handle, filename, base=read_base_firmware(base_path))
     except OTAError as err:
         _LOGGER.error(str(err))
         return 1
@@ -289,11 +513,12 @@ def run_ota_impl_(remote_host, remote_port, password, filename):
         sock.close()
         file_handle.close()
 
+    store_base_firmware(filename, base_path)
     return 0
 
 
-def run_ota(remote_host, remote_port, password, filename):
+def run_ota(remote_host, remote_port, password, filename, base_path=None):
     try:
-        return run_ota_impl_(remote_host, remote_port, password, filename)
+        return run_ota_impl_(remote_host, remote_port, password, filename, base_path)
     except OTAError as err:
         _LOGGER.error(err)
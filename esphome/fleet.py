@@ -0,0 +1,493 @@
+from __future__ import print_function
+
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+from esphome.core import CORE, EsphomeError
+from esphome.helpers import color, is_ip_address
+from esphome.py_compat import text_type
+from esphome.util import safe_print
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def expand_configurations(paths):
+    """Expand the given paths to a list of configuration files.
+
+    Directories are replaced by the YAML files directly inside them (like the dashboard lists
+    them), files are kept as they are. Files given more than once are only returned once.
+    """
+    result = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files = [path]
+        else:
+            files = []
+            for f_name in os.listdir(path):
+                if not f_name.endswith('.yaml') or f_name.startswith('.') or \
+                        f_name == 'secrets.yaml':
+                    continue
+                files.append(os.path.join(path, f_name))
+            files.sort()
+        for f_path in files:
+            if not any(os.path.abspath(f_path) == os.path.abspath(x) for x in result):
+                result.append(f_path)
+    return result
+
+
+class FleetNode(object):
+    """The state of one node in a fleet build, passed between the worker processes."""
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.name = None
+        self.build_path = None
+        self.esp_platform = None
+        self.board = None
+        self.arduino_version = None
+        # One of 'pending', 'invalid', 'generated', 'success', 'failed'
+        self.result = 'pending'
+        self.generate_time = None
+        self.compile_time = None
+        self.log_path = None
+        # OTA upload
+        self.address = None
+        self.ip = None
+        self.ota_port = None
+        self.ota_password = None
+        self.firmware_bin = None
+        self.firmware_base = None
+        self.upload_size = None
+        self.upload_time = None
+        self.attempts = 0
+        self.error = None
+
+    @property
+    def toolchain_key(self):
+        return self.esp_platform or '', self.arduino_version or '', self.board or ''
+
+
+def _init_worker(verbose, dashboard):
+    # pylint: disable=cyclic-import
+    from esphome.__main__ import setup_log
+
+    setup_log(verbose)
+    CORE.dashboard = dashboard
+
+
+def _generate_node(args):
+    config_path, verbose = args
+    # pylint: disable=cyclic-import
+    from esphome.__main__ import write_cpp
+    from esphome.config import read_config
+
+    node = FleetNode(config_path)
+    start = time.time()
+    dashboard = CORE.dashboard
+    CORE.reset()
+    CORE.dashboard = dashboard
+    CORE.config_path = config_path
+    try:
+        config = read_config(verbose)
+        if config is None:
+            node.result = 'invalid'
+            return node
+        CORE.config = config
+        node.name = CORE.name
+        node.build_path = CORE.build_path
+        node.esp_platform = CORE.esp_platform
+        node.board = CORE.board
+        node.arduino_version = CORE.arduino_version
+        if write_cpp(config) != 0:
+            node.result = 'failed'
+            return node
+    except EsphomeError as err:
+        _LOGGER.error(u"%s: %s", config_path, err)
+        node.result = 'failed'
+        return node
+    except Exception:  # pylint: disable=broad-except
+        _LOGGER.exception(u"Unexpected exception while generating code for %s:", config_path)
+        node.result = 'failed'
+        return node
+    finally:
+        node.generate_time = time.time() - start
+    node.result = 'generated'
+    return node
+
+
+def _redirect_output(path):
+    # Concurrent builds would interleave their output, send it to a log file instead
+    log_file = open(path, 'w')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(log_file.fileno(), 1)
+    os.dup2(log_file.fileno(), 2)
+    sys.stdout = sys.stderr = log_file
+
+
+def _compile_node(args):
+    from esphome import platformio_api
+
+    node, verbose = args
+    dashboard = CORE.dashboard
+    CORE.reset()
+    CORE.dashboard = dashboard
+    CORE.config_path = node.config_path
+    CORE.name = node.name
+    CORE.build_path = node.build_path
+    if node.log_path is not None:
+        _redirect_output(node.log_path)
+    start = time.time()
+    try:
+        exit_code = platformio_api.run_compile(None, verbose)
+    except Exception:  # pylint: disable=broad-except
+        _LOGGER.exception(u"Compiling %s failed:", node.config_path)
+        exit_code = 1
+    node.compile_time = time.time() - start
+    node.result = 'success' if exit_code == 0 else 'failed'
+    return node
+
+
+def _order_for_compile(nodes):
+    """Order nodes so that nodes sharing a toolchain are built one after another.
+
+    Returns a list of the first node of each toolchain group (built one at a time so
+    that platformio installs the toolchain only once) and a list of the rest.
+    """
+    nodes = sorted(nodes, key=lambda n: (n.toolchain_key, n.config_path))
+    first, rest = [], []
+    seen = set()
+    for node in nodes:
+        if node.toolchain_key in seen:
+            rest.append(node)
+        else:
+            seen.add(node.toolchain_key)
+            first.append(node)
+    return first, rest
+
+
+def _format_time(seconds):
+    if seconds is None:
+        return u'-'
+    return u'{:.1f}s'.format(seconds)
+
+
+def print_summary(nodes):
+    safe_print()
+    safe_print(color('bold_white', u"Fleet build summary:"))
+    if not nodes:
+        safe_print(u"  No nodes were built")
+        return
+    colors = {'success': 'bold_green', 'generated': 'bold_green'}
+    width = max(len(node.config_path) for node in nodes)
+    for node in nodes:
+        safe_print(u"  {}  {:>8}  {:>8}  {}".format(
+            node.config_path.ljust(width), _format_time(node.generate_time),
+            _format_time(node.compile_time),
+            color(colors.get(node.result, 'bold_red'), node.result.upper())))
+        if node.result == 'failed' and node.log_path is not None:
+            safe_print(u"    See {} for the build output".format(node.log_path))
+
+
+def _run_pool(func, items, processes, verbose, maxtasksperchild=None):
+    if not items:
+        return []
+    pool = multiprocessing.Pool(processes=min(processes, len(items)),
+                                initializer=_init_worker, initargs=(verbose, CORE.dashboard),
+                                maxtasksperchild=maxtasksperchild)
+    try:
+        return pool.map(func, [(item, verbose) for item in items], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def compile_fleet(args, config_paths):
+    """Validate, generate and compile many configurations at once.
+
+    Validation and code generation run in a pool of worker processes (which keep the
+    imported components around between nodes), then the platformio builds run with at
+    most args.jobs builds at the same time.
+    """
+    if not config_paths:
+        _LOGGER.error(u"No configuration files found in %s", u', '.join(args.configuration))
+        return 1
+    generate_jobs = args.generate_jobs or multiprocessing.cpu_count()
+    _LOGGER.info(u"Generating code for %s nodes using %s processes...",
+                 len(config_paths), min(generate_jobs, len(config_paths)))
+    nodes = _run_pool(_generate_node, config_paths, generate_jobs, args.verbose)
+
+    generated = [node for node in nodes if node.result == 'generated']
+    if not args.only_generate and generated:
+        first, rest = _order_for_compile(generated)
+        if args.jobs > 1:
+            for node in generated:
+                node.log_path = os.path.join(node.build_path, 'build.log')
+        _LOGGER.info(u"Compiling %s nodes, at most %s at a time...", len(generated), args.jobs)
+        # A new process for each build, platformio keeps global state around.
+        # Build the first node of each toolchain alone so that the toolchain is only
+        # installed once, then build the rest in parallel.
+        results = _run_pool(_compile_node, first, 1, args.verbose, maxtasksperchild=1)
+        results += _run_pool(_compile_node, rest, args.jobs, args.verbose, maxtasksperchild=1)
+        by_path = {node.config_path: node for node in results}
+        nodes = [by_path.get(node.config_path, node) for node in nodes]
+
+    print_summary(nodes)
+    success = 'generated' if args.only_generate else 'success'
+    return 0 if all(node.result == success for node in nodes) else 1
+
+
+def _read_upload_target(args):
+    config_path, verbose = args
+    # pylint: disable=cyclic-import
+    from esphome.config import read_config
+    from esphome.const import CONF_OTA, CONF_PASSWORD, CONF_PORT
+    from esphome.storage_json import firmware_base_path
+
+    node = FleetNode(config_path)
+    dashboard = CORE.dashboard
+    CORE.reset()
+    CORE.dashboard = dashboard
+    CORE.config_path = config_path
+    try:
+        config = read_config(verbose)
+        if config is None:
+            node.result = 'invalid'
+            return node
+        CORE.config = config
+        node.name = CORE.name
+        node.address = CORE.address
+        node.firmware_bin = CORE.firmware_bin
+        node.firmware_base = firmware_base_path()
+        if CONF_OTA not in config:
+            node.result = 'invalid'
+            node.error = u"OTA is not enabled"
+            return node
+        node.ota_port = config[CONF_OTA][CONF_PORT]
+        node.ota_password = config[CONF_OTA][CONF_PASSWORD]
+    except Exception as err:  # pylint: disable=broad-except
+        _LOGGER.exception(u"Unexpected exception while reading %s:", config_path)
+        node.result = 'invalid'
+        node.error = text_type(err)
+        return node
+    if not os.path.isfile(node.firmware_bin):
+        node.result = 'failed'
+        node.error = u"Firmware not compiled"
+    return node
+
+
+def resolve_addresses(addresses):
+    """Resolve many host names at once.
+
+    Every name is only looked up once, normal DNS lookups run in parallel and all names
+    that need mDNS share one Zeroconf instance. Returns a dict of address to IP, None if
+    the address could not be resolved.
+    """
+    result = {}
+    lookups = []
+    for address in set(addresses):
+        if is_ip_address(address):
+            result[address] = address
+        else:
+            lookups.append(address)
+
+    def lookup(address):
+        try:
+            result[address] = socket.gethostbyname(address)
+        except socket.error:
+            result[address] = None
+
+    threads = [threading.Thread(target=lookup, args=(address,)) for address in lookups]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mdns = [x for x in lookups if result[x] is None and x.endswith('.local')]
+    if mdns:
+        from esphome.zeroconf import Zeroconf
+
+        try:
+            zeroconf = Zeroconf()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.error(u"Cannot start mDNS sockets, is this a docker container without "
+                          u"host network mode?")
+            return result
+        try:
+            for address in mdns:
+                try:
+                    result[address] = zeroconf.resolve_host(address + '.')
+                except Exception:  # pylint: disable=broad-except
+                    pass
+        finally:
+            zeroconf.close()
+    return result
+
+
+def _subnet(ip):
+    return ip.rpartition('.')[0]
+
+
+class OTAScheduler(object):
+    """Hands out nodes to the upload threads.
+
+    At most jobs_per_subnet uploads run at the same time in each /24 subnet (0 means no
+    limit), a thread waits if all pending nodes are in busy subnets.
+    """
+
+    def __init__(self, nodes, jobs_per_subnet):
+        self.pending = list(nodes)
+        self.jobs_per_subnet = jobs_per_subnet
+        self.active = {}
+        self.cond = threading.Condition()
+
+    def _has_capacity(self, node):
+        if not self.jobs_per_subnet:
+            return True
+        return self.active.get(_subnet(node.ip), 0) < self.jobs_per_subnet
+
+    def next(self):
+        with self.cond:
+            while self.pending:
+                for i, node in enumerate(self.pending):
+                    if self._has_capacity(node):
+                        del self.pending[i]
+                        subnet = _subnet(node.ip)
+                        self.active[subnet] = self.active.get(subnet, 0) + 1
+                        return node
+                self.cond.wait()
+            return None
+
+    def done(self, node):
+        with self.cond:
+            self.active[_subnet(node.ip)] -= 1
+            self.cond.notify_all()
+
+
+def _upload_node(node, retries, backoff):
+    from esphome import espota2
+
+    node.upload_size = os.path.getsize(node.firmware_bin)
+    base = espota2.read_base_firmware(node.firmware_base)
+    while True:
+        node.attempts += 1
+        start = time.time()
+        sock = None
+        try:
+            sock = socket.create_connection((node.ip, node.ota_port), timeout=10.0)
+            with open(node.firmware_bin, 'rb') as file_handle:
+                espota2.perform_ota(sock, node.ota_password, file_handle, node.firmware_bin,
+                                    show_progress=False, wait=False, base=base)
+        except (espota2.OTAError, socket.error, IOError, OSError) as err:
+            node.error = text_type(err)
+            if node.attempts > retries:
+                _LOGGER.error(u"Uploading to %s failed: %s", node.address, err)
+                node.result = 'failed'
+                return
+            delay = backoff * 2 ** (node.attempts - 1)
+            _LOGGER.warning(u"Uploading to %s failed: %s, retrying in %ss",
+                            node.address, err, delay)
+            time.sleep(delay)
+            continue
+        finally:
+            if sock is not None:
+                sock.close()
+        node.upload_time = time.time() - start
+        espota2.store_base_firmware(node.firmware_bin, node.firmware_base)
+        node.error = None
+        node.result = 'success'
+        _LOGGER.info(u"Uploaded to %s in %.1fs", node.address, node.upload_time)
+        return
+
+
+def _upload_worker(scheduler, retries, backoff):
+    while True:
+        node = scheduler.next()
+        if node is None:
+            return
+        try:
+            _upload_node(node, retries, backoff)
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.exception(u"Unexpected exception while uploading to %s:", node.address)
+            node.result = 'failed'
+            node.error = text_type(err)
+        finally:
+            scheduler.done(node)
+
+
+def upload_nodes(nodes, jobs, jobs_per_subnet=0, retries=0, backoff=1.0):
+    """Upload the firmware of the given nodes over OTA, at most jobs at a time.
+
+    The nodes need their address, OTA port, password and firmware set. After the upload
+    node.result is 'success' or 'failed'.
+    """
+    ips = resolve_addresses(node.address for node in nodes)
+    uploads = []
+    for node in nodes:
+        node.ip = ips.get(node.address)
+        if node.ip is None:
+            node.result = 'failed'
+            node.error = u"Could not resolve {}".format(node.address)
+        else:
+            uploads.append(node)
+
+    scheduler = OTAScheduler(uploads, jobs_per_subnet)
+    threads = [threading.Thread(target=_upload_worker, args=(scheduler, retries, backoff))
+               for _ in range(min(jobs, len(uploads)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return nodes
+
+
+def _format_throughput(node):
+    if node.upload_time is None or not node.upload_size:
+        return u'-'
+    return u'{:.1f} KiB/s'.format(node.upload_size / 1024.0 / max(node.upload_time, 1e-6))
+
+
+def print_upload_summary(nodes):
+    safe_print()
+    safe_print(color('bold_white', u"Fleet OTA summary:"))
+    if not nodes:
+        safe_print(u"  No nodes were uploaded to")
+        return
+    width = max(len(node.config_path) for node in nodes)
+    host_width = max(len(node.address or u'-') for node in nodes)
+    for node in nodes:
+        result = color('bold_green' if node.result == 'success' else 'bold_red',
+                       node.result.upper())
+        safe_print(u"  {}  {}  {:>8}  {:>14}  {:>2}x  {}".format(
+            node.config_path.ljust(width), (node.address or u'-').ljust(host_width),
+            _format_time(node.upload_time), _format_throughput(node), node.attempts, result))
+        if node.error is not None:
+            safe_print(u"    {}".format(node.error))
+
+
+def upload_fleet(args, config_paths):
+    """Upload the compiled firmware of many configurations over OTA.
+
+    The configurations are read in a pool of worker processes, then the uploads run in
+    threads with at most args.ota_jobs uploads at the same time (and at most
+    args.ota_jobs_per_subnet in each /24 subnet). Failed uploads are retried
+    args.ota_retries times with exponential backoff.
+    """
+    if not config_paths:
+        _LOGGER.error(u"No configuration files found in %s", u', '.join(args.configuration))
+        return 1
+    _LOGGER.info(u"Reading %s configurations...", len(config_paths))
+    nodes = _run_pool(_read_upload_target, config_paths, multiprocessing.cpu_count(),
+                      args.verbose)
+    uploads = [node for node in nodes if node.result == 'pending']
+    _LOGGER.info(u"Uploading to %s nodes, at most %s at a time...", len(uploads),
+                 args.ota_jobs)
+    upload_nodes(uploads, args.ota_jobs, args.ota_jobs_per_subnet, args.ota_retries)
+    print_upload_summary(nodes)
+    return 0 if all(node.result == 'success' for node in nodes) else 1
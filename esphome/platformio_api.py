@@ -1,13 +1,19 @@
 from __future__ import print_function
 
+import hashlib
 import json
 import logging
 import os
 import re
 import subprocess
+import threading
 
-from esphome.core import CORE
-from esphome.util import run_external_command, run_external_process
+from esphome.core import CORE, EsphomeError
+from esphome.helpers import write_file
+from esphome.util import OrderedDict, run_external_command, run_external_process
+
+if False:  # pylint: disable=using-constant-test
+    from typing import Optional  # noqa
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -56,13 +62,19 @@ def patch_structhash():
     run._clean_build_dir = patched_safe
 
 
+def _use_subprocess():
+    return os.environ.get('ESPHOME_USE_SUBPROCESS') is not None
+
+
 def run_platformio_cli(*args, **kwargs):
+    # external: always start a platformio process, even when ESPHOME_USE_SUBPROCESS is unset
+    external = kwargs.pop('external', False)
     os.environ["PLATFORMIO_FORCE_COLOR"] = "true"
     os.environ["PLATFORMIO_BUILD_DIR"] = os.path.abspath(CORE.relative_pioenvs_path())
     os.environ["PLATFORMIO_LIBDEPS_DIR"] = os.path.abspath(CORE.relative_piolibdeps_path())
     cmd = ['platformio'] + list(args)
 
-    if os.environ.get('ESPHOME_USE_SUBPROCESS') is None:
+    if not external and not _use_subprocess():
         import platformio.__main__
         try:
             patch_structhash()
@@ -84,16 +96,41 @@ def run_platformio_cli_run(config, verbose, *args, **kwargs):
 
 
 def run_compile(config, verbose):
-    return run_platformio_cli_run(config, verbose)
+    from esphome.writer import OBJECT_CACHE_STATS_NAME, get_object_cache_dir
+
+    if get_object_cache_dir() is None:
+        return run_platformio_cli_run(config, verbose)
+
+    _LOGGER.warning("The object cache (ESPHOME_OBJECT_CACHE) is experimental. Unset it if "
+                    "builds fail or the firmware doesn't behave like a build without it.")
+    # Written by the object cache extra script when the build finishes
+    stats_path = CORE.relative_build_path(OBJECT_CACHE_STATS_NAME)
+    if os.path.isfile(stats_path):
+        os.remove(stats_path)
+    result = run_platformio_cli_run(config, verbose)
+    try:
+        with open(stats_path) as f_handle:
+            stats = json.load(f_handle)
+        _LOGGER.info("Object cache: %s of %s compiled objects were retrieved from the cache.",
+                     stats['hits'], stats['hits'] + stats['misses'])
+    except (IOError, OSError, ValueError, KeyError):
+        _LOGGER.info("Object cache statistics are not available for this build.")
+    return result
 
 
 def run_upload(config, verbose, port):
     return run_platformio_cli_run(config, verbose, '-t', 'upload', '--upload-port', port)
 
 
-def run_idedata(config):
+def run_idedata(config, external=False):
     args = ['-t', 'idedata']
-    stdout = run_platformio_cli_run(config, False, *args, capture_stdout=True)
+    stdout = run_platformio_cli_run(config, False, *args, capture_stdout=True, external=external)
+    if isinstance(stdout, bytes):
+        stdout = stdout.decode('utf-8', 'replace')
+    return _parse_idedata(stdout)
+
+
+def _parse_idedata(stdout):
     match = re.search(r'{.*}', stdout)
     if match is None:
         return IDEData(None)
@@ -104,14 +141,112 @@ def run_idedata(config):
 
 
 IDE_DATA = None
+IDE_DATA_CACHE_VERSION = 1
+# Set once a background refresh of outdated IDE data was started in this process
+_IDE_DATA_REFRESH_STARTED = False
+_IDE_DATA_REFRESH_THREAD = None  # type: Optional[threading.Thread]
 
 
-def get_idedata(config):
+def idedata_cache_path():
+    return CORE.relative_build_path('.esphome_idedata.json')
+
+
+def _platformio_ini_hash():
+    try:
+        with open(CORE.relative_build_path('platformio.ini'), 'rb') as f_handle:
+            return hashlib.sha256(f_handle.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+def _toolchain_version(idedata):
+    # cc_path is <toolchain package>/bin/<prefix>-gcc, platformio records the package version
+    # in the package.json next to the bin directory
+    cc_path = idedata.cc_path
+    if cc_path is None:
+        return None
+    package_json = os.path.join(os.path.dirname(os.path.dirname(cc_path)), 'package.json')
+    try:
+        with open(package_json) as f_handle:
+            return json.load(f_handle).get('version')
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+
+def _load_idedata_cache():
+    try:
+        with open(idedata_cache_path()) as f_handle:
+            cache = json.load(f_handle)
+        if cache['version'] != IDE_DATA_CACHE_VERSION:
+            return None
+        return cache
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_idedata_cache(ini_hash, idedata):
+    if ini_hash is None or not idedata.raw:
+        return
+    content = json.dumps({
+        'version': IDE_DATA_CACHE_VERSION,
+        'platformio_ini': ini_hash,
+        'toolchain': _toolchain_version(idedata),
+        'idedata': idedata.raw,
+    })
+    try:
+        write_file(idedata_cache_path(), content)
+    except EsphomeError as err:
+        _LOGGER.debug("Could not write IDE-data cache: %s", err)
+
+
+def _refresh_idedata(config, ini_hash):
+    """Fetch new IDE data and store it in IDE_DATA and the cache, return True on success."""
     global IDE_DATA
 
-    if IDE_DATA is None:
-        _LOGGER.info("Need to fetch platformio IDE-data, please stand by")
-        IDE_DATA = run_idedata(config)
+    # The in-process platformio call swaps out sys.stdout for the whole process, so the
+    # refresh always runs platformio as a separate process
+    idedata = run_idedata(config, external=True)
+    if not idedata.raw:
+        _LOGGER.warning("Refreshing platformio IDE-data failed, stack traces are decoded "
+                        "with the outdated data.")
+        return False
+    IDE_DATA = idedata
+    _save_idedata_cache(ini_hash, idedata)
+    return True
+
+
+def get_idedata(config):
+    """Get the platformio IDE data for the current build.
+
+    The data is cached in the build directory, keyed by the platformio.ini contents and
+    the toolchain version. A cache entry for an outdated platformio.ini is still used
+    while up-to-date data is fetched in the background.
+    """
+    global IDE_DATA, _IDE_DATA_REFRESH_STARTED, _IDE_DATA_REFRESH_THREAD
+
+    if IDE_DATA is not None:
+        return IDE_DATA
+
+    ini_hash = _platformio_ini_hash()
+    cache = _load_idedata_cache()
+    if cache is not None:
+        cached = IDEData(cache['idedata'])
+        if cache['platformio_ini'] == ini_hash and \
+                cache['toolchain'] == _toolchain_version(cached):
+            IDE_DATA = cached
+            return IDE_DATA
+        if ini_hash is not None and not _IDE_DATA_REFRESH_STARTED:
+            _LOGGER.info("Platformio IDE-data is outdated, refreshing it in the background")
+            _IDE_DATA_REFRESH_STARTED = True
+            _IDE_DATA_REFRESH_THREAD = threading.Thread(target=_refresh_idedata,
+                                                        args=(config, ini_hash))
+            _IDE_DATA_REFRESH_THREAD.daemon = True
+            _IDE_DATA_REFRESH_THREAD.start()
+        return cached
+
+    _LOGGER.info("Need to fetch platformio IDE-data, please stand by")
+    IDE_DATA = run_idedata(config)
+    _save_idedata_cache(ini_hash, IDE_DATA)
     return IDE_DATA
 
 
@@ -155,21 +290,117 @@ ESP8266_EXCEPTION_CODES = {
 }
 
 
-def _decode_pc(config, addr):
+class AddressDecoder(object):
+    """Translates program counters to function names and source lines.
+
+    A single addr2line process is kept running and fed addresses over stdin instead of
+    starting a new one for every address, and translations are memoized.
+    """
+
+    def __init__(self, addr2line_path, elf_path):
+        self.addr2line_path = addr2line_path
+        self.elf_path = elf_path
+        self._process = None
+        self._cache = {}
+
+    def _start(self):
+        command = [self.addr2line_path, '-pfiaC', '-e', self.elf_path]
+        with open(os.devnull, 'w') as devnull:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE, stderr=devnull,
+                                             universal_newlines=True)
+
+    def _translate(self, addrs):
+        if self._process is None:
+            self._start()
+        # addr2line flushes its output after every address it reads from stdin. With -a every
+        # translation starts with the address, inlined frames follow on extra lines. The zero
+        # address at the end marks the end of the batch.
+        self._process.stdin.write(u''.join(u'{}\n'.format(addr) for addr in addrs) + u'0\n')
+        self._process.stdin.flush()
+        result = []
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                raise EOFError("addr2line exited")
+            line = line.rstrip('\n')
+            if line.startswith(' (inlined by)'):
+                if result:
+                    result[-1].append(line)
+            else:
+                if len(result) == len(addrs):
+                    # Translation of the end marker
+                    return result
+                result.append([line])
+
+    def decode(self, addrs):
+        """Decode a list of addresses (hex strings) in one batch.
+
+        Returns a dict of address to translation, None for addresses that don't belong to
+        a known function.
+        """
+        missing = [addr for addr in OrderedDict.fromkeys(addrs) if addr not in self._cache]
+        if missing:
+            try:
+                # Small batches so that the pipe buffers can't fill up in both directions
+                translations = []
+                for i in range(0, len(missing), 64):
+                    translations += self._translate(missing[i:i + 64])
+            except (OSError, IOError, EOFError, ValueError):
+                self.close()
+                translations = [None] * len(missing)
+            for addr, lines in zip(missing, translations):
+                translation = None if lines is None else u'\n'.join(lines)
+                if translation is None or "?? ??:0" in translation:
+                    # Nothing useful
+                    translation = None
+                else:
+                    translation = translation.replace(' at ??:?', '').replace(':?', '')
+                self._cache[addr] = translation
+        return {addr: self._cache[addr] for addr in addrs}
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+            self._process.wait()
+        except (OSError, IOError):
+            pass
+        self._process = None
+
+
+_DECODER = None
+
+
+def get_address_decoder(config):
+    global _DECODER
+
     idedata = get_idedata(config)
     if not idedata.addr2line_path or not idedata.firmware_elf_path:
+        return None
+    if _DECODER is None or _DECODER.addr2line_path != idedata.addr2line_path or \
+            _DECODER.elf_path != idedata.firmware_elf_path:
+        if _DECODER is not None:
+            _DECODER.close()
+        _DECODER = AddressDecoder(idedata.addr2line_path, idedata.firmware_elf_path)
+    return _DECODER
+
+
+def _decode_pcs(config, addrs):
+    if not addrs:
         return
-    command = [idedata.addr2line_path, '-pfiaC', '-e', idedata.firmware_elf_path, addr]
-    try:
-        translation = subprocess.check_output(command).strip()
-    except Exception:  # pylint: disable=broad-except
+    decoder = get_address_decoder(config)
+    if decoder is None:
         return
+    translations = decoder.decode(addrs)
+    for addr in addrs:
+        if translations[addr] is not None:
+            _LOGGER.warning("Decoded %s", translations[addr])
 
-    if "?? ??:0" in translation:
-        # Nothing useful
-        return
-    translation = translation.replace(' at ??:?', '').replace(':?', '')
-    _LOGGER.warning("Decoded %s", translation)
+
+def _decode_pc(config, addr):
+    _decode_pcs(config, [addr])
 
 
 def _parse_register(config, regex, line):
@@ -215,8 +446,7 @@ def process_stacktrace(config, line, backtrace_state):
     match = re.match(STACKTRACE_ESP32_BACKTRACE_RE, line)
     if match is not None:
         _LOGGER.warning("Found stack trace! Trying to decode it")
-        for addr in re.finditer(STACKTRACE_ESP32_BACKTRACE_PC_RE, line):
-            _decode_pc(config, addr.group())
+        _decode_pcs(config, STACKTRACE_ESP32_BACKTRACE_PC_RE.findall(line))
 
     # ESP8266 multi-line backtrace
     if '>>>stack>>>' in line:
@@ -228,8 +458,7 @@ def process_stacktrace(config, line, backtrace_state):
         backtrace_state = False
 
     if backtrace_state:
-        for addr in re.finditer(STACKTRACE_ESP8266_BACKTRACE_PC_RE, line):
-            _decode_pc(config, addr.group())
+        _decode_pcs(config, STACKTRACE_ESP8266_BACKTRACE_PC_RE.findall(line))
 
     return backtrace_state
 
@@ -263,3 +492,10 @@ class IDEData(object):
             return None
         # replace gcc at end with addr2line
         return cc_path[:-3] + 'addr2line'
+
+    @property
+    def nm_path(self):
+        cc_path = self.cc_path
+        if cc_path is None:
+            return None
+        return cc_path[:-3] + 'nm'
@@ -0,0 +1,163 @@
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import time
+import weakref
+
+from esphome.util import OrderedDict, safe_print
+
+if False:  # pylint: disable=using-constant-test
+    from typing import Dict, Tuple  # noqa
+
+if hasattr(time, 'perf_counter'):
+    wall_clock = time.perf_counter
+    cpu_clock = time.process_time  # pylint: disable=no-member
+else:
+    wall_clock = time.time
+    cpu_clock = time.clock  # pylint: disable=no-member
+
+
+def _task_label(func):
+    """Get the component domain a to_code coroutine belongs to from its module name."""
+    module = getattr(func, '__module__', None) or '?'
+    if module.startswith('esphome.components.'):
+        parts = module[len('esphome.components.'):].split('.')
+        if len(parts) == 2:
+            # Platform modules like dht.sensor, use the same sensor.dht label as validation
+            return u'{}.{}'.format(parts[1], parts[0])
+        return parts[0]
+    if module == 'esphome.core_config':
+        return 'esphome'
+    return module
+
+
+class Timing(object):
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.count = 0
+
+    def add(self, wall, cpu):
+        self.wall += wall
+        self.cpu += cpu
+        self.count += 1
+
+    def as_dict(self):
+        return {
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'count': self.count,
+        }
+
+
+class Profiler(object):
+    """Records wall-clock and CPU time for the phases of an esphome run.
+
+    Phases are the big steps (loading YAML, validation, code generation, ...), domains
+    the time spent per component in validation and in to_code.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.phases = OrderedDict()  # type: Dict[str, Timing]
+        self.domains = OrderedDict()  # type: Dict[Tuple[str, str], Timing]
+        # Chrome trace events, only recorded if trace is True
+        self.trace = False
+        self.events = []
+        self._task_labels = weakref.WeakKeyDictionary()
+        self._start_wall = None
+        self._start_cpu = None
+
+    def enable(self, trace=False):
+        self.enabled = True
+        self.trace = trace
+        self._start_wall = wall_clock()
+        self._start_cpu = cpu_clock()
+
+    def _record(self, timings, key, name, category, start_wall, start_cpu):
+        wall = wall_clock() - start_wall
+        cpu = cpu_clock() - start_cpu
+        if key not in timings:
+            timings[key] = Timing()
+        timings[key].add(wall, cpu)
+        if self.trace:
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': int((start_wall - self._start_wall) * 1e6),
+                'dur': int(wall * 1e6),
+                'pid': os.getpid(),
+                'tid': 0,
+                'args': {'cpu_ms': round(cpu * 1e3, 3)},
+            })
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start_wall, start_cpu = wall_clock(), cpu_clock()
+        try:
+            yield
+        finally:
+            self._record(self.phases, name, name, 'phase', start_wall, start_cpu)
+
+    @contextlib.contextmanager
+    def domain(self, stage, domain):
+        if not self.enabled:
+            yield
+            return
+        start_wall, start_cpu = wall_clock(), cpu_clock()
+        try:
+            yield
+        finally:
+            self._record(self.domains, (stage, domain), u'{} {}'.format(stage, domain), stage,
+                         start_wall, start_cpu)
+
+    def register_task(self, task, func):
+        self._task_labels[task] = _task_label(func)
+
+    def task_step(self, task):
+        return self.domain('to_code', self._task_labels.get(task, '?'))
+
+    def as_dict(self):
+        return {
+            'total': {
+                'wall': round(wall_clock() - self._start_wall, 6),
+                'cpu': round(cpu_clock() - self._start_cpu, 6),
+            },
+            'phases': [dict(name=name, **timing.as_dict())
+                       for name, timing in self.phases.items()],
+            'domains': [dict(stage=stage, domain=domain, **timing.as_dict())
+                        for (stage, domain), timing in self.domains.items()],
+        }
+
+    def print_summary(self):
+        data = self.as_dict()
+        line = u"  {:<32} {:>9.3f}s {:>9.3f}s"
+        safe_print(u"Profile (wall / cpu):")
+        safe_print(line.format(u'total', data['total']['wall'], data['total']['cpu']))
+        for phase in data['phases']:
+            safe_print(line.format(phase['name'], phase['wall'], phase['cpu']))
+        slowest = sorted(data['domains'], key=lambda x: x['wall'], reverse=True)[:15]
+        if slowest:
+            safe_print(u"Slowest components:")
+        for domain in slowest:
+            name = u'{} {}'.format(domain['stage'], domain['domain'])
+            safe_print(line.format(name, domain['wall'], domain['cpu']))
+
+    def save_json(self, path, **extra):
+        data = self.as_dict()
+        data.update(extra)
+        with open(path, 'w') as f_handle:
+            json.dump(data, f_handle, indent=2, sort_keys=True)
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w') as f_handle:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f_handle)
+
+
+PROFILER = Profiler()
@@ -1,4 +1,5 @@
 import functools
+import os
 import sys
 
 PYTHON_MAJOR = sys.version_info[0]
@@ -79,3 +80,14 @@ else:
     def decode_text(data, encoding='utf-8', errors='strict'):
         # type: (bytes, str, str) -> str
         return data.decode(encoding=encoding, errors=errors)
+
+
+if IS_PY2:
+    def replace_file(src, dst):
+        # os.rename can't overwrite files on Windows
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+else:
+    def replace_file(src, dst):
+        os.replace(src, dst)
@@ -0,0 +1,203 @@
+from __future__ import print_function
+
+import json
+import logging
+import os
+import subprocess
+
+from esphome.core import CORE, EsphomeError
+from esphome.helpers import color
+from esphome.util import OrderedDict, safe_print
+
+if False:  # pylint: disable=using-constant-test
+    from typing import Dict  # noqa
+
+_LOGGER = logging.getLogger(__name__)
+
+REGIONS = ['flash', 'iram', 'dram']
+
+MAIN_CPP_GLOBALS = u'main.cpp (globals)'
+MAIN_CPP_SETUP = u'main.cpp (setup)'
+MAIN_CPP_USER = u'main.cpp (user code)'
+OTHER = u'[other]'
+
+
+def memory_region(section):
+    """Get the memory region (flash, iram or dram) an ELF section is loaded to.
+
+    On the ESP8266 .text is the code in IRAM and .irom0.text the code in flash, on the ESP32
+    the sections are called .iram0.text and .flash.text. Sections that don't use memory on
+    the device (debug info, ...) return None.
+    """
+    if 'iram' in section or section == '.text':
+        return 'iram'
+    if 'flash' in section or 'irom' in section:
+        return 'flash'
+    if any(x in section for x in ('dram', 'data', 'bss', 'rodata')):
+        return 'dram'
+    return None
+
+
+def read_symbols(nm_path, elf_path):
+    """Read the symbols from an ELF file.
+
+    Returns a list of (name, size, section, source path, line) tuples, the source path and
+    line are None for symbols without debug info.
+    """
+    command = [nm_path, '--format=sysv', '--print-size', '--line-numbers', '--demangle',
+               elf_path]
+    try:
+        with open(os.devnull, 'w') as devnull:
+            output = subprocess.check_output(command, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError) as err:
+        raise EsphomeError(u"Could not read symbols from {}: {}".format(elf_path, err))
+
+    symbols = []
+    seen = set()
+    for line in output.decode('utf-8', 'replace').splitlines():
+        # name|value|class|type|size|line|section<TAB>file:line, demangled names can contain |
+        parts = line.rsplit('|', 6)
+        if len(parts) != 7:
+            continue
+        name, value, _, _, size, _, section = [x.strip() for x in parts]
+        if not size:
+            continue
+        section, _, source = section.partition('\t')
+        key = (value, section)
+        if key in seen:
+            # Aliases like C1/C2 constructors share their code
+            continue
+        seen.add(key)
+        path, lineno = None, None
+        if source:
+            path, _, lineno = source.rpartition(':')
+            lineno = int(lineno) if lineno.isdigit() else None
+        symbols.append((name, int(size, 16), section, path or None, lineno))
+    return symbols
+
+
+def _main_cpp_sections(path):
+    """Get the line ranges of the sections in main.cpp.
+
+    Returns a list of (first line, last line, label) tuples for the generated sections,
+    all other lines are user code.
+    """
+    # pylint: disable=cyclic-import
+    from esphome.writer import CPP_AUTO_GENERATE_BEGIN, CPP_AUTO_GENERATE_END, \
+        CPP_INCLUDE_BEGIN, CPP_INCLUDE_END
+
+    markers = [
+        (CPP_INCLUDE_BEGIN, CPP_INCLUDE_END, MAIN_CPP_GLOBALS),
+        (CPP_AUTO_GENERATE_BEGIN, CPP_AUTO_GENERATE_END, MAIN_CPP_SETUP),
+    ]
+    sections = []
+    start = None
+    setup_line = None
+    try:
+        with open(path, 'rb') as f_handle:
+            for lineno, line in enumerate(f_handle, 1):
+                line = line.decode('utf-8', 'replace')
+                begin, end, label = markers[len(sections)]
+                if line.startswith(u'void setup()'):
+                    # The debug info of setup() itself points to its first line
+                    setup_line = lineno
+                if start is None and begin in line:
+                    start = lineno
+                    if label == MAIN_CPP_SETUP and setup_line is not None:
+                        start = setup_line
+                elif start is not None and end in line:
+                    sections.append((start, lineno, label))
+                    start = None
+                    if len(sections) == len(markers):
+                        break
+    except (IOError, OSError):
+        pass
+    return sections
+
+
+class SizeReport(object):
+    """Flash, IRAM and DRAM usage per component of a firmware ELF.
+
+    Symbols are attributed using the source file of their debug info, with the source
+    layout copy_src_tree creates in the build directory: esphome/core, the components in
+    esphome/components/<domain> and the generated main.cpp. Relative paths in the debug
+    info are relative to the build directory platformio compiles in, unknown paths (??)
+    and files outside the src directory are counted as [other].
+    """
+
+    def __init__(self, elf_path, src_path):
+        self.elf_path = elf_path
+        self.src_path = os.path.abspath(src_path)
+        self.main_cpp_sections = _main_cpp_sections(os.path.join(self.src_path, 'main.cpp'))
+        self.totals = OrderedDict((region, 0) for region in REGIONS)
+        self.components = {}  # type: Dict[str, Dict[str, int]]
+
+    def owner(self, path, lineno):
+        if path is None or path.startswith('??'):
+            return OTHER
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(self.src_path), path)
+        path = os.path.normpath(path)
+        if not path.startswith(self.src_path + os.sep):
+            return OTHER
+        parts = os.path.relpath(path, self.src_path).split(os.sep)
+        if parts == ['main.cpp']:
+            for start, end, label in self.main_cpp_sections:
+                if lineno is not None and start <= lineno <= end:
+                    return label
+            return MAIN_CPP_USER
+        if parts[0] != 'esphome':
+            return OTHER
+        if len(parts) > 3 and parts[1] == 'components':
+            return parts[2]
+        return u'core'
+
+    def add(self, symbols):
+        for _, size, section, path, lineno in symbols:
+            region = memory_region(section)
+            if region is None:
+                continue
+            owner = self.owner(path, lineno)
+            if owner not in self.components:
+                self.components[owner] = OrderedDict((x, 0) for x in REGIONS)
+            self.components[owner][region] += size
+            self.totals[region] += size
+
+    def sorted_components(self):
+        return sorted(self.components.items(), key=lambda x: (-sum(x[1].values()), x[0]))
+
+    def as_dict(self):
+        return {
+            'elf': self.elf_path,
+            'totals': dict(self.totals),
+            'components': {name: dict(sizes) for name, sizes in self.components.items()},
+        }
+
+    def print_report(self):
+        line = u"  {:<32} {:>10} {:>10} {:>10}"
+        safe_print(color('bold_white', line.format(u'Component', u'Flash', u'IRAM', u'DRAM')))
+        for name, sizes in self.sorted_components():
+            safe_print(line.format(name, *sizes.values()))
+        safe_print(color('bold_white', line.format(u'Total', *self.totals.values())))
+
+    def save_json(self, path, **extra):
+        data = self.as_dict()
+        data.update(extra)
+        with open(path, 'w') as f_handle:
+            json.dump(data, f_handle, indent=2, sort_keys=True)
+
+
+def create_size_report(config):
+    from esphome.platformio_api import get_idedata
+
+    idedata = get_idedata(config)
+    elf_path = idedata.firmware_elf_path
+    if elf_path is None or not os.path.isfile(elf_path):
+        raise EsphomeError(u"Could not find the firmware ELF file, please compile the "
+                           u"firmware first.")
+    if idedata.nm_path is None:
+        raise EsphomeError(u"Could not find the nm tool of the toolchain.")
+    _LOGGER.info("Reading symbols from %s", elf_path)
+    report = SizeReport(elf_path, CORE.relative_src_path())
+    report.add(read_symbols(idedata.nm_path, elf_path))
+    return report
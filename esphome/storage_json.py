@@ -21,6 +21,11 @@ def storage_path():  # type: () -> str
     return CORE.relative_path('.esphome', '{}.json'.format(CORE.config_filename))
 
 
+def firmware_base_path():  # type: () -> str
+    """The copy of the firmware last uploaded over OTA, delta updates send a patch against it."""
+    return CORE.relative_path('.esphome', '{}.firmware.bin'.format(CORE.config_filename))
+
+
 def ext_storage_path(base_path, config_filename):  # type: (str, str) -> str
     return os.path.join(base_path, '.esphome', '{}.json'.format(config_filename))
 
@@ -37,7 +42,7 @@ def trash_storage_path(base_path):  # type: (str) -> str
 class StorageJSON(object):
     def __init__(self, storage_version, name, esphome_version,
                  src_version, arduino_version, address, esp_platform, board, build_path,
-                 firmware_bin_path):
+                 firmware_bin_path, config_hash=None):
         # Version of the storage JSON schema
         assert storage_version is None or isinstance(storage_version, int)
         self.storage_version = storage_version  # type: int
@@ -61,6 +66,9 @@ class StorageJSON(object):
         self.build_path = build_path  # type: str
         # The absolute path to the firmware binary
         self.firmware_bin_path = firmware_bin_path  # type: str
+        # Hash of the validated config, esphome version and component sources the code in
+        # build_path was generated from. None if the generated code may be outdated
+        self.config_hash = config_hash  # type: Optional[str]
 
     def as_dict(self):
         return {
@@ -74,6 +82,7 @@ class StorageJSON(object):
             'board': self.board,
             'build_path': self.build_path,
             'firmware_bin_path': self.firmware_bin_path,
+            'config_hash': self.config_hash,
         }
 
     def to_json(self):
@@ -97,6 +106,7 @@ class StorageJSON(object):
             board=esph.board,
             build_path=esph.build_path,
             firmware_bin_path=esph.firmware_bin,
+            config_hash=None,
         )
 
     @staticmethod
@@ -113,13 +123,14 @@ class StorageJSON(object):
             board=board,
             build_path=None,
             firmware_bin_path=None,
+            config_hash=None,
         )
 
     @staticmethod
     def _load_impl(path):  # type: (str) -> Optional[StorageJSON]
         with codecs.open(path, 'r', encoding='utf-8') as f_handle:
             text = f_handle.read()
-        storage = json.loads(text, encoding='utf-8')
+        storage = json.loads(text)
         storage_version = storage['storage_version']
         name = storage.get('name')
         esphome_version = storage.get('esphome_version', storage.get('esphomeyaml_version'))
@@ -130,9 +141,10 @@ class StorageJSON(object):
         board = storage.get('board')
         build_path = storage.get('build_path')
         firmware_bin_path = storage.get('firmware_bin_path')
+        config_hash = storage.get('config_hash')
         return StorageJSON(storage_version, name, esphome_version,
                            src_version, arduino_version, address, esp_platform, board, build_path,
-                           firmware_bin_path)
+                           firmware_bin_path, config_hash)
 
     @staticmethod
     def load(path):  # type: (str) -> Optional[StorageJSON]
@@ -189,7 +201,7 @@ class EsphomeStorageJSON(object):
     def _load_impl(path):  # type: (str) -> Optional[EsphomeStorageJSON]
         with codecs.open(path, 'r', encoding='utf-8') as f_handle:
             text = f_handle.read()
-        storage = json.loads(text, encoding='utf-8')
+        storage = json.loads(text)
         storage_version = storage['storage_version']
         cookie_secret = storage.get('cookie_secret')
         last_update_check = storage.get('last_update_check')
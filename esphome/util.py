@@ -133,24 +133,21 @@ def run_external_process(*cmd, **kwargs):
     _LOGGER.info(u"Running:  %s", full_cmd)
 
     capture_stdout = kwargs.get('capture_stdout', False)
-    if capture_stdout:
-        sub_stdout = io.BytesIO()
-    else:
-        sub_stdout = RedirectText(sys.stdout)
-
     sub_stderr = RedirectText(sys.stderr)
 
     try:
+        if capture_stdout:
+            # subprocess needs a real file to write to, read the output through a pipe
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=sub_stderr)
+            return proc.communicate()[0]
         return subprocess.call(cmd,
-                               stdout=sub_stdout,
+                               stdout=RedirectText(sys.stdout),
                                stderr=sub_stderr)
     except Exception as err:  # pylint: disable=broad-except
         _LOGGER.error(u"Running command failed: %s", err)
         _LOGGER.error(u"Please try running %s locally.", full_cmd)
-    finally:
         if capture_stdout:
-            # pylint: disable=lost-exception
-            return sub_stdout.getvalue()
+            return b''
 
 
 def is_dev_esphome_version():
@@ -24,9 +24,10 @@ class _Schema(vol.Schema):
                                 ((self.required and not isinstance(key, (vol.Optional, vol.Remove)))
                                  or isinstance(key, vol.Required)))
 
-        # Keys that may have defaults
-        all_default_keys = set(key for key in schema
-                               if isinstance(key, (vol.Required, vol.Optional)))
+        # Keys that may have defaults, in schema order so that defaults are inserted in the
+        # same order in every run
+        all_default_keys = [key for key in schema
+                            if isinstance(key, (vol.Required, vol.Optional))]
 
         _compiled_schema = {}
         for skey, svalue in vol.iteritems(schema):
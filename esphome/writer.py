@@ -1,15 +1,29 @@
 from __future__ import print_function
 
+import codecs
+import collections
+import hashlib
+import itertools
+import json
 import logging
 import os
 import re
+import sys
 
+# pylint: disable=unused-import, wrong-import-order
+from typing import List, Optional, Set, Tuple  # noqa
+
+from esphome import const
 from esphome.config import iter_components
 from esphome.const import CONF_BOARD_FLASH_MODE, CONF_ESPHOME, CONF_PLATFORMIO_OPTIONS, \
     HEADER_FILE_EXTENSIONS, SOURCE_FILE_EXTENSIONS
-from esphome.core import CORE, EsphomeError
-from esphome.helpers import mkdir_p, read_file, write_file_if_changed
+from esphome.core import CORE, EsphomeError, ID, IPAddress, Lambda, MACAddress, TimePeriod
+from esphome.helpers import mkdir_p, read_file, write_file, write_file_if_changed
+from esphome.profiling import PROFILER
+from esphome.py_compat import binary_type, integer_types, replace_file, string_types, \
+    text_type
 from esphome.storage_json import StorageJSON, storage_path
+from esphome.util import OrderedDict
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -185,6 +199,238 @@ def gather_build_flags():
     return list(sorted(list(build_flags)))
 
 
+OBJECT_CACHE_SCRIPT_NAME = 'esphome_object_cache.py'
+OBJECT_CACHE_STATS_NAME = '.esphome_object_cache_stats.json'
+OBJECT_CACHE_SCRIPT = u"""\
+# Auto generated by esphome: Store compiled objects in a cache directory shared by all nodes.
+# SCons keys the cache on the compiler command line and the content of the source file and
+# all headers it includes (including defines.h), so identical objects only compile once.
+import atexit
+import json
+
+import SCons.CacheDir
+
+Import("env")  # noqa
+
+env.CacheDir({cache_dir})  # noqa
+
+STATS = {{'hits': 0, 'misses': 0}}
+
+
+def _patch_retrieve():
+    orig = SCons.CacheDir.CacheDir.retrieve
+
+    def retrieve(self, node):
+        result = orig(self, node)
+        if str(node).endswith('.o'):
+            STATS['hits' if result else 'misses'] += 1
+        return result
+
+    SCons.CacheDir.CacheDir.retrieve = retrieve
+
+
+def _save_stats():
+    with open({stats_path}, 'w') as f_handle:
+        json.dump(STATS, f_handle)
+
+
+try:
+    _patch_retrieve()
+    atexit.register(_save_stats)
+except Exception:  # pylint: disable=broad-except
+    pass
+"""
+
+
+def get_object_cache_dir():  # type: () -> Optional[str]
+    """Get the shared object cache directory, None if the cache is not enabled.
+
+    The cache is experimental and off by default. Set the ESPHOME_OBJECT_CACHE environment
+    variable to a directory to enable it. It has been tested with SCons directly, but not
+    yet with real ESP8266/ESP32 builds.
+    """
+    path = os.environ.get('ESPHOME_OBJECT_CACHE')
+    if not path:
+        return None
+    return os.path.abspath(os.path.expanduser(path))
+
+
+UNITY_BUILD_DIR = 'esphome_unity'
+
+
+def get_unity_build_size():  # type: () -> Optional[int]
+    """Get the number of source files per unity build unit, None if not enabled.
+
+    Unity builds are experimental and off by default, set the ESPHOME_UNITY_BUILD environment
+    variable to the number of files per unit to enable them. The units have been checked
+    with host compilers, but not yet compiled for ESP8266/ESP32.
+
+    Clashes are found for file-level statics, anonymous namespace members, macros and
+    using-directives (see _unity_build_units). Names in nested scopes, like the enumerators
+    of an enum in an anonymous namespace, and statics that don't start a line aren't
+    checked. script/benchmark/unity_build.py compares the compile times.
+    """
+    value = os.environ.get('ESPHOME_UNITY_BUILD')
+    if not value:
+        return None
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise EsphomeError(u"ESPHOME_UNITY_BUILD must be the number of source files per unit, "
+                           u"got '{}'".format(value))
+    return size
+
+
+# Names a source file defines at file level: statics at the start of a line and macros
+_FILE_LEVEL_NAME_RE = re.compile(r'^(?:static\s[^;=({]*?\b(\w+)\s*(?:\[[^\]]*\]\s*)?[;=({]|'
+                                 r'#\s*define\s+(\w+))', re.MULTILINE)
+# Comments and string literals, removed before the scopes of a file are followed
+_CODE_NOISE_RE = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'',
+                            re.DOTALL)
+_SCOPE_TOKEN_RE = re.compile(r'\bnamespace(\s+[\w:]+)?\s*\{|\busing\s+namespace\s+[\w:]+\s*;|[{};]')
+# The name a declaration in an anonymous namespace introduces
+_DECLARATION_NAME_RE = re.compile(r'\b(?:struct|class|union|enum(?:\s+class)?)\s+(\w+)|'
+                                  r'\b(?!(?:struct|class|union|enum|namespace)\b)(\w+)\s*'
+                                  r'(?:\[[^\]]*\]\s*)?[=({;]')
+# Marks the files with a using-directive outside of functions, see _unity_build_units
+_USING_NAMESPACE = u'using namespace'
+
+
+def _unity_scoped_names(content, component):
+    """Get the names declared in anonymous namespaces and the using-directives of a file.
+
+    Anonymous namespace members act like statics of the enclosing namespace. A using-directive
+    is returned as _USING_NAMESPACE, with the component if it is inside a namespace or
+    None if it is at global scope. Enumerators and the members of nested scopes aren't
+    returned.
+    """
+    content = _CODE_NOISE_RE.sub(u' ', content)
+    stack = []  # namespace, anonymous or block for each open brace
+    names = set()
+    start = 0
+    for match in _SCOPE_TOKEN_RE.finditer(content):
+        token = match.group()
+        scope = component if u'namespace' in stack else None
+        if token.startswith(u'using'):
+            if u'block' not in stack:
+                names.add((scope, _USING_NAMESPACE))
+        elif stack and stack[-1] == u'anonymous':
+            declaration = _DECLARATION_NAME_RE.search(content, start, match.end())
+            if declaration is not None:
+                names.add((scope, declaration.group(1) or declaration.group(2)))
+        start = match.end()
+        if token.startswith(u'namespace'):
+            stack.append(u'namespace' if match.group(1) else u'anonymous')
+        elif token == u'{':
+            stack.append(u'block')
+        elif token == u'}' and stack:
+            stack.pop()
+    return names
+
+
+def _unity_file_level_names(path, component):
+    """Get the names a source file defines at file level that can clash in a unity unit.
+
+    Statics and anonymous namespace members are in the namespace of their component, so they
+    are returned together with the component. TAG is left out, every file gets its own TAG in
+    the unit (see _unity_unit_content).
+    """
+    try:
+        content = read_file(path)
+    except EsphomeError:
+        return set()
+    names = {(scope, name) for scope, name in _unity_scoped_names(content, component)
+             if name != 'TAG'}
+    for static, macro in _FILE_LEVEL_NAME_RE.findall(content):
+        if macro:
+            names.add((None, macro))
+        elif static != 'TAG':
+            names.add((component, static))
+    return names
+
+
+def _unity_component(target):
+    # esphome/components/<name>/... or esphome/core/...
+    parts = target.split('/')
+    return u'/'.join(parts[:3] if parts[1] == 'components' else parts[:2])
+
+
+def _unity_build_units(sources, size):
+    """Split the C++ source files into the units of a unity build, grouped by component.
+
+    sources maps the target path of each source file to its path on disk. The files of a
+    component go into as few units as possible, small components share a unit with the one
+    before them. Two files of a component that define the same file-level static or
+    anonymous namespace member, or two files that define the same macro, never share a unit.
+
+    A using-directive applies to all code after it in the unit, so a file with one is the last
+    file of its component in the unit, or the last file of the unit if the directive is at
+    global scope. These files are put after the other files of their component.
+    """
+    units = []  # type: List[Tuple[List[str], Set[Tuple[Optional[str], str]]]]
+    by_component = OrderedDict()
+    for target in sorted(sources):
+        by_component.setdefault(_unity_component(target), []).append(target)
+    for component, targets in by_component.items():
+        names = {target: _unity_file_level_names(sources[target], component)
+                 for target in targets}
+        closed = {(component, _USING_NAMESPACE), (None, _USING_NAMESPACE)}
+        # The last unit of the previous component is only used if it has room left
+        candidates = units[-1:]
+        for target in sorted(targets, key=lambda x: bool(names[x] & closed)):
+            for unit, unit_names in candidates:
+                if len(unit) < size and not names[target] & unit_names and \
+                        not closed & unit_names:
+                    break
+            else:
+                unit, unit_names = [], set()
+                units.append((unit, unit_names))
+                candidates.append(units[-1])
+            unit.append(target)
+            unit_names.update(names[target])
+    return [unit for unit, _ in units]
+
+
+def _unity_build_sources():
+    source_files = {}
+    for _, component, _ in iter_components(CORE.config):
+        source_files.update(component.source_files)
+    return {target: path for target, path in source_files.items() if target.endswith('.cpp')}
+
+
+def _unity_unit_content(unit):
+    content = u'// Auto generated code by esphome\n'
+    for i, target in enumerate(unit):
+        # Files of a component all define a static TAG, give each file its own
+        content += u'#define TAG TAG_{}\n#include "{}"\n#undef TAG\n'.format(i, target)
+    return content
+
+
+def write_unity_build():
+    """Write the unity build units and remove the units that are no longer used."""
+    size = get_unity_build_size()
+    units = []
+    if size is not None:
+        _LOGGER.warning("Unity builds (ESPHOME_UNITY_BUILD) are experimental. Unset it if the "
+                        "build fails.")
+        units = _unity_build_units(_unity_build_sources(), size)
+
+    unity_dir = CORE.relative_src_path(UNITY_BUILD_DIR)
+    paths = set()
+    for i, unit in enumerate(units):
+        path = os.path.join(unity_dir, u'unity_{}.cpp'.format(i))
+        write_file_if_changed(_unity_unit_content(unit), path)
+        paths.add(path)
+    if os.path.isdir(unity_dir):
+        for path in walk_files(unity_dir):
+            if path not in paths:
+                os.remove(path)
+        if not paths:
+            os.rmdir(unity_dir)
+
+
 def get_ini_content():
     lib_deps = gather_lib_deps()
     build_flags = gather_build_flags()
@@ -219,6 +465,20 @@ def get_ini_content():
     # data['lib_ldf_mode'] = 'chain'
     data.update(CORE.config[CONF_ESPHOME].get(CONF_PLATFORMIO_OPTIONS, {}))
 
+    if get_object_cache_dir() is not None:
+        extra_scripts = data.get('extra_scripts', [])
+        if isinstance(extra_scripts, string_types):
+            extra_scripts = [extra_scripts]
+        data['extra_scripts'] = list(extra_scripts) + [OBJECT_CACHE_SCRIPT_NAME]
+
+    if get_unity_build_size() is not None:
+        # The sources are compiled through the unity build units, which include them
+        src_filter = data.get('src_filter', '+<*>')
+        if isinstance(src_filter, (list, tuple)):
+            src_filter = u' '.join(src_filter)
+        data['src_filter'] = [src_filter] + [u'-<{}>'.format(target)
+                                             for target in sorted(_unity_build_sources())]
+
     content = u'[env:{}]\n'.format(CORE.name)
     content += format_ini(data)
 
@@ -244,6 +504,120 @@ def find_begin_end(text, begin_s, end_s):
     return text[:begin_index], text[(end_index + len(end_s)):]
 
 
+def _hash_update_text(hasher, text):
+    if isinstance(text, text_type):
+        text = text.encode('utf-8')
+    # Length prefix so that adjacent values can't be confused
+    hasher.update(u'{}:'.format(len(text)).encode('ascii'))
+    hasher.update(text)
+
+
+def _hash_file(hasher, path):
+    with open(path, 'rb') as f_handle:
+        hasher.update(hashlib.sha256(f_handle.read()).digest())
+
+
+def _hash_config_value(hasher, value):
+    if isinstance(value, dict):
+        hasher.update(b'{')
+        items = value.items()
+        if not isinstance(value, collections.OrderedDict):
+            # Validation can build plain dicts in set iteration order, which changes with
+            # PYTHONHASHSEED between runs. The order of OrderedDicts is part of the config.
+            items = sorted(items, key=lambda kv: text_type(kv[0]))
+        for key, val in items:
+            _hash_config_value(hasher, key)
+            _hash_config_value(hasher, val)
+        hasher.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        hasher.update(b'[')
+        for val in value:
+            _hash_config_value(hasher, val)
+        hasher.update(b']')
+    elif isinstance(value, ID):
+        _hash_update_text(hasher, u'ID {} {} {}'.format(value.id, value.type,
+                                                        value.is_declaration))
+    elif isinstance(value, Lambda):
+        _hash_update_text(hasher, u'Lambda ' + value.value)
+    elif isinstance(value, string_types):
+        _hash_update_text(hasher, u'str ' + value)
+        # Strings can reference files (fonts, images, includes), hash their content too
+        try:
+            path = CORE.relative_path(value)
+            if os.path.isfile(path):
+                _hash_file(hasher, path)
+        except (ValueError, TypeError, IOError, OSError):
+            pass
+    elif isinstance(value, binary_type):
+        _hash_update_text(hasher, b'bytes ' + value)
+    elif value is None or isinstance(value, (bool, float) + integer_types) or \
+            isinstance(value, (TimePeriod, IPAddress, MACAddress)):
+        # These have a str() that includes everything they hold
+        _hash_update_text(hasher, u'{} {}'.format(type(value).__name__, value))
+    else:
+        # Unknown types usually have a repr() with their memory address, which means the
+        # hash never matches. Better than reusing code generated from a different config.
+        _hash_update_text(hasher, u'{} {!r}'.format(type(value).__name__, value))
+
+
+def get_config_hash():  # type: () -> str
+    """Hash everything the generated source code depends on.
+
+    That's the validated config (including files referenced from it), the esphome version,
+    the esphome python modules and the source files of all used components.
+    """
+    hasher = hashlib.sha256()
+    _hash_update_text(hasher, const.__version__)
+    _hash_config_value(hasher, CORE.config)
+    # Changes platformio.ini
+    _hash_update_text(hasher, get_object_cache_dir() or u'')
+    _hash_update_text(hasher, text_type(get_unity_build_size()))
+
+    esphome_path = os.path.dirname(os.path.abspath(const.__file__))
+    for path in sorted(walk_files(esphome_path)):
+        if not path.endswith('.py'):
+            continue
+        stat = os.stat(path)
+        _hash_update_text(hasher, u'{} {} {}'.format(os.path.relpath(path, esphome_path),
+                                                     stat.st_size, stat.st_mtime))
+
+    source_files = {}
+    for _, component, _ in iter_components(CORE.config):
+        source_files.update(component.source_files)
+    for target, path in sorted(source_files.items()):
+        _hash_update_text(hasher, target)
+        _hash_file(hasher, path)
+    return hasher.hexdigest()
+
+
+def is_code_up_to_date(config_hash):  # type: (str) -> bool
+    """Check if the source code in the build directory was generated from config_hash."""
+    storage = StorageJSON.load(storage_path())
+    if storage is None or storage.config_hash != config_hash:
+        return False
+    for path in [CORE.relative_build_path('platformio.ini'), CORE.relative_src_path('main.cpp'),
+                 CORE.relative_src_path('esphome', 'core', 'defines.h')]:
+        if not os.path.isfile(path):
+            return False
+    # The copied component sources must still be what copy_src_tree() left behind
+    manifest = _load_src_manifest()
+    if manifest is None:
+        return False
+    for target, entry in manifest.items():
+        if _file_stat(CORE.relative_src_path(*target.split('/'))) != entry['stat']:
+            return False
+    return True
+
+
+def save_config_hash(config_hash):  # type: (str) -> None
+    path = storage_path()
+    storage = StorageJSON.load(path)
+    if storage is None:
+        return
+    storage.config_hash = config_hash
+    storage.save(path)
+
+
 def write_platformio_ini(content):
     update_storage_json()
     path = CORE.relative_build_path('platformio.ini')
@@ -265,6 +639,13 @@ def write_platformio_project():
     write_gitignore()
     write_platformio_ini(content)
 
+    cache_dir = get_object_cache_dir()
+    if cache_dir is not None:
+        stats_path = os.path.abspath(CORE.relative_build_path(OBJECT_CACHE_STATS_NAME))
+        script = OBJECT_CACHE_SCRIPT.format(cache_dir=json.dumps(cache_dir),
+                                            stats_path=json.dumps(stats_path))
+        write_file_if_changed(script, CORE.relative_build_path(OBJECT_CACHE_SCRIPT_NAME))
+
 
 DEFINES_H_FORMAT = u"""\
 #pragma once
@@ -289,10 +670,89 @@ def walk_files(path):
             yield os.path.join(root, name)
 
 
-def copy_src_tree():
-    import filecmp
+SRC_MANIFEST_VERSION = 1
+# ioctl to clone a file on copy-on-write filesystems (btrfs, xfs) on Linux
+FICLONE = 0x40049409
+
+
+def src_manifest_path():
+    return CORE.relative_build_path('.esphome_src_manifest.json')
+
+
+def _load_src_manifest():
+    try:
+        with codecs.open(src_manifest_path(), 'r', encoding='utf-8') as f_handle:
+            manifest = json.load(f_handle)
+    except Exception:  # pylint: disable=broad-except
+        return None
+    if manifest.get('version') != SRC_MANIFEST_VERSION:
+        return None
+    return manifest['files']
+
+
+def _file_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime]
+
+
+def _file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f_handle:
+        for block in iter(lambda: f_handle.read(1 << 16), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _copy_file(src_path, dst_path):
     import shutil
 
+    mkdir_p(os.path.dirname(dst_path))
+    if sys.platform.startswith('linux'):
+        import fcntl
+
+        try:
+            with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except (IOError, OSError):
+            # Filesystem doesn't support reflinks, do a normal copy
+            pass
+    shutil.copy(src_path, dst_path)
+
+
+def _sync_src_file(src_path, dst_path, entry):
+    """Make sure dst_path has the content of src_path, return the new manifest entry.
+
+    Files are only read if their size or mtime changed since the last build, and dst_path
+    is only written if its content differs so that platformio doesn't rebuild it.
+    """
+    src_stat = _file_stat(src_path)
+    dst_stat = _file_stat(dst_path)
+    if entry is not None and dst_stat is not None and entry['source'] == src_path and \
+            entry['source_stat'] == src_stat and entry['stat'] == dst_stat:
+        return entry
+
+    digest = _file_digest(src_path)
+    if entry is not None and entry['hash'] == digest and entry['stat'] == dst_stat:
+        unchanged = True
+    else:
+        unchanged = dst_stat is not None and dst_stat[0] == src_stat[0] and \
+            _file_digest(dst_path) == digest
+    if not unchanged:
+        _copy_file(src_path, dst_path)
+        dst_stat = _file_stat(dst_path)
+    return {
+        'source': src_path,
+        'source_stat': src_stat,
+        'hash': digest,
+        'stat': dst_stat,
+    }
+
+
+def copy_src_tree():
     source_files = {}
     for _, component, _ in iter_components(CORE.config):
         source_files.update(component.source_files)
@@ -312,35 +772,42 @@ def copy_src_tree():
     source_files_copy = source_files.copy()
     source_files_copy.pop(DEFINES_H_TARGET)
 
-    for path in walk_files(CORE.relative_src_path('esphome')):
-        if os.path.splitext(path)[1] not in SOURCE_FILE_EXTENSIONS:
-            # Not a source file, ignore
-            continue
-        # Transform path to target path name
-        target = os.path.relpath(path, CORE.relative_src_path()).replace(os.path.sep, '/')
-        if target == DEFINES_H_TARGET:
-            # Ignore defines.h, will be dealt with later
-            continue
+    old_manifest = _load_src_manifest()
+    if old_manifest is None:
+        # No record of what was copied before, look at what's there
+        old_manifest = {}
+        for path in walk_files(CORE.relative_src_path('esphome')):
+            if os.path.splitext(path)[1] not in SOURCE_FILE_EXTENSIONS:
+                # Not a source file, ignore
+                continue
+            # Transform path to target path name
+            target = os.path.relpath(path, CORE.relative_src_path()).replace(os.path.sep, '/')
+            if target != DEFINES_H_TARGET:
+                old_manifest[target] = None
+
+    for target in old_manifest:
         if target not in source_files_copy:
             # Source file removed, delete target
-            os.remove(path)
-        else:
-            src_path = source_files_copy.pop(target)
-            if not filecmp.cmp(path, src_path):
-                # Files are not same, copy
-                shutil.copy(src_path, path)
+            path = CORE.relative_src_path(*target.split('/'))
+            if os.path.isfile(path):
+                os.remove(path)
 
-    # Now copy new files
+    manifest = {}
     for target, src_path in source_files_copy.items():
         dst_path = CORE.relative_src_path(*target.split('/'))
-        mkdir_p(os.path.dirname(dst_path))
-        shutil.copy(src_path, dst_path)
+        manifest[target] = _sync_src_file(src_path, dst_path, old_manifest.get(target))
+    if manifest != old_manifest:
+        write_file(src_manifest_path(), json.dumps({
+            'version': SRC_MANIFEST_VERSION,
+            'files': manifest,
+        }, indent=2, sort_keys=True))
 
     # Finally copy defines
     write_file_if_changed(generate_defines_h(),
                           CORE.relative_src_path('esphome', 'core', 'defines.h'))
     write_file_if_changed(ESPHOME_README_TXT,
                           CORE.relative_src_path('esphome', 'README.txt'))
+    write_unity_build()
 
     return include_s
 
@@ -351,24 +818,145 @@ def generate_defines_h():
     return DEFINES_H_FORMAT.format(u'\n'.join(define_content_l))
 
 
-def write_cpp(code_s):
+class _HashingWriter(object):
+    """Write text to a binary file as UTF-8 and hash everything written."""
+
+    def __init__(self, f_handle):
+        self.f_handle = f_handle
+        self.hasher = hashlib.sha256()
+
+    def write(self, data):
+        if isinstance(data, text_type):
+            data = data.encode('utf-8')
+        self.f_handle.write(data)
+        self.hasher.update(data)
+
+
+def _read_main_cpp_user_code(path):
+    """Get the user code around the auto generated blocks of an existing main.cpp.
+
+    Returns the code before the include block, between the include block and the code block
+    and after the code block (as bytes) and the hash of the whole file. The file is read in
+    pieces, so the generated code is never held in memory.
+    """
+    markers = [CPP_INCLUDE_BEGIN.encode('utf-8'), CPP_INCLUDE_END.encode('utf-8'),
+               CPP_AUTO_GENERATE_BEGIN.encode('utf-8'), CPP_AUTO_GENERATE_END.encode('utf-8')]
+    counts = [0, 0, 0, 0]
+    # Even states collect user code, odd states are inside an auto generated block
+    state = 0
+    parts = [[], [], []]
+    in_head = True
+    with open(path, 'rb') as f_handle:
+        for line in f_handle:
+            if b'// ===' in line:
+                for i in (2, 3):
+                    counts[i] += line.count(markers[i])
+                if in_head:
+                    # The include block markers are only looked for before the code block
+                    index = line.find(markers[2])
+                    head = line if index == -1 else line[:index]
+                    in_head = index == -1
+                    for i in (0, 1):
+                        counts[i] += head.count(markers[i])
+                while state < 4:
+                    index = line.find(markers[state])
+                    if index == -1:
+                        break
+                    if state % 2 == 0:
+                        parts[state // 2].append(line[:index])
+                    line = line[index + len(markers[state]):]
+                    state += 1
+            if state % 2 == 0:
+                parts[state // 2].append(line)
+
+    # The same checks in the same order as splitting the file with find_begin_end(), first
+    # at the code block and then the part before it at the include block
+    for i in (2, 0):
+        if counts[i] == 0:
+            raise EsphomeError(u"Could not find auto generated code begin in file, either "
+                               u"delete the main sketch file or insert the comment again.")
+        if counts[i] > 1:
+            raise EsphomeError(u"Found multiple auto generate code begins, don't know "
+                               u"which to chose, please remove one of them.")
+        if counts[i + 1] == 0:
+            raise EsphomeError(u"Could not find auto generated code end in file, either "
+                               u"delete the main sketch file or insert the comment again.")
+        if counts[i + 1] > 1:
+            raise EsphomeError(u"Found multiple auto generate code endings, don't know "
+                               u"which to chose, please remove one of them.")
+    if state < 4:
+        raise EsphomeError(u"The auto generated code blocks are out of order, either delete "
+                           u"the main sketch file or move the comments back.")
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f_handle:
+        for block in iter(lambda: f_handle.read(1 << 16), b''):
+            hasher.update(block)
+    return [b''.join(part) for part in parts], hasher.hexdigest()
+
+
+def _write_global_section(writer):
+    from esphome.cpp_generator import statement
+
+    # Same output as CORE.cpp_global_section
+    if not CORE.global_statements:
+        writer.write(u'\n')
+    for exp in CORE.global_statements:
+        writer.write(text_type(statement(exp)).rstrip())
+        writer.write(u'\n')
+
+
+# Line boundaries str.splitlines() knows about other than \n
+_OTHER_LINE_BREAKS = u'\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+def _write_main_section(writer, padding=u'  '):
+    from esphome.cpp_generator import statement
+
+    # Same output as indent(CORE.cpp_main_section), but one statement at a time
+    separator = u''
+    texts = (text_type(statement(exp)).rstrip() for exp in CORE.main_statements)
+    for text in itertools.chain(texts if CORE.main_statements else [u''], [u'']):
+        if not any(char in text for char in _OTHER_LINE_BREAKS):
+            text = padding + text.replace(u'\n', u'\n' + padding)
+        else:
+            text = padding + (u'\n' + padding).join(text.splitlines() or [u''])
+        writer.write(separator + text)
+        separator = u'\n'
+
+
+def write_cpp():
     path = CORE.relative_src_path('main.cpp')
     if os.path.isfile(path):
-        text = read_file(path)
-        code_format = find_begin_end(text, CPP_AUTO_GENERATE_BEGIN, CPP_AUTO_GENERATE_END)
-        code_format_ = find_begin_end(code_format[0], CPP_INCLUDE_BEGIN, CPP_INCLUDE_END)
-        code_format = (code_format_[0], code_format_[1], code_format[1])
+        user_code, old_hash = _read_main_cpp_user_code(path)
     else:
-        code_format = CPP_BASE_FORMAT
-
-    include_s = copy_src_tree()
-    global_s = include_s + u'\n'
-    global_s += CORE.cpp_global_section
-
-    full_file = code_format[0] + CPP_INCLUDE_BEGIN + u'\n' + global_s + CPP_INCLUDE_END
-    full_file += code_format[1] + CPP_AUTO_GENERATE_BEGIN + u'\n' + code_s + CPP_AUTO_GENERATE_END
-    full_file += code_format[2]
-    write_file_if_changed(full_file, path)
+        user_code, old_hash = CPP_BASE_FORMAT, None
+
+    with PROFILER.phase('copy_src_tree'):
+        include_s = copy_src_tree()
+
+    # Stream the file to a temporary file and only replace main.cpp if it changed,
+    # so that large arrays don't have to be kept in memory several times
+    mkdir_p(os.path.dirname(path))
+    tmp_path = path + u'.tmp'
+    try:
+        with open(tmp_path, 'wb') as f_handle:
+            writer = _HashingWriter(f_handle)
+            writer.write(user_code[0])
+            writer.write(CPP_INCLUDE_BEGIN + u'\n' + include_s + u'\n')
+            _write_global_section(writer)
+            writer.write(CPP_INCLUDE_END)
+            writer.write(user_code[1])
+            writer.write(CPP_AUTO_GENERATE_BEGIN + u'\n')
+            _write_main_section(writer)
+            writer.write(CPP_AUTO_GENERATE_END)
+            writer.write(user_code[2])
+        if writer.hasher.hexdigest() != old_hash:
+            replace_file(tmp_path, path)
+    except (IOError, OSError) as err:
+        raise EsphomeError(u"Could not write file at {}: {}".format(path, err))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def clean_build():
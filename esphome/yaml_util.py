@@ -1,7 +1,9 @@
 from __future__ import print_function
 
-import codecs
 import fnmatch
+import hashlib
+import io
+import json
 import logging
 import os
 import uuid
@@ -9,9 +11,10 @@ import uuid
 import yaml
 import yaml.constructor
 
-from esphome import core
+from esphome import const, core
 from esphome.core import EsphomeError, HexInt, IPAddress, Lambda, MACAddress, TimePeriod
-from esphome.py_compat import string_types, text_type, IS_PY2
+from esphome.helpers import get_bool_env, mkdir_p
+from esphome.py_compat import integer_types, string_types, text_type, IS_PY2
 from esphome.util import OrderedDict
 
 _LOGGER = logging.getLogger(__name__)
@@ -20,9 +23,18 @@ _LOGGER = logging.getLogger(__name__)
 # let's not reinvent the wheel here
 
 SECRET_YAML = u'secrets.yaml'
-_SECRET_CACHE = {}
 _SECRET_VALUES = {}
 
+# Version of the on-disk parsed YAML cache format, bump when the constructed tree changes
+YAML_CACHE_VERSION = 3
+# Everything the currently loading YAML file depends on, used to validate the parse cache.
+# Maps file path -> sha256 of the file content
+_DEPENDENCY_FILES = OrderedDict()
+# Maps (directory, pattern) -> list of files found there by the !include_dir_* tags
+_DEPENDENCY_DIRS = OrderedDict()
+# Maps environment variable name -> value (or None) looked up by !env_var
+_DEPENDENCY_ENV = OrderedDict()
+
 
 class NodeListClass(list):
     """Wrapper class to be able to add attributes on a list."""
@@ -32,6 +44,32 @@ class NodeStrClass(text_type):
     """Wrapper class to be able to add attributes on a string."""
 
 
+class SecretReference(object):
+    """Stands in for a !secret value until the tree is loaded.
+
+    The parse cache stores the tree with these references, so secret values are never
+    written to it. They are looked up in secrets.yaml after every load.
+    """
+
+    def __init__(self, secrets_path, name):
+        self.secrets_path = secrets_path
+        self.name = name
+
+    # References can be mapping keys, the same secret must be the same key
+    def __eq__(self, other):
+        return isinstance(other, SecretReference) and \
+            (self.secrets_path, self.name) == (other.secrets_path, other.name)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.secrets_path, self.name))
+
+    def __str__(self):
+        return u'!secret {}'.format(self.name)
+
+
 class SafeLineLoader(yaml.SafeLoader):  # pylint: disable=too-many-ancestors
     """Loader class that keeps track of line numbers."""
 
@@ -43,17 +81,235 @@ class SafeLineLoader(yaml.SafeLoader):  # pylint: disable=too-many-ancestors
         return node
 
 
+if getattr(yaml, '__with_libyaml__', False):
+    class CSafeLineLoader(yaml.CSafeLoader):  # pylint: disable=too-many-ancestors
+        """Loader class using the libyaml C parser.
+
+        Line information for error messages comes from the node start marks, which
+        the C parser fills in as well.
+        """
+
+        def __init__(self, stream):
+            super(CSafeLineLoader, self).__init__(stream)
+            # The C parser doesn't expose these, but the constructors below need them
+            self.stream = stream
+            self.name = getattr(stream, 'name', u'<file>')
+
+    _LOADERS = [CSafeLineLoader, SafeLineLoader]
+else:
+    _LOADERS = [SafeLineLoader]
+
+
 def load_yaml(fname):
+    """Load a YAML configuration file.
+
+    The constructed tree is cached in .esphome/yaml_cache/ next to the file, without the
+    values of secrets. Pass --no-yaml-cache or set ESPHOME_DISABLE_YAML_CACHE to disable it.
+    """
     _SECRET_VALUES.clear()
-    _SECRET_CACHE.clear()
-    return _load_yaml_internal(fname)
+    _DEPENDENCY_FILES.clear()
+    _DEPENDENCY_DIRS.clear()
+    _DEPENDENCY_ENV.clear()
+
+    use_cache = not get_bool_env('ESPHOME_DISABLE_YAML_CACHE')
+    data = _load_yaml_cache(fname) if use_cache else None
+    if data is None:
+        data = _load_yaml_internal(fname)
+        if use_cache:
+            _save_yaml_cache(fname, data)
+    _resolve_secrets(data, {})
+    return data
+
+
+def _resolve_secret(ref, secrets):
+    if ref.secrets_path not in secrets:
+        secrets[ref.secrets_path] = _load_yaml_internal(ref.secrets_path)
+    values = secrets[ref.secrets_path]
+    if ref.name not in values:
+        raise EsphomeError(u"Secret {} not defined".format(ref.name))
+    val = values[ref.name]
+    _SECRET_VALUES[text_type(val)] = ref.name
+    return val
+
+
+def _resolve_secrets(item, secrets):
+    """Replace the SecretReferences in a loaded tree by their values, in place."""
+    if isinstance(item, list):
+        for i, value in enumerate(item):
+            if isinstance(value, SecretReference):
+                item[i] = _resolve_secret(value, secrets)
+            else:
+                _resolve_secrets(value, secrets)
+    elif isinstance(item, dict):
+        if any(isinstance(key, SecretReference) for key in item):
+            items = list(item.items())
+            item.clear()
+            for key, value in items:
+                if isinstance(key, SecretReference):
+                    key = _resolve_secret(key, secrets)
+                item[key] = value
+        for key, value in item.items():
+            if isinstance(value, SecretReference):
+                item[key] = _resolve_secret(value, secrets)
+            else:
+                _resolve_secrets(value, secrets)
+
+
+def _yaml_cache_path(fname):
+    return os.path.join(os.path.dirname(fname), '.esphome', 'yaml_cache',
+                        u'{}.json'.format(os.path.basename(fname)))
+
+
+def _file_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class _UncacheableError(Exception):
+    """The constructed tree contains a value the parse cache can't store."""
+
+
+_PLAIN_TYPES = (type(None), bool, float, text_type) + integer_types
+
+
+def _encode_node(obj):
+    """Encode a constructed tree as JSON values.
+
+    The cache is stored as JSON and not pickled, the config directory is shared with the
+    dashboard and loading a pickle could run any code put there. Values that aren't plain
+    JSON values become objects tagged with their type in 't'.
+    """
+    kind = type(obj)
+    if kind in _PLAIN_TYPES:
+        return obj
+    if kind is list:
+        return [_encode_node(value) for value in obj]
+    if kind is OrderedDict:
+        node = {'t': 'map', 'v': [[_encode_node(key), _encode_node(value)]
+                                  for key, value in obj.items()]}
+    elif kind is NodeListClass:
+        node = {'t': 'seq', 'v': [_encode_node(value) for value in obj]}
+    elif kind is NodeStrClass:
+        node = {'t': 'str', 'v': text_type(obj)}
+    elif kind is Lambda:
+        return {'t': 'lambda', 'v': obj.value}
+    elif kind is SecretReference:
+        return {'t': 'secret', 'path': obj.secrets_path, 'name': obj.name}
+    elif IS_PY2 and kind is str:
+        # PyYAML returns ASCII strings as str on Python 2
+        return {'t': 'ascii', 'v': obj.decode('ascii')}
+    else:
+        raise _UncacheableError(u"Can't cache values of type {}".format(kind))
+    if hasattr(obj, '__config_file__'):
+        node['file'] = obj.__config_file__
+        node['line'] = obj.__line__
+    return node
+
+
+def _decode_node(node):
+    """Decode a tagged JSON object written by _encode_node, the json object_hook."""
+    tag = node.get('t')
+    if tag is None:
+        # Not a tree value, the cache entry itself
+        return node
+    if tag == 'lambda':
+        return Lambda(node['v'])
+    if tag == 'secret':
+        return SecretReference(node['path'], node['name'])
+    if tag == 'ascii':
+        return str(node['v'])
+    if tag == 'map':
+        obj = OrderedDict((key, value) for key, value in node['v'])
+    elif tag == 'seq':
+        obj = NodeListClass(node['v'])
+    elif tag == 'str':
+        obj = NodeStrClass(node['v'])
+    else:
+        raise ValueError(u"Unknown cached value {}".format(tag))
+    if 'file' in node:
+        setattr(obj, '__config_file__', node['file'])
+        setattr(obj, '__line__', node['line'])
+    return obj
+
+
+def _load_yaml_cache(fname):
+    """Load the constructed tree of fname from the parse cache.
+
+    Returns None if there is no cache entry or if any file, directory listing or
+    environment variable the cached tree was constructed from has changed since.
+    """
+    try:
+        with io.open(_yaml_cache_path(fname), 'r', encoding='utf-8') as f_handle:
+            entry = json.load(f_handle, object_hook=_decode_node)
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+    if not isinstance(entry, dict) or entry.get('version') != YAML_CACHE_VERSION or \
+            entry.get('esphome_version') != const.__version__ or entry.get('fname') != fname:
+        return None
+    for path, digest in entry['files']:
+        try:
+            with open(path, 'rb') as f_handle:
+                if _file_digest(f_handle.read()) != digest:
+                    return None
+        except (IOError, OSError):
+            return None
+    for directory, pattern, files in entry['dirs']:
+        if _walk_files(directory, pattern) != files:
+            return None
+    for var, value in entry['env']:
+        if os.environ.get(var) != value:
+            return None
+
+    _LOGGER.debug("Using cached parse of %s", fname)
+    _DEPENDENCY_FILES.update(entry['files'])
+    _DEPENDENCY_DIRS.update(((directory, pattern), files)
+                            for directory, pattern, files in entry['dirs'])
+    _DEPENDENCY_ENV.update(entry['env'])
+    return entry['data']
+
+
+def _save_yaml_cache(fname, data):
+    try:
+        encoded = _encode_node(data)
+    except _UncacheableError as err:
+        _LOGGER.debug("Not caching the parse of %s: %s", fname, err)
+        return
+    entry = {
+        'version': YAML_CACHE_VERSION,
+        'esphome_version': const.__version__,
+        'fname': fname,
+        'files': list(_DEPENDENCY_FILES.items()),
+        'dirs': [[directory, pattern, files]
+                 for (directory, pattern), files in _DEPENDENCY_DIRS.items()],
+        'env': list(_DEPENDENCY_ENV.items()),
+        'data': encoded,
+    }
+    path = _yaml_cache_path(fname)
+    try:
+        content = json.dumps(entry, separators=(',', ':'))
+        if IS_PY2 and isinstance(content, str):
+            content = content.decode('ascii')
+        mkdir_p(os.path.dirname(path))
+        if os.path.exists(path):
+            os.remove(path)
+        # Only readable by the user, the tree can contain passwords that aren't secrets
+        with io.open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w',
+                     encoding='utf-8') as f_handle:
+            f_handle.write(content)
+    except Exception as err:  # pylint: disable=broad-except
+        _LOGGER.debug("Could not write YAML cache %s: %s", path, err)
 
 
 def _load_yaml_internal(fname):
     """Load a YAML file."""
     try:
-        with codecs.open(fname, encoding='utf-8') as conf_file:
-            return yaml.load(conf_file, Loader=SafeLineLoader) or OrderedDict()
+        with open(fname, 'rb') as f_handle:
+            content = f_handle.read()
+        _DEPENDENCY_FILES[fname] = _file_digest(content)
+        conf_file = io.StringIO(content.decode('utf-8'))
+        # Loader uses the stream name for the __config_file__ line info
+        conf_file.name = fname
+        return yaml.load(conf_file, Loader=_LOADERS[0]) or OrderedDict()
     except yaml.YAMLError as exc:
         raise EsphomeError(exc)
     except IOError as exc:
@@ -186,6 +442,7 @@ def _env_var_yaml(_, node):
     """Load environment variables and embed it into the configuration YAML."""
     args = node.value.split()
 
+    _DEPENDENCY_ENV[args[0]] = os.environ.get(args[0])
     # Check for a default value
     if len(args) > 1:
         return os.getenv(args[0], u' '.join(args[1:]))
@@ -209,14 +466,22 @@ def _is_file_valid(name):
     return not name.startswith(u'.')
 
 
-def _find_files(directory, pattern):
-    """Recursively load files in a directory."""
+def _walk_files(directory, pattern):
+    """Recursively list files in a directory."""
+    result = []
     for root, dirs, files in os.walk(directory, topdown=True):
         dirs[:] = [d for d in dirs if _is_file_valid(d)]
         for basename in files:
             if _is_file_valid(basename) and fnmatch.fnmatch(basename, pattern):
-                filename = os.path.join(root, basename)
-                yield filename
+                result.append(os.path.join(root, basename))
+    return result
+
+
+def _find_files(directory, pattern):
+    """Recursively load files in a directory."""
+    files = _walk_files(directory, pattern)
+    _DEPENDENCY_DIRS[(directory, pattern)] = files
+    return files
 
 
 def _include_dir_named_yaml(loader, node):
@@ -276,27 +541,24 @@ def _secret_yaml(loader, node):
     secrets = _load_yaml_internal(secret_path)
     if node.value not in secrets:
         raise EsphomeError(u"Secret {} not defined".format(node.value))
-    val = secrets[node.value]
-    _SECRET_VALUES[text_type(val)] = node.value
-    return val
+    return SecretReference(secret_path, node.value)
 
 
 def _lambda(loader, node):
     return Lambda(text_type(node.value))
 
 
-yaml.SafeLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _ordered_dict)
-yaml.SafeLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_SEQUENCE_TAG, _construct_seq)
-yaml.SafeLoader.add_constructor('!env_var', _env_var_yaml)
-yaml.SafeLoader.add_constructor('!secret', _secret_yaml)
-yaml.SafeLoader.add_constructor('!include', _include_yaml)
-yaml.SafeLoader.add_constructor('!include_dir_list', _include_dir_list_yaml)
-yaml.SafeLoader.add_constructor('!include_dir_merge_list',
-                                _include_dir_merge_list_yaml)
-yaml.SafeLoader.add_constructor('!include_dir_named', _include_dir_named_yaml)
-yaml.SafeLoader.add_constructor('!include_dir_merge_named',
-                                _include_dir_merge_named_yaml)
-yaml.SafeLoader.add_constructor('!lambda', _lambda)
+for _loader in _LOADERS:
+    _loader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _ordered_dict)
+    _loader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_SEQUENCE_TAG, _construct_seq)
+    _loader.add_constructor('!env_var', _env_var_yaml)
+    _loader.add_constructor('!secret', _secret_yaml)
+    _loader.add_constructor('!include', _include_yaml)
+    _loader.add_constructor('!include_dir_list', _include_dir_list_yaml)
+    _loader.add_constructor('!include_dir_merge_list', _include_dir_merge_list_yaml)
+    _loader.add_constructor('!include_dir_named', _include_dir_named_yaml)
+    _loader.add_constructor('!include_dir_merge_named', _include_dir_merge_named_yaml)
+    _loader.add_constructor('!lambda', _lambda)
 
 
 # From: https://gist.github.com/miracle2k/3184458
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Compare decoding a stack trace with one addr2line process per address and with
+AddressDecoder.
+
+Builds an ELF with FUNCTIONS small functions (gcc -g -O2, some inlined) and decodes a
+trace of FRAMES addresses inside them. Needs gcc, nm and addr2line on the PATH.
+
+Usage: script/benchmark/addr2line.py [FUNCTIONS [FRAMES]]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+from esphome.platformio_api import AddressDecoder  # noqa: E402
+
+FUNCTION = u"""\
+static inline int h{0}(int x) {{ return x * {0} + 1; }}
+__attribute__((noinline)) int f{0}(int x) {{
+  volatile int y = h{0}(x);
+  for (int j = 0; j < x; j++) y += j * {0};
+  return y;
+}}
+"""
+
+
+def build_elf(directory, functions):
+    source = os.path.join(directory, 'firmware.c')
+    elf = os.path.join(directory, 'firmware.elf')
+    with open(source, 'w') as f_handle:
+        f_handle.write(u''.join(FUNCTION.format(i) for i in range(functions)))
+        calls = u' + '.join(u'f{}(argc)'.format(i) for i in range(functions))
+        f_handle.write(u'int main(int argc, char **argv) {{ return {}; }}\n'.format(calls))
+    subprocess.check_call(['gcc', '-g', '-O2', '-o', elf, source])
+    return elf
+
+
+def function_addresses(elf):
+    output = subprocess.check_output(['nm', elf]).decode('utf-8')
+    addrs = []
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and parts[1] in 'tT' and parts[2].startswith('f'):
+            addrs.append(u'{:x}'.format(int(parts[0], 16) + 0x10))
+    return addrs
+
+
+def decode_per_process(elf, addr):
+    output = subprocess.check_output(['addr2line', '-pfiaC', '-e', elf, addr])
+    translation = output.decode('utf-8').strip()
+    if '?? ??:0' in translation:
+        return None
+    return translation.replace(' at ??:?', '').replace(':?', '')
+
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    directory = tempfile.mkdtemp()
+    try:
+        elf = build_elf(directory, functions)
+        addrs = function_addresses(elf)[:frames]
+
+        start = time.time()
+        expected = [decode_per_process(elf, addr) for addr in addrs]
+        per_process = time.time() - start
+
+        decoder = AddressDecoder('addr2line', elf)
+        start = time.time()
+        result = decoder.decode(addrs)
+        persistent = time.time() - start
+        start = time.time()
+        decoder.decode(addrs)
+        repeated = time.time() - start
+        decoder.close()
+    finally:
+        shutil.rmtree(directory)
+
+    if [result[addr] for addr in addrs] != expected:
+        print("Output differs from the per-address translations!")
+        return 1
+    print(u"{} frames: one process per address {:.1f}ms, AddressDecoder {:.1f}ms, "
+          u"repeated trace {:.2f}ms".format(len(addrs), per_process * 1000,
+                                            persistent * 1000, repeated * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
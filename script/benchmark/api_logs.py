@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Compare how fast the threaded APIClient and the AsyncAPIClient receive log messages.
+
+A fake node in another process answers the handshake and then sends MESSAGES log messages
+of SIZE bytes each, in batches of 1000, as fast as the connection allows. The clients log
+in, subscribe to the logs and count the messages until the last one. Python 3 only, like
+the asyncio client.
+
+Usage: script/benchmark/api_logs.py [--messages MESSAGES] [--size SIZE]
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+import esphome.api.api_pb2 as pb  # noqa: E402
+from esphome.api.client import MESSAGE_TYPE_TO_PROTO, APIClient, _varuint_to_bytes  # noqa: E402
+
+PASSWORD = 'benchmark'
+BATCH = 1000
+PROTO_TO_MESSAGE_TYPE = {klass: message_type
+                         for message_type, klass in MESSAGE_TYPE_TO_PROTO.items()}
+
+
+def encode_frame(msg):
+    encoded = msg.SerializeToString()
+    return b''.join([b'\x00', _varuint_to_bytes(len(encoded)),
+                     _varuint_to_bytes(PROTO_TO_MESSAGE_TYPE[type(msg)]), encoded])
+
+
+def serve(server, messages, size):
+    """Run the fake node on the listening socket server."""
+    import asyncio  # pylint: disable=import-error
+    from esphome.api.async_client import APIProtocol
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    log_frame = encode_frame(pb.SubscribeLogsResponse(level=3, message='x' * size))
+    end_frame = encode_frame(pb.SubscribeLogsResponse(level=3, message='END'))
+
+    class FakeNode(object):
+        def __init__(self):
+            self.protocol = APIProtocol(self)
+
+        def send(self, msg):
+            self.protocol.transport.write(encode_frame(msg))
+
+        def flood(self, remaining):
+            if self.protocol.transport is None:
+                return
+            if remaining <= 0:
+                self.protocol.transport.write(end_frame)
+                return
+            self.protocol.transport.write(log_frame * min(remaining, BATCH))
+            loop.call_soon(self.flood, remaining - BATCH)
+
+        def handle_frame(self, msg_type, raw_msg):
+            msg = MESSAGE_TYPE_TO_PROTO[msg_type]()
+            msg.ParseFromString(raw_msg.tobytes())
+            if isinstance(msg, pb.HelloRequest):
+                self.send(pb.HelloResponse(server_info='benchmark', api_version_major=1))
+            elif isinstance(msg, pb.ConnectRequest):
+                self.send(pb.ConnectResponse(invalid_password=msg.password != PASSWORD))
+            elif isinstance(msg, pb.PingRequest):
+                self.send(pb.PingResponse())
+            elif isinstance(msg, pb.DisconnectRequest):
+                self.send(pb.DisconnectResponse())
+                self.protocol.transport.close()
+            elif isinstance(msg, pb.SubscribeLogsRequest):
+                loop.call_soon(self.flood, messages)
+
+        def connection_lost(self, protocol, err):
+            pass
+
+    loop.run_until_complete(loop.create_server(lambda: FakeNode().protocol, sock=server))
+    loop.run_forever()
+
+
+def bench_threaded(port):
+    cli = APIClient('127.0.0.1', port, PASSWORD)
+    cli.start()
+    done = threading.Event()
+    count = [0]
+
+    def on_log(msg):
+        count[0] += 1
+        if msg.message == 'END':
+            done.set()
+
+    cli.connect()
+    cli.login()
+    start = time.time()
+    cli.subscribe_logs(on_log)
+    done.wait()
+    duration = time.time() - start
+    cli.stop(force=True)
+    return count[0], duration
+
+
+def bench_async(port):
+    import asyncio  # pylint: disable=import-error
+    from esphome.api.async_client import AsyncAPIClient
+
+    loop = asyncio.new_event_loop()
+    cli = AsyncAPIClient('127.0.0.1', port, PASSWORD, loop=loop)
+    loop.run_until_complete(cli.connect())
+    loop.run_until_complete(cli.login())
+    done = loop.create_future()
+    count = [0]
+
+    def on_log(msg):
+        count[0] += 1
+        if msg.message == 'END':
+            done.set_result(None)
+
+    start = time.time()
+    cli.subscribe_logs(on_log)
+    loop.run_until_complete(done)
+    duration = time.time() - start
+    loop.run_until_complete(cli.disconnect())
+    loop.close()
+    return count[0], duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--size', type=int, default=60, help="Log message size in bytes")
+    args = parser.parse_args()
+    if sys.version_info[0] < 3:
+        print("The asyncio client needs Python 3")
+        return 1
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    process = multiprocessing.Process(target=serve, args=(server, args.messages, args.size))
+    process.daemon = True
+    process.start()
+    port = server.getsockname()[1]
+    try:
+        for name, bench in [('threaded', bench_threaded), ('asyncio', bench_async)]:
+            count, duration = bench(port)
+            print(u'{:<10} {} messages in {:.2f}s, {:.0f} messages/s'.format(
+                name, count, duration, count / duration))
+    finally:
+        process.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Time do_id_pass on a synthetic config with N declared IDs.
+
+Half of the IDs are manual and half use default names. Each entry also has one
+reference by name and one by type.
+
+Usage: script/benchmark/id_pass.py [N ...]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+import esphome.codegen as cg  # noqa: E402
+from esphome import config, core  # noqa: E402
+from esphome.components import sensor  # noqa: E402
+
+BenchSensor = cg.esphome_ns.class_('BenchSensor', sensor.Sensor)
+
+
+def make_config(count):
+    result = config.Config()
+    items = []
+    for i in range(count):
+        items.append({
+            'id': core.ID(None if i % 2 else u's{}'.format(i), is_declaration=True,
+                          type=BenchSensor),
+            'sensor_id': core.ID(u's{}'.format((i // 2) * 2), type=sensor.Sensor),
+            'default': core.ID(None, type=sensor.Sensor),
+        })
+    result['sensor'] = items
+    return result
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    for count in counts:
+        result = make_config(count)
+        start = time.time()
+        config.do_id_pass(result)
+        print(u"{} IDs: {:.3f}s, {} errors".format(count, time.time() - start,
+                                                   len(result.errors)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
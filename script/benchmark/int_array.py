@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Compare building and formatting array data with one HexInt per element and with
+IntArrayInitializer.
+
+Usage: script/benchmark/int_array.py [NUM_BYTES]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+from esphome import cpp_generator as cg  # noqa: E402
+from esphome.core import HexInt  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def per_element(data):
+    return str(cg.ArrayInitializer(*[HexInt(x) for x in data], multiline=False))
+
+
+def packed(data):
+    return str(cg.IntArrayInitializer(data))
+
+
+def measure(func, data):
+    """Time func without tracing, then run it again to get the peak traced memory."""
+    start = time.time()
+    func(data)
+    duration = time.time() - start
+    if tracemalloc is None:
+        return duration, None
+    tracemalloc.start()
+    func(data)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    data = bytearray(random.getrandbits(8) for _ in range(size))
+    for name, func in [('HexInt per element', per_element), ('IntArrayInitializer', packed)]:
+        duration, peak = measure(func, data)
+        peak_s = u'' if peak is None else u', {:.1f}MB peak traced memory'.format(peak)
+        print(u"{} bytes, {}: {:.2f}s{}".format(size, name, duration, peak_s))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
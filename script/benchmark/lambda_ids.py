@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""Time to_code for a config with many lambdas that reference other IDs.
+
+Generates SENSORS template sensors plus LAMBDAS template sensors whose lambdas each
+reference 4 of them, validates the config and times running all to_code coroutines.
+
+Usage: script/benchmark/lambda_ids.py [SENSORS [LAMBDAS]]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+from esphome.config import iter_components, read_config  # noqa: E402
+from esphome.core import CORE  # noqa: E402
+
+HEADER = u"""\
+esphome:
+  name: bench
+  platform: ESP8266
+  board: nodemcuv2
+
+sensor:
+"""
+
+
+def make_config(sensors, lambdas):
+    parts = [HEADER]
+    for i in range(sensors):
+        parts.append(u"  - platform: template\n    id: s{0}\n    name: s{0}\n"
+                     u"    lambda: 'return {0};'\n".format(i))
+    for i in range(lambdas):
+        refs = u' + '.join(u'id(s{}).state'.format((i * 4 + j) % sensors) for j in range(4))
+        parts.append(u"  - platform: template\n    name: l{}\n"
+                     u"    lambda: 'return {};'\n".format(i, refs))
+    return u''.join(parts)
+
+
+def main():
+    sensors = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    lambdas = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    os.environ['ESPHOME_DISABLE_YAML_CACHE'] = '1'
+    directory = tempfile.mkdtemp()
+    try:
+        CORE.config_path = os.path.join(directory, 'bench.yaml')
+        with open(CORE.config_path, 'w') as f_handle:
+            f_handle.write(make_config(sensors, lambdas))
+        start = time.time()
+        CORE.config = read_config(False)
+        if CORE.config is None:
+            return 1
+        validated = time.time()
+        for _, component, conf in iter_components(CORE.config):
+            if component.to_code is not None:
+                CORE.add_job(component.to_code, conf)
+        CORE.flush_tasks()
+        done = time.time()
+    finally:
+        shutil.rmtree(directory)
+    print(u"{} sensors, {} lambdas: validation {:.2f}s, to_code {:.2f}s".format(
+        sensors, lambdas, validated - start, done - validated))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
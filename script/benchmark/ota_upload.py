@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Measure the time and memory perform_ota needs to send a firmware over loopback.
+
+A fake device in another process accepts the uploads without compression or delta updates,
+so only the transfer itself is measured. Prints the best time of RUNS uploads of a SIZE MiB
+random image and the peak Python memory of one more upload.
+
+--compare takes another espota2.py to measure next to the current one, for example the
+version before a change:
+
+    git show HEAD~1:esphome/espota2.py > /tmp/old_espota2.py
+    script/benchmark/ota_upload.py --compare /tmp/old_espota2.py
+
+Usage: script/benchmark/ota_upload.py [--compare ESPOTA2_PY] [--size MIB] [--runs RUNS]
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+from esphome import espota2  # noqa: E402
+
+
+def receive(conn, amount):
+    data = bytearray()
+    while len(data) < amount:
+        chunk = conn.recv(min(amount - len(data), 1 << 20))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return bytes(data)
+
+
+def serve(server):
+    """A device that answers every upload like an ESP without compression support."""
+    while True:
+        conn, _ = server.accept()
+        receive(conn, 5)
+        conn.sendall(bytearray([espota2.RESPONSE_OK, espota2.OTA_VERSION_1_0]))
+        receive(conn, 1)
+        conn.sendall(bytearray([espota2.RESPONSE_HEADER_OK, espota2.RESPONSE_AUTH_OK]))
+        size, = struct.unpack('>I', receive(conn, 4))
+        conn.sendall(bytearray([espota2.RESPONSE_UPDATE_PREPARE_OK]))
+        md5 = receive(conn, 32).decode()
+        conn.sendall(bytearray([espota2.RESPONSE_BIN_MD5_OK]))
+        if hashlib.md5(receive(conn, size)).hexdigest() != md5:
+            raise ValueError("MD5 mismatch")
+        conn.sendall(bytearray([espota2.RESPONSE_RECEIVE_OK, espota2.RESPONSE_UPDATE_END_OK]))
+        receive(conn, 1)
+        conn.close()
+
+
+def load_module(path):
+    if sys.version_info[0] < 3:
+        import imp
+        return imp.load_source('compare_espota2', path)
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('compare_espota2', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def upload(module, port, path, **kwargs):
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        with open(path, 'rb') as f_handle:
+            start = time.time()
+            module.perform_ota(sock, None, f_handle, path, wait=False, **kwargs)
+            return time.time() - start
+    finally:
+        sock.close()
+
+
+def measure(module, port, path, runs, **kwargs):
+    best = min(upload(module, port, path, **kwargs) for _ in range(runs))
+    peak = None
+    try:
+        import tracemalloc
+    except ImportError:
+        pass
+    else:
+        tracemalloc.start()
+        upload(module, port, path, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--compare', help="Another espota2.py to measure")
+    parser.add_argument('--size', type=int, default=4, help="Firmware size in MiB")
+    parser.add_argument('--runs', type=int, default=15)
+    args = parser.parse_args()
+
+    modules = [('current', espota2)]
+    if args.compare:
+        modules.insert(0, ('compare', load_module(args.compare)))
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    process = multiprocessing.Process(target=serve, args=(server,))
+    process.daemon = True
+    process.start()
+    port = server.getsockname()[1]
+
+    logging.disable(logging.INFO)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'firmware.bin')
+        with open(path, 'wb') as f_handle:
+            f_handle.write(os.urandom(args.size << 20))
+        for name, module in modules:
+            for progress in [True, False]:
+                best, peak = measure(module, port, path, args.runs, show_progress=progress)
+                label = u'{}, {}'.format(name, u'progress bar' if progress else u'no progress bar')
+                peak_text = u'n/a' if peak is None else u'{:.2f} MiB'.format(peak / 2.0 ** 20)
+                print(u'{:<28} {:6.1f} ms {:7.1f} MiB/s   {} peak'.format(
+                    label, best * 1e3, args.size / best, peak_text))
+    finally:
+        shutil.rmtree(directory)
+        process.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
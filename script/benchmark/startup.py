@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Break down the startup time of 'esphome CONFIG config' for some configurations.
+
+Each configuration is validated in fresh interpreters. The wall time is the best of RUNS
+runs of the command. One more run in a fresh interpreter splits it up into importing
+esphome, looking up (importing) the component modules, and the rest of validation. It
+also counts the component modules that were imported but whose configuration was never
+validated, only those imports could be deferred by not importing a component for its
+metadata.
+
+Usage: script/benchmark/startup.py [-n RUNS] [FILE ...]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+SMALL_CONFIG = u"""\
+esphome:
+  name: small
+  platform: ESP8266
+  board: nodemcuv2
+wifi:
+  ssid: ssid
+  password: password
+api:
+ota:
+logger:
+sensor:
+  - platform: uptime
+    name: Uptime
+"""
+
+
+def breakdown(fname):
+    """Run in a fresh interpreter, prints the phases as JSON."""
+    start = time.time()
+    sys.path.insert(0, ROOT)
+    # pylint: disable=wrong-import-position
+    from esphome import __main__, config  # noqa: F401 pylint: disable=unused-variable
+    from esphome.core import CORE
+    imported = time.time()
+
+    lookup = {'time': 0.0, 'domains': set()}
+    lookup_module = config._lookup_module  # pylint: disable=protected-access
+
+    def timed_lookup(domain, is_platform):
+        begin = time.time()
+        try:
+            return lookup_module(domain, is_platform)
+        finally:
+            lookup['time'] += time.time() - begin
+            lookup['domains'].add(domain)
+
+    config._lookup_module = timed_lookup  # pylint: disable=protected-access
+    begin = time.time()
+    CORE.config_path = fname
+    result = config.load_config()
+    validated = time.time() - begin
+
+    # Platforms are listed as sensor.uptime, their module is uptime.sensor. The sensor
+    # component itself is used to validate them.
+    validated_domains = set()
+    for _, domain in result.domains:
+        if '.' in domain:
+            component, platform = domain.split('.')
+            validated_domains.update([component, u'{}.{}'.format(platform, component)])
+        else:
+            validated_domains.add(domain)
+    modules = {name[len('esphome.components.'):] for name in sys.modules
+               if name.startswith('esphome.components.') and sys.modules[name] is not None}
+    print(json.dumps({
+        'import': imported - start,
+        'lookup': lookup['time'],
+        'validate': validated - lookup['time'],
+        'modules': len(modules),
+        'not_validated': sorted(lookup['domains'] - validated_domains - {'esphome'}),
+    }))
+
+
+def wall_time(fname, runs):
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-m', 'esphome', fname, 'config'], cwd=ROOT,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--breakdown', help=argparse.SUPPRESS)
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+    if args.breakdown:
+        breakdown(args.breakdown)
+        return 0
+
+    directory = tempfile.mkdtemp()
+    small = os.path.join(directory, 'small.yaml')
+    with open(small, 'w') as f_handle:
+        f_handle.write(SMALL_CONFIG)
+    files = args.files or [small, os.path.join(ROOT, 'tests', 'test3.yaml'),
+                           os.path.join(ROOT, 'tests', 'test1.yaml')]
+
+    try:
+        print_table(files, args.runs)
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+def print_table(files, runs):
+    print(u"{:<12} {:>8} {:>8} {:>8} {:>9} {:>8}  {}".format(
+        u'config', u'wall', u'import', u'lookup', u'validate', u'modules', u'not validated'))
+    for fname in files:
+        wall = wall_time(fname, runs)
+        output = subprocess.check_output([sys.executable, __file__, '--breakdown', fname],
+                                         stderr=subprocess.PIPE)
+        phases = json.loads(output.decode().splitlines()[-1])
+        print(u"{:<12} {:>6.0f}ms {:>6.0f}ms {:>6.0f}ms {:>7.0f}ms {:>8}  {}".format(
+            os.path.basename(fname), wall * 1e3, phases['import'] * 1e3,
+            phases['lookup'] * 1e3, phases['validate'] * 1e3, phases['modules'],
+            u', '.join(phases['not_validated']) or u'-'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Measure how long the substitution pass takes on a large generated config.
+
+The config has SUBSTITUTIONS substitutions and SENSORS template sensors whose names, IDs,
+lambdas and filters use them, like a config that stamps out many similar nodes from one
+package. Prints the best time of RUNS passes, each on a fresh copy of the config.
+
+--compare takes another substitutions/__init__.py to measure next to the current one, for
+example the version before a change:
+
+    git show dfd4f27~1:esphome/components/substitutions/__init__.py > /tmp/old_subst.py
+    script/benchmark/substitutions.py --compare /tmp/old_subst.py
+
+Usage: script/benchmark/substitutions.py [--compare SUBSTITUTIONS_PY] [--sensors SENSORS]
+                                         [--substitutions SUBSTITUTIONS] [--runs RUNS]
+"""
+from __future__ import print_function
+
+import argparse
+import copy
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+from esphome.components import substitutions  # noqa: E402
+from esphome.core import Lambda  # noqa: E402
+from esphome.util import OrderedDict  # noqa: E402
+
+
+def make_config(num_sensors, num_substitutions):
+    subst = OrderedDict()
+    for i in range(num_substitutions):
+        subst[u'room{}'.format(i)] = u'Room {}'.format(i)
+    # A few substitutions that build on others
+    subst[u'prefix'] = u'${room0} node'
+    subst[u'interval'] = u'60s'
+    subst[u'offset'] = u'0.5'
+    subst[u'window'] = u'15'
+
+    sensors = []
+    for i in range(num_sensors):
+        room = u'room{}'.format(i % num_substitutions)
+        sensors.append(OrderedDict([
+            (u'platform', u'template'),
+            (u'name', u'${prefix} ${%s} temperature' % room),
+            (u'id', u'temperature_%d' % i),
+            (u'update_interval', u'$interval'),
+            (u'unit_of_measurement', u'°C'),
+            (u'lambda', Lambda(u'return id(temperature_%d).state;' % i)),
+            (u'filters', [
+                OrderedDict([(u'offset', u'$offset')]),
+                OrderedDict([(u'sliding_window_moving_average', OrderedDict([
+                    (u'window_size', u'$window'), (u'send_every', u'$window')]))]),
+                OrderedDict([(u'lambda', Lambda(u'return x * ${offset};'))]),
+            ]),
+        ]))
+    return OrderedDict([
+        (u'substitutions', subst),
+        (u'esphome', OrderedDict([(u'name', u'bench'), (u'platform', u'ESP32'),
+                                  (u'board', u'nodemcu-32s')])),
+        (u'sensor', sensors),
+    ])
+
+
+def load_module(path):
+    if sys.version_info[0] < 3:
+        import imp
+        return imp.load_source('compare_substitutions', path)
+    import importlib.util
+    spec = importlib.util.spec_from_file_location('compare_substitutions', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(module, config, runs):
+    best = None
+    for _ in range(runs):
+        fresh = copy.deepcopy(config)
+        start = time.time()
+        module.do_substitution_pass(fresh)
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--compare', help="Another substitutions/__init__.py to measure")
+    parser.add_argument('--sensors', type=int, default=5000)
+    parser.add_argument('--substitutions', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    modules = [('current', substitutions)]
+    if args.compare:
+        modules.insert(0, ('compare', load_module(args.compare)))
+
+    logging.disable(logging.WARNING)
+    config = make_config(args.sensors, args.substitutions)
+    for name, module in modules:
+        best = measure(module, config, args.runs)
+        print(u'{:<8} {} sensors, {} substitutions: {:6.1f} ms'.format(
+            name, args.sensors, args.substitutions, best * 1e3))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
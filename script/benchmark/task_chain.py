@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""Time CORE.flush_tasks on a chain of N tasks where each waits for the previous one.
+
+Usage: script/benchmark/task_chain.py [N ...]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)))
+
+# pylint: disable=wrong-import-position
+from esphome.core import CORE, ID, EsphomeError, coroutine  # noqa: E402
+
+
+def make_job(i):
+    @coroutine
+    def job():
+        if i > 0:
+            yield CORE.get_variable(ID(u'v{}'.format(i - 1)))
+        CORE.register_variable(ID(u'v{}'.format(i)), i)
+    return job
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [300, 1000, 10000]
+    for count in counts:
+        CORE.reset()
+        # Added in reverse, so every task but the last is blocked when it first runs
+        for i in reversed(range(count)):
+            CORE.add_job(make_job(i))
+        start = time.time()
+        try:
+            CORE.flush_tasks()
+        except EsphomeError as err:
+            print(u"{} tasks: failed after {:.3f}s: {}".format(count, time.time() - start, err))
+            continue
+        print(u"{} tasks: {:.3f}s".format(count, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
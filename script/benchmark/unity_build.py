@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Time a clean 'esphome CONFIG compile' with and without a unity build.
+
+The directory of each configuration is copied to a temporary directory for every run, so
+each compile starts without a build directory (platformio's own packages are still
+shared). Every configuration is compiled once normally and once for each unity build size
+given with --size (ESPHOME_UNITY_BUILD). Prints the best wall time of RUNS runs and the
+number of object files compiled from the esphome sources.
+
+The ESP8266/ESP32 platforms must be installed for platformio, and the configuration must
+compile without a unity build.
+
+Usage: script/benchmark/unity_build.py [-n RUNS] [--size SIZE ...] [FILE ...]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+SMALL_CONFIG = u"""\
+esphome:
+  name: small
+  platform: ESP8266
+  board: nodemcuv2
+wifi:
+  ssid: ssid
+  password: password
+api:
+ota:
+logger:
+sensor:
+  - platform: uptime
+    name: Uptime
+"""
+
+
+def count_objects(directory):
+    """Count the object files compiled from the src directory of the builds in directory."""
+    count = 0
+    for dirpath, dirnames, _ in os.walk(directory):
+        if os.path.basename(dirpath) != '.pioenvs':
+            continue
+        for env in dirnames:
+            for _, _, filenames in os.walk(os.path.join(dirpath, env, 'src')):
+                count += sum(1 for name in filenames if name.endswith('.o'))
+        del dirnames[:]
+    return count
+
+
+def compile_once(fname, size):
+    """Compile a copy of the configuration in a fresh directory.
+
+    Returns the wall time and the number of object files.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        config_dir = os.path.join(directory, 'config')
+        shutil.copytree(os.path.dirname(os.path.abspath(fname)), config_dir,
+                        ignore=shutil.ignore_patterns('.esphome', 'build', '.pioenvs',
+                                                      '.piolibdeps'))
+        env = dict(os.environ)
+        env.pop('ESPHOME_UNITY_BUILD', None)
+        if size is not None:
+            env['ESPHOME_UNITY_BUILD'] = str(size)
+        start = time.time()
+        proc = subprocess.Popen([sys.executable, '-m', 'esphome',
+                                 os.path.join(config_dir, os.path.basename(fname)), 'compile'],
+                                cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        duration = time.time() - start
+        if proc.returncode != 0:
+            sys.stderr.write(output.decode('utf-8', 'replace'))
+            raise RuntimeError(u"Compiling {} failed".format(fname))
+        return duration, count_objects(config_dir)
+    finally:
+        shutil.rmtree(directory)
+
+
+def measure(fname, size, runs):
+    best = None
+    objects = None
+    for _ in range(runs):
+        duration, objects = compile_once(fname, size)
+        best = duration if best is None else min(best, duration)
+    return best, objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=1)
+    parser.add_argument('--size', type=int, action='append',
+                        help="Source files per unity build unit, can be given more than once "
+                             "(default: 8)")
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+    sizes = args.size or [8]
+
+    directory = tempfile.mkdtemp()
+    small = os.path.join(directory, 'small.yaml')
+    with open(small, 'w') as f_handle:
+        f_handle.write(SMALL_CONFIG)
+    files = args.files or [small]
+
+    try:
+        print(u"{:<12} {:>8} {:>9} {:>8} {:>8}".format(
+            u'config', u'unity', u'wall', u'speedup', u'objects'))
+        for fname in files:
+            baseline = None
+            for size in [None] + sizes:
+                duration, objects = measure(fname, size, args.runs)
+                if baseline is None:
+                    baseline = duration
+                print(u"{:<12} {:>8} {:>8.1f}s {:>7.2f}x {:>8}".format(
+                    os.path.basename(fname), u'off' if size is None else size, duration,
+                    baseline / duration, objects))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""Time the pure-Python and libyaml loaders on the test configurations.
+
+Usage: script/benchmark/yaml_loader.py [-n RUNS] [FILE ...]
+"""
+from __future__ import print_function
+
+import argparse
+import functools
+import io
+import os
+import sys
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+sys.path.insert(0, ROOT)
+
+import yaml  # noqa: E402 pylint: disable=wrong-import-position
+
+from esphome import yaml_util  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def load(content, fname, loader):
+    stream = io.StringIO(content)
+    stream.name = fname
+    return yaml.load(stream, Loader=loader)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('files', nargs='*', default=[
+        os.path.join(ROOT, 'tests', 'test{}.yaml'.format(i)) for i in range(1, 4)])
+    args = parser.parse_args()
+    if len(yaml_util._LOADERS) < 2:  # pylint: disable=protected-access
+        print("PyYAML is built without libyaml, nothing to compare")
+        return 1
+
+    for fname in args.files:
+        with io.open(fname, encoding='utf-8') as f_handle:
+            content = f_handle.read()
+        times = []
+        for loader in (yaml_util.SafeLineLoader, yaml_util.CSafeLineLoader):
+            best = min(timeit.repeat(functools.partial(load, content, fname, loader),
+                                     number=1, repeat=args.runs))
+            times.append(best * 1000)
+        print(u"{}: python {:.1f}ms, libyaml {:.1f}ms".format(os.path.basename(fname), *times))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""A Python implementation of the device side of the OTA protocol for the espota2 tests.
+
+It follows ota_component.cpp and stands in for a device, the results record what it
+received and how many bytes were sent over the network.
+"""
+import hashlib
+import logging
+import random
+import socket
+import struct
+import threading
+import zlib
+
+from esphome import espota2
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ReceiverError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class OTAResult(object):
+    """The outcome of one upload to the receiver."""
+
+    def __init__(self):
+        self.firmware = None
+        self.compressed = False
+        self.delta = False
+        # All bytes received on the connection, including the handshake
+        self.wire_bytes = 0
+        self.error = None
+
+
+class _Connection(object):
+    def __init__(self, sock, result):
+        self.sock = sock
+        self.result = result
+
+    def receive(self, amount):
+        data = b''
+        while len(data) < amount:
+            chunk = self.sock.recv(amount - len(data))
+            if not chunk:
+                raise ReceiverError(None, "Connection closed")
+            self.result.wire_bytes += len(chunk)
+            data += chunk
+        return data
+
+    def receive_some(self, amount):
+        chunk = self.sock.recv(amount)
+        if not chunk:
+            raise ReceiverError(None, "Connection closed")
+        self.result.wire_bytes += len(chunk)
+        return chunk
+
+    def send(self, *values):
+        self.sock.sendall(bytearray(values))
+
+
+class _DeltaPatcher(object):
+    """Rebuilds a firmware from a patch against the running firmware, like OTADeltaPatcher."""
+
+    def __init__(self, base):
+        self.base = base
+        self.output = bytearray()
+        self._op = bytearray()
+        self._insert_remaining = 0
+
+    def write(self, data):
+        data = bytearray(data)
+        pos = 0
+        while pos < len(data):
+            if self._insert_remaining:
+                chunk = data[pos:pos + self._insert_remaining]
+                self.output += chunk
+                pos += len(chunk)
+                self._insert_remaining -= len(chunk)
+                continue
+            self._op.append(data[pos])
+            pos += 1
+            if self._op[0] == espota2.DELTA_OP_COPY:
+                op_size = 9
+            elif self._op[0] == espota2.DELTA_OP_INSERT:
+                op_size = 5
+            else:
+                raise ReceiverError(espota2.RESPONSE_ERROR_WRITING_FLASH,
+                                    "Unknown delta operation 0x{:02X}".format(self._op[0]))
+            if len(self._op) < op_size:
+                continue
+            if op_size == 5:
+                self._insert_remaining, = struct.unpack('>I', bytes(self._op[1:5]))
+            else:
+                offset, length = struct.unpack('>II', bytes(self._op[1:9]))
+                if offset + length > len(self.base):
+                    raise ReceiverError(espota2.RESPONSE_ERROR_WRITING_FLASH,
+                                        "Delta copy out of range")
+                self.output += self.base[offset:offset + length]
+            self._op = bytearray()
+
+
+class OTAReceiver(object):
+    """Accepts OTA uploads on a local port, one at a time, in a background thread.
+
+    The received firmware and statistics of every upload are appended to results. firmware
+    is the firmware the receiver runs, delta updates patch it and successful uploads replace
+    it.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, password='', supports_compression=True,
+                 supports_delta=True, firmware=b''):
+        self.password = password
+        self.supports_compression = supports_compression
+        self.supports_delta = supports_delta
+        self.firmware = firmware
+        self.results = []
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.getsockname()[1]
+
+    def start(self):
+        self._server.listen(5)
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._server.close()
+
+    def _serve(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except socket.error:
+                return
+            result = OTAResult()
+            try:
+                self._handle(_Connection(sock, result))
+            except ReceiverError as err:
+                result.error = str(err)
+                if err.code is not None:
+                    try:
+                        sock.sendall(bytearray([err.code]))
+                    except socket.error:
+                        pass
+            except socket.error as err:
+                result.error = str(err)
+            finally:
+                sock.close()
+            self.results.append(result)
+
+    def _handle(self, conn):
+        if bytearray(conn.receive(5)) != bytearray(espota2.MAGIC_BYTES):
+            raise ReceiverError(espota2.RESPONSE_ERROR_MAGIC, "Magic bytes do not match")
+        conn.send(espota2.RESPONSE_OK, espota2.OTA_VERSION_1_0)
+
+        features = bytearray(conn.receive(1))[0]
+        compressed = self.supports_compression and \
+            bool(features & espota2.FEATURE_SUPPORTS_COMPRESSION)
+        delta = self.supports_delta and bool(features & espota2.FEATURE_SUPPORTS_DELTA)
+        if compressed and delta:
+            conn.send(espota2.RESPONSE_SUPPORTS_COMPRESSION_AND_DELTA)
+        elif delta:
+            conn.send(espota2.RESPONSE_SUPPORTS_DELTA)
+        else:
+            conn.send(espota2.RESPONSE_SUPPORTS_COMPRESSION if compressed
+                      else espota2.RESPONSE_HEADER_OK)
+
+        if self.password:
+            self._authenticate(conn)
+        conn.send(espota2.RESPONSE_AUTH_OK)
+
+        if delta:
+            base_size, = struct.unpack('>I', conn.receive(4))
+            base_md5 = u'0' * 32
+            if 0 < base_size <= len(self.firmware):
+                base_md5 = hashlib.md5(self.firmware[:base_size]).hexdigest()
+            conn.sock.sendall(base_md5.encode())
+            delta = bytearray(conn.receive(1))[0] == espota2.DELTA_MODE_PATCH
+
+        size = 0
+        for byte in bytearray(conn.receive(4)):
+            size = (size << 8) | byte
+        conn.send(espota2.RESPONSE_UPDATE_PREPARE_OK)
+        md5 = conn.receive(32).decode()
+        conn.send(espota2.RESPONSE_BIN_MD5_OK)
+
+        conn.result.compressed = compressed
+        conn.result.delta = delta
+        patcher = _DeltaPatcher(self.firmware) if delta else None
+        if compressed:
+            firmware = self._receive_compressed(conn, size, patcher)
+        elif delta:
+            while len(patcher.output) < size:
+                patcher.write(conn.receive_some(1024))
+            firmware = bytes(patcher.output)
+        else:
+            firmware = conn.receive(size)
+        conn.result.firmware = firmware
+
+        conn.send(espota2.RESPONSE_RECEIVE_OK)
+        if len(firmware) != size or hashlib.md5(firmware).hexdigest() != md5:
+            raise ReceiverError(espota2.RESPONSE_ERROR_UPDATE_END, "MD5 mismatch")
+        conn.send(espota2.RESPONSE_UPDATE_END_OK)
+        self.firmware = firmware
+        conn.receive(1)
+
+    @staticmethod
+    def _receive_compressed(conn, size, patcher):
+        decompressor = zlib.decompressobj()
+        firmware = b''
+        while not decompressor.eof:
+            chunk = decompressor.decompress(conn.receive_some(1024))
+            if patcher is not None:
+                patcher.write(chunk)
+                firmware = patcher.output
+            else:
+                firmware += chunk
+            if len(firmware) > size:
+                raise ReceiverError(espota2.RESPONSE_ERROR_WRITING_FLASH,
+                                    "Firmware larger than announced")
+        return bytes(firmware)
+
+    def _authenticate(self, conn):
+        conn.send(espota2.RESPONSE_REQUEST_AUTH)
+        nonce = hashlib.md5(str(random.random()).encode()).hexdigest()
+        conn.sock.sendall(nonce.encode())
+        cnonce = conn.receive(32).decode()
+        response = conn.receive(32).decode()
+        expected = hashlib.md5((self.password + nonce + cnonce).encode('utf-8')).hexdigest()
+        if response != expected:
+            raise ReceiverError(espota2.RESPONSE_ERROR_AUTH_INVALID, "Authentication invalid")
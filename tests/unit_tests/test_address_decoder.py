@@ -0,0 +1,84 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from esphome.platformio_api import AddressDecoder
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="Uses a script as addr2line")
+
+# Answers like addr2line -pfiaC: 0x...10 is inlined into a caller, 0x...20 is a plain
+# function, everything else (including the 0 end marker) is unknown
+FAKE_ADDR2LINE = u"""\
+#!{python}
+import sys
+
+with open({log!r}, 'a') as log:
+    log.write('start\\n')
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    addr = int(line, 16)
+    out = '0x{{:08x}}: '.format(addr)
+    if addr == 0x40201010:
+        out += 'inner at src/a.h:3\\n (inlined by) outer at src/a.cpp:10\\n'
+    elif addr == 0x40201020:
+        out += 'loop() at src/main.cpp:42\\n'
+    elif addr == 0x40201030:
+        sys.exit(1)
+    else:
+        out += '?? ??:0\\n'
+    sys.stdout.write(out)
+    sys.stdout.flush()
+"""
+
+
+@pytest.fixture
+def decoder(tmpdir):
+    script = tmpdir.join('addr2line')
+    script.write(FAKE_ADDR2LINE.format(python=sys.executable, log=str(tmpdir.join('log'))))
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    decoder = AddressDecoder(str(script), str(tmpdir.join('firmware.elf')))
+    yield decoder
+    decoder.close()
+
+
+def starts(tmpdir):
+    return tmpdir.join('log').read().count('start')
+
+
+def test_inlined_frames_split_at_end_marker(decoder):
+    result = decoder.decode(['40201010', '40201020', '40201010'])
+    assert result == {
+        '40201010': u'0x40201010: inner at src/a.h:3\n (inlined by) outer at src/a.cpp:10',
+        '40201020': u'0x40201020: loop() at src/main.cpp:42',
+    }
+
+
+def test_unknown_address_is_none(decoder):
+    assert decoder.decode(['40209999', '40201020']) == {
+        '40209999': None,
+        '40201020': u'0x40201020: loop() at src/main.cpp:42',
+    }
+
+
+def test_one_process_and_memoized(decoder, tmpdir):
+    decoder.decode(['40201010'])
+    decoder.decode(['40201020'])
+    decoder.decode(['40201010', '40201020'])
+    assert starts(tmpdir) == 1
+
+
+def test_batches_larger_than_pipe_chunk(decoder):
+    addrs = ['4030{:04x}'.format(i) for i in range(200)] + ['40201020']
+    result = decoder.decode(addrs)
+    assert result['40201020'] == u'0x40201020: loop() at src/main.cpp:42'
+    assert sum(1 for value in result.values() if value is None) == 200
+
+
+def test_exited_process_reports_undecodable_and_restarts(decoder, tmpdir):
+    assert decoder.decode(['40201030', '40201040']) == {'40201030': None, '40201040': None}
+    assert decoder.decode(['40201020'])['40201020'] == u'0x40201020: loop() at src/main.cpp:42'
+    assert starts(tmpdir) == 2
@@ -0,0 +1,140 @@
+import pytest
+
+# The asyncio client is Python 3 only
+async_client = pytest.importorskip('esphome.api.async_client')
+
+import esphome.api.api_pb2 as pb  # noqa: E402 pylint: disable=wrong-import-position
+from esphome.api.client import APIConnectionError, _varuint_to_bytes  # noqa: E402
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.frames = []
+        self.errors = []
+
+    def handle_frame(self, msg_type, raw_msg):
+        # The frame is a view of the receive buffer, only valid during the call
+        self.frames.append((msg_type, raw_msg.tobytes()))
+
+    def connection_lost(self, protocol, err):
+        protocol.transport = None
+        self.errors.append(err)
+
+
+class FakeTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        pass
+
+
+def frame(msg_type, payload):
+    return b'\x00' + _varuint_to_bytes(len(payload)) + _varuint_to_bytes(msg_type) + payload
+
+
+@pytest.fixture
+def protocol():
+    proto = async_client.APIProtocol(FakeClient())
+    proto.connection_made(FakeTransport())
+    return proto
+
+
+def test_read_varuint():
+    assert async_client._read_varuint(bytearray(b'\x05'), 0) == (5, 1)
+    assert async_client._read_varuint(bytearray(b'\x00\xac\x02'), 1) == (300, 3)
+    assert async_client._read_varuint(bytearray(b'\xac'), 0) is None
+
+
+def test_several_frames_in_one_chunk(protocol):
+    data = frame(1, b'abc') + frame(7, b'') + frame(200, b'x' * 300)
+    protocol.data_received(data)
+    assert protocol._client.frames == [(1, b'abc'), (7, b''), (200, b'x' * 300)]
+    assert not protocol._buffer
+
+
+@pytest.mark.parametrize('split', range(1, 6))
+def test_frame_split_in_varints(protocol, split):
+    # Length 300 and type 200 are both two byte varints, the splits fall into them
+    data = frame(200, b'y' * 300)
+    protocol.data_received(data[:split])
+    assert protocol._client.frames == []
+    protocol.data_received(data[split:])
+    assert protocol._client.frames == [(200, b'y' * 300)]
+    assert not protocol._buffer
+
+
+def test_frames_byte_by_byte(protocol):
+    data = frame(1, b'abc') + frame(200, b'z' * 130)
+    for i in range(len(data)):
+        protocol.data_received(data[i:i + 1])
+    assert protocol._client.frames == [(1, b'abc'), (200, b'z' * 130)]
+
+
+def test_partial_frame_kept(protocol):
+    first = frame(1, b'abc')
+    data = first + frame(2, b'defg')
+    protocol.data_received(data[:-2])
+    assert protocol._client.frames == [(1, b'abc')]
+    assert protocol._buffer == bytearray(data[len(first):-2])
+    protocol.data_received(data[-2:])
+    assert protocol._client.frames == [(1, b'abc'), (2, b'defg')]
+
+
+def test_bad_preamble(protocol):
+    protocol.data_received(frame(1, b'abc') + b'\x01' + frame(2, b'def')[1:])
+    assert protocol._client.frames == [(1, b'abc')]
+    assert len(protocol._client.errors) == 1
+    assert isinstance(protocol._client.errors[0], APIConnectionError)
+    assert u"Invalid preamble" in str(protocol._client.errors[0])
+
+
+@pytest.fixture
+def loop():
+    loop = async_client.asyncio.new_event_loop()
+    errors = []
+    loop.set_exception_handler(lambda _, context: errors.append(context))
+    loop.errors = errors
+    yield loop
+    loop.close()
+
+
+def connected_client(loop):
+    cli = async_client.AsyncAPIClient('127.0.0.1', 6053, 'pw', loop=loop)
+    cli._protocol = async_client.APIProtocol(cli)
+    cli._protocol.connection_made(FakeTransport())
+    cli._connected = True
+    return cli
+
+
+def run_briefly(loop):
+    loop.run_until_complete(async_client.asyncio.sleep(0.01))
+
+
+def test_login(loop):
+    cli = connected_client(loop)
+    future = cli.login()
+    cli._protocol.data_received(frame(4, pb.ConnectResponse().SerializeToString()))
+    assert loop.run_until_complete(future).invalid_password is False
+    assert cli._authenticated
+
+
+def test_login_invalid_password(loop):
+    cli = connected_client(loop)
+    future = cli.login()
+    cli._protocol.data_received(frame(4, pb.ConnectResponse(invalid_password=True)
+                                      .SerializeToString()))
+    with pytest.raises(APIConnectionError):
+        loop.run_until_complete(future)
+    assert not cli.connected
+
+
+def test_cancelled_login_closes_connection(loop):
+    cli = connected_client(loop)
+    cli.login().cancel()
+    run_briefly(loop)
+    assert loop.errors == []
+    assert not cli.connected
@@ -0,0 +1,70 @@
+from esphome import config, core
+import esphome.codegen as cg
+
+fake_ns = cg.esphome_ns.namespace('test')
+Base = fake_ns.class_('Base')
+Child = fake_ns.class_('Child', Base)
+Other = fake_ns.class_('Other')
+
+
+def declare(id_=None, type_=Base):
+    return core.ID(id_, is_declaration=True, type=type_)
+
+
+def make_config(items):
+    result = config.Config()
+    result['test'] = [{'id': id_} for id_ in items]
+    return result
+
+
+def reference_names(items):
+    """Names given by resolving each ID against all declared IDs one after another."""
+    ids = [core.ID(id_.id, is_declaration=True, type=id_.type) for id_ in items]
+    for id_ in ids:
+        id_.resolve([other.id for other in ids])
+    return [id_.id for id_ in ids]
+
+
+def test_default_ids_resolved_in_declaration_order():
+    items = [declare(), declare(u'test_base'), declare(), declare(u'test_base_3'),
+             declare(), declare(type_=Child), declare(u'test_child_2'), declare(type_=Child)]
+    expected = reference_names(items)
+    result = make_config(items)
+    config.do_id_pass(result)
+    assert not result.errors
+    assert [id_.id for id_ in items] == expected
+    assert expected == [u'test_base_2', u'test_base', u'test_base_4',
+                        u'test_base_3', u'test_base_5', u'test_child',
+                        u'test_child_2', u'test_child_3']
+
+
+def test_default_id_avoids_reserved_names():
+    class_ = cg.global_ns.class_('int')
+    items = [declare(type_=class_), declare(type_=class_)]
+    result = make_config(items)
+    config.do_id_pass(result)
+    assert [id_.id for id_ in items] == [u'int_2', u'int_3']
+
+
+def test_typed_reference_uses_first_matching_declaration():
+    items = [declare(u'other', Other), declare(u'child', Child), declare(u'base', Base)]
+    result = make_config(items)
+    by_child = core.ID(None, type=Child)
+    by_base = core.ID(None, type=Base)
+    result['ref'] = {'child': by_child, 'base': by_base}
+    config.do_id_pass(result)
+    assert not result.errors
+    assert by_child.id == u'child'
+    assert by_base.id == u'child'
+
+
+def test_manual_reference_errors():
+    result = make_config([declare(u'dup'), declare(u'dup'), declare(u'other', Other)])
+    result['ref'] = {'missing': core.ID(u'missing', type=Base),
+                     'wrong_type': core.ID(u'other', type=Base)}
+    config.do_id_pass(result)
+    messages = [msg for msg, _ in result.errors]
+    assert messages[0] == u"ID dup redefined!"
+    assert messages[1] == u"Couldn't find ID 'missing'"
+    assert messages[2].startswith(u"ID 'other' of type test::Other doesn't inherit from")
+    assert len(messages) == 3
@@ -0,0 +1,147 @@
+import pytest
+
+from esphome.core import CORE, ID, MAX_IDLE_TASK_PASSES, EsphomeError, coroutine, \
+    coroutine_with_priority
+
+
+@pytest.fixture(autouse=True)
+def reset_core():
+    CORE.reset()
+    yield
+    CORE.reset()
+
+
+def chain_job(i, order):
+    @coroutine
+    def job():
+        if i > 0:
+            yield CORE.get_variable(ID(u'v{}'.format(i - 1)))
+        CORE.register_variable(ID(u'v{}'.format(i)), i)
+        order.append(i)
+    return job
+
+
+def test_long_dependency_chain_resolves():
+    order = []
+    # Added in reverse, so every task but the last has to wait for the previous one
+    for i in reversed(range(2000)):
+        CORE.add_job(chain_job(i, order))
+    CORE.flush_tasks()
+    assert order == list(range(2000))
+    assert not CORE.blocked_tasks
+
+
+def test_blocked_task_resumes_with_variable():
+    result = []
+
+    @coroutine
+    def waiter():
+        value = yield CORE.get_variable(ID(u'target'))
+        result.append(value)
+
+    @coroutine_with_priority(-10.0)
+    def provider():
+        CORE.register_variable(ID(u'target'), 42)
+
+    CORE.add_job(waiter)
+    CORE.add_job(provider)
+    CORE.flush_tasks()
+    assert result == [42]
+
+
+def test_tasks_run_in_priority_order():
+    order = []
+
+    def make(name, priority):
+        @coroutine_with_priority(priority)
+        def job():
+            order.append(name)
+        return job
+
+    CORE.add_job(make('low', -100.0))
+    CORE.add_job(make('high', 100.0))
+    CORE.add_job(make('default', 0.0))
+    CORE.flush_tasks()
+    assert order == ['high', 'default', 'low']
+
+
+def test_missing_ids_are_reported():
+    @coroutine
+    def first():
+        yield CORE.get_variable(ID(u'never_b'))
+
+    @coroutine
+    def second():
+        yield CORE.get_variable(ID(u'never_a'))
+
+    CORE.add_job(first)
+    CORE.add_job(second)
+    with pytest.raises(EsphomeError) as err:
+        CORE.flush_tasks()
+    assert str(err.value) == (u"Circular dependency detected! The following IDs are waited "
+                              u"for but never registered: never_a, never_b")
+
+
+def test_get_variable_with_full_id_returns_registered_id():
+    result = []
+
+    @coroutine
+    def lookup():
+        full_id, obj = yield CORE.get_variable_with_full_id(ID(u'target'))
+        result.append((full_id, obj))
+
+    @coroutine_with_priority(-10.0)
+    def provider():
+        CORE.register_variable(ID(u'target', is_declaration=True, type=u'Sensor'), 42)
+
+    CORE.add_job(lookup)
+    CORE.add_job(provider)
+    CORE.flush_tasks()
+    full_id, obj = result[0]
+    assert obj == 42
+    assert full_id.is_declaration
+    assert full_id.type == u'Sensor'
+
+
+def test_task_without_progress_is_reported():
+    @coroutine
+    def spinning():
+        while True:
+            yield
+
+    @coroutine
+    def other():
+        yield CORE.get_variable(ID(u'never_registered'))
+
+    CORE.add_job(spinning)
+    CORE.add_job(other)
+    with pytest.raises(EsphomeError) as err:
+        CORE.flush_tasks()
+    assert str(err.value) == (u"Circular dependency detected! The following tasks keep "
+                              u"running without making progress: spinning")
+
+
+def test_long_task_without_code_finishes():
+    result = []
+
+    @coroutine
+    def counting():
+        # Adds no code for many passes, but finishes within the limit
+        for i in range(MAX_IDLE_TASK_PASSES - 1):
+            yield i
+        result.append(True)
+
+    @coroutine
+    def spinning_until_registered():
+        while not CORE.has_id(ID(u'late')):
+            yield
+
+    @coroutine_with_priority(-10.0)
+    def provider():
+        CORE.register_variable(ID(u'late'), 1)
+
+    CORE.add_job(counting)
+    CORE.add_job(spinning_until_registered)
+    CORE.add_job(provider)
+    CORE.flush_tasks()
+    assert result == [True]
@@ -0,0 +1,57 @@
+import pytest
+
+from esphome import cpp_generator as cg
+from esphome.core import HexInt
+from esphome.py_compat import IS_PY2
+
+
+def test_int_array_initializer_bytes_as_hex():
+    expr = cg.IntArrayInitializer(bytes(bytearray(range(18))))
+    assert str(expr) == (
+        u'{\n'
+        u'  0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B, 0x0C, '
+        u'0x0D, 0x0E, 0x0F,\n'
+        u'  0x10, 0x11,\n'
+        u'}')
+
+
+def test_int_array_initializer_ints_as_decimal():
+    expr = cg.IntArrayInitializer([1, -200, 3000, 40000], per_line=3)
+    assert str(expr) == u'{\n  1, -200, 3000,\n  40000,\n}'
+
+
+def test_int_array_initializer_empty():
+    assert str(cg.IntArrayInitializer([])) == u'{}'
+    assert str(cg.IntArrayInitializer(b'')) == u'{}'
+
+
+def test_int_array_initializer_matches_array_initializer_values():
+    data = bytearray([0, 0x7F, 0x80, 0xFF] * 10)
+    packed = str(cg.safe_exp(data))
+    per_element = str(cg.ArrayInitializer(*[HexInt(x) for x in data]))
+
+    def values(text):
+        return [x.strip() for x in text.strip(u'{}\n ').split(u',') if x.strip()]
+
+    assert isinstance(cg.safe_exp(data), cg.IntArrayInitializer)
+    assert values(packed) == values(per_element)
+
+
+@pytest.mark.parametrize('data', [
+    bytes(bytearray([0, 0x7F, 0x80, 0xFF])),
+    bytearray([0, 0x7F, 0x80, 0xFF]),
+    memoryview(bytearray([0, 0x7F, 0x80, 0xFF])),
+])
+def test_safe_exp_binary_data(data):
+    expr = cg.safe_exp(data)
+    if IS_PY2 and isinstance(data, str):
+        # A Python 2 str is a string
+        assert isinstance(expr, cg.StringLiteral)
+        return
+    assert isinstance(expr, cg.IntArrayInitializer)
+    assert str(expr) == u'{\n  0x00, 0x7F, 0x80, 0xFF,\n}'
+
+
+def test_safe_exp_strings():
+    assert isinstance(cg.safe_exp(u'text'), cg.StringLiteral)
+    assert isinstance(cg.safe_exp('text'), cg.StringLiteral)
@@ -0,0 +1,220 @@
+import io
+import logging
+import os
+import random
+import socket
+import struct
+import time
+
+import pytest
+
+from esphome import espota2
+from ota_receiver import OTAReceiver, _DeltaPatcher
+
+
+@pytest.fixture
+def receiver():
+    receivers = []
+
+    def start(**kwargs):
+        kwargs.setdefault('supports_compression', False)
+        kwargs.setdefault('supports_delta', False)
+        rec = OTAReceiver(**kwargs)
+        rec.start()
+        receivers.append(rec)
+        return rec
+
+    yield start
+    for rec in receivers:
+        rec.stop()
+
+
+def random_firmware(size, seed=0):
+    rand = random.Random(seed)
+    return bytes(bytearray(rand.getrandbits(8) for _ in range(size)))
+
+
+def upload(rec, firmware, tmpdir, password=None, **kwargs):
+    """Upload firmware to the receiver and return the receiver's result."""
+    kwargs.setdefault('show_progress', False)
+    count = len(rec.results)
+    path = tmpdir.join('firmware.bin')
+    path.write_binary(firmware)
+    sock = socket.create_connection(('127.0.0.1', rec.port))
+    sock.settimeout(10.0)
+    try:
+        with open(str(path), 'rb') as f_handle:
+            espota2.perform_ota(sock, password, f_handle, str(path), wait=False, **kwargs)
+    finally:
+        sock.close()
+    # The receiver records the result once it has closed the connection
+    deadline = time.time() + 10.0
+    while len(rec.results) == count and time.time() < deadline:
+        time.sleep(0.01)
+    return rec.results[-1]
+
+
+@pytest.mark.parametrize('chunk_size', [1000, espota2.OTA_CHUNK_SIZE])
+def test_streamed_upload_round_trip(receiver, tmpdir, chunk_size):
+    rec = receiver()
+    firmware = random_firmware(100000)
+    result = upload(rec, firmware, tmpdir, chunk_size=chunk_size)
+    assert result.error is None
+    assert result.firmware == firmware
+    assert not result.compressed
+
+
+def test_upload_with_progress_bar_and_password(receiver, tmpdir, capsys):
+    rec = receiver(password='secret')
+    firmware = random_firmware(50000, seed=1)
+    result = upload(rec, firmware, tmpdir, password='secret', show_progress=True)
+    assert result.error is None
+    assert result.firmware == firmware
+    assert u'Done...' in capsys.readouterr().err
+
+
+def test_wrong_password(receiver, tmpdir):
+    rec = receiver(password='secret')
+    with pytest.raises(espota2.OTAError):
+        upload(rec, random_firmware(1000), tmpdir, password='wrong')
+
+
+def test_empty_firmware(receiver, tmpdir):
+    rec = receiver()
+    result = upload(rec, b'', tmpdir)
+    assert result.error is None
+    assert result.firmware == b''
+
+
+def test_map_file(tmpdir):
+    firmware = random_firmware(20000, seed=2)
+    path = tmpdir.join('firmware.bin')
+    path.write_binary(firmware)
+    with open(str(path), 'rb') as f_handle:
+        data = espota2._map_file(f_handle)
+        try:
+            assert data[:] == firmware
+        finally:
+            data.close()
+    # Empty files can't be mapped and are read instead
+    with io.open(os.devnull, 'rb') as f_handle:
+        assert espota2._map_file(f_handle) == b''
+
+
+def compressible_firmware(size):
+    return (random_firmware(1000, seed=3) * (size // 1000 + 1))[:size]
+
+
+def test_compressed_upload(receiver, tmpdir, monkeypatch):
+    # The firmware is compressed in a stream, never as a whole
+    monkeypatch.delattr(espota2.zlib, 'compress')
+    rec = receiver(supports_compression=True)
+    firmware = compressible_firmware(100000)
+    result = upload(rec, firmware, tmpdir, show_progress=True)
+    assert result.error is None
+    assert result.compressed
+    assert result.firmware == firmware
+    assert result.wire_bytes < len(firmware) // 10
+
+
+def test_compression_disabled(receiver, tmpdir):
+    rec = receiver(supports_compression=True)
+    firmware = compressible_firmware(100000)
+    result = upload(rec, firmware, tmpdir, compression=False)
+    assert result.error is None
+    assert not result.compressed
+    assert result.firmware == firmware
+
+
+def test_device_without_compression(receiver, tmpdir, monkeypatch):
+    # A device that doesn't support compression answers the features with 64, the
+    # firmware isn't compressed at all then
+    monkeypatch.delattr(espota2.zlib, 'compressobj')
+    rec = receiver(supports_compression=False)
+    firmware = compressible_firmware(100000)
+    result = upload(rec, firmware, tmpdir)
+    assert result.error is None
+    assert not result.compressed
+    assert result.firmware == firmware
+    assert result.wire_bytes > len(firmware)
+
+
+def modified_firmware(base):
+    """A new version of base with changed, inserted and removed bytes."""
+    return base[:1000] + b'changed' + base[1007:20000] + random_firmware(500, seed=4) + \
+        base[20000:40000] + base[45000:]
+
+
+def patch_operations(patch):
+    operations = []
+    pos = 0
+    while pos < len(patch):
+        operation = bytearray(patch[pos:pos + 1])[0]
+        if operation == espota2.DELTA_OP_COPY:
+            operations.append(('copy',) + struct.unpack('>II', patch[pos + 1:pos + 9]))
+            pos += 9
+        else:
+            assert operation == espota2.DELTA_OP_INSERT
+            length, = struct.unpack('>I', patch[pos + 1:pos + 5])
+            operations.append(('insert', length))
+            pos += 5 + length
+    return operations
+
+
+def test_compute_delta_copy_and_insert():
+    base = random_firmware(50000, seed=5)
+    data = modified_firmware(base)
+    patch = espota2.compute_delta(base, data)
+    assert patch_operations(patch) == [
+        ('copy', 0, 1000), ('insert', 7), ('copy', 1007, 18993), ('insert', 500),
+        ('copy', 20000, 20000), ('copy', 45000, 5000)]
+    patcher = _DeltaPatcher(base)
+    # Split in odd places, the device receives the patch in arbitrary pieces
+    for pos in range(0, len(patch), 7):
+        patcher.write(patch[pos:pos + 7])
+    assert bytes(patcher.output) == data
+
+
+def test_compute_delta_without_common_blocks():
+    data = random_firmware(1000, seed=6)
+    patch = espota2.compute_delta(random_firmware(1000, seed=7), data)
+    assert patch_operations(patch) == [('insert', 1000)]
+    assert espota2.compute_delta(b'', b'') == b''
+
+
+@pytest.mark.parametrize('supports_compression', [False, True])
+def test_delta_upload(receiver, tmpdir, supports_compression):
+    base = random_firmware(50000, seed=5)
+    rec = receiver(supports_compression=supports_compression, supports_delta=True, firmware=base)
+    firmware = modified_firmware(base)
+    result = upload(rec, firmware, tmpdir, base=base)
+    assert result.error is None
+    assert result.delta
+    assert result.compressed == supports_compression
+    assert result.firmware == firmware
+    assert rec.firmware == firmware
+    assert result.wire_bytes < 1000
+
+
+def test_delta_upload_mismatched_base(receiver, tmpdir, caplog):
+    caplog.set_level(logging.INFO)
+    base = random_firmware(50000, seed=5)
+    rec = receiver(supports_delta=True, firmware=random_firmware(50000, seed=8))
+    firmware = modified_firmware(base)
+    result = upload(rec, firmware, tmpdir, base=base)
+    assert result.error is None
+    assert not result.delta
+    assert result.firmware == firmware
+    assert u"doesn't run the last uploaded firmware" in caplog.text
+
+
+def test_delta_upload_device_without_delta(receiver, tmpdir):
+    # The device answers 70, it supports compression but not delta updates
+    base = random_firmware(50000, seed=5)
+    rec = receiver(supports_compression=True, supports_delta=False, firmware=base)
+    firmware = modified_firmware(base)
+    result = upload(rec, firmware, tmpdir, base=base)
+    assert result.error is None
+    assert result.compressed
+    assert not result.delta
+    assert result.firmware == firmware
@@ -0,0 +1,68 @@
+import argparse
+
+import pytest
+
+from esphome import fleet
+from esphome.__main__ import parse_args
+
+
+def make_args(**kwargs):
+    defaults = dict(configuration=[], verbose=False, generate_jobs=1, jobs=1,
+                    only_generate=False, ota_jobs=8, ota_jobs_per_subnet=0, ota_retries=2)
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+def test_expand_configurations(tmpdir):
+    for name in ['b.yaml', 'a.yaml', 'secrets.yaml', '.hidden.yaml', 'notes.txt']:
+        tmpdir.join(name).write(u'')
+    path = str(tmpdir)
+    a_yaml = str(tmpdir.join('a.yaml'))
+    b_yaml = str(tmpdir.join('b.yaml'))
+    assert fleet.expand_configurations([path]) == [a_yaml, b_yaml]
+    # Files given more than once are only returned once
+    assert fleet.expand_configurations([b_yaml, path]) == [b_yaml, a_yaml]
+
+
+def test_compile_empty_directory(tmpdir, caplog):
+    path = str(tmpdir)
+    assert fleet.expand_configurations([path]) == []
+    assert fleet.compile_fleet(make_args(configuration=[path]), []) == 1
+    assert u"No configuration files found in {}".format(path) in caplog.text
+
+
+def test_print_summary_without_nodes(capsys):
+    fleet.print_summary([])
+    assert u"No nodes were built" in capsys.readouterr().out
+
+
+def test_upload_empty_directory(tmpdir, caplog):
+    path = str(tmpdir)
+    assert fleet.upload_fleet(make_args(configuration=[path]), []) == 1
+    assert u"No configuration files found in {}".format(path) in caplog.text
+
+
+def test_print_upload_summary_without_nodes(capsys):
+    fleet.print_upload_summary([])
+    assert u"No nodes were uploaded to" in capsys.readouterr().out
+
+
+def test_ota_jobs_validated(capsys):
+    args = parse_args(['esphome', 'a.yaml', 'upload', '--ota-jobs', '1', '--ota-retries', '0'])
+    assert args.ota_jobs == 1
+    assert args.ota_retries == 0
+    for option, value in [('--ota-jobs', '0'), ('--ota-jobs', 'x'),
+                          ('--ota-jobs-per-subnet', '-1'), ('--ota-retries', '-1')]:
+        with pytest.raises(SystemExit):
+            parse_args(['esphome', 'a.yaml', 'upload', option, value])
+        assert u"argument {}: must be an integer of at least".format(option) in \
+            capsys.readouterr().err
+
+
+def test_compile_jobs_validated():
+    args = parse_args(['esphome', 'a.yaml', 'compile', '-j', '2', '--generate-jobs', '1'])
+    assert args.jobs == 2
+    assert args.generate_jobs == 1
+    for option in ['-j', '--generate-jobs']:
+        with pytest.raises(SystemExit):
+            parse_args(['esphome', 'a.yaml', 'compile', option, '0'])
@@ -0,0 +1,114 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('PIL')
+
+from esphome.components import font  # noqa: E402 pylint: disable=wrong-import-position
+from esphome.const import CONF_FILE, CONF_GLYPHS, CONF_SIZE  # noqa: E402
+from esphome.core import CORE  # noqa: E402
+
+# A tiny font with outline glyphs for A, B, C (with a hole), . and g (below the baseline)
+FONT_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'font.ttf')
+GLYPHS = [u'.', u'A', u'B', u'C', u'g']
+
+
+@pytest.fixture
+def config_dir(tmpdir):
+    shutil.copy(FONT_PATH, str(tmpdir.join('font.ttf')))
+    CORE.config_path = str(tmpdir.join('node.yaml'))
+    yield tmpdir
+    CORE.reset()
+
+
+def font_config(size=12, glyphs=None):
+    return {CONF_FILE: 'font.ttf', CONF_SIZE: size, CONF_GLYPHS: glyphs or GLYPHS}
+
+
+def pack_per_pixel(path, config):
+    """How glyphs were packed before they were converted in C, one pixel at a time."""
+    from PIL import ImageFont
+
+    pil_font = ImageFont.truetype(path, config[CONF_SIZE])
+    glyph_args = {}
+    data = []
+    for glyph in config[CONF_GLYPHS]:
+        mask = pil_font.getmask(glyph, mode='1')
+        _, (offset_x, offset_y) = pil_font.font.getsize(glyph)
+        width, height = mask.size
+        width8 = ((width + 7) // 8) * 8
+        glyph_data = [0 for _ in range(height * width8 // 8)]
+        for y in range(height):
+            for x in range(width):
+                if not mask.getpixel((x, y)):
+                    continue
+                pos = x + y * width8
+                glyph_data[pos // 8] |= 0x80 >> (pos % 8)
+        glyph_args[glyph] = (len(data), offset_x, offset_y, width, height)
+        data += glyph_data
+    return glyph_args, bytearray(data)
+
+
+@pytest.mark.parametrize('size', [5, 12, 20, 33])
+def test_packing_matches_per_pixel(size):
+    config = font_config(size)
+    _, _, glyph_args, data = font._rasterize_font(FONT_PATH, config)
+    expected_args, expected_data = pack_per_pixel(FONT_PATH, config)
+    assert glyph_args == expected_args
+    assert data == expected_data
+    # Widths that are and aren't a multiple of 8, and a glyph with a hole
+    assert any(args[3] % 8 for args in glyph_args.values())
+
+
+class RasterizeCounter(object):
+    def __init__(self, monkeypatch):
+        self.calls = 0
+        self._rasterize = font._rasterize_font
+        monkeypatch.setattr(font, '_rasterize_font', self)
+
+    def __call__(self, path, config):
+        self.calls += 1
+        return self._rasterize(path, config)
+
+
+def normalized(font_data):
+    ascent, descent, glyph_args, data = font_data
+    return ascent, descent, {k: list(v) for k, v in glyph_args.items()}, bytes(data)
+
+
+def test_cache_hit(config_dir, monkeypatch):
+    counter = RasterizeCounter(monkeypatch)
+    first = font.get_font_data(font_config())
+    assert counter.calls == 1
+    assert config_dir.join('.esphome', 'font_cache').listdir()
+    second = font.get_font_data(font_config())
+    assert counter.calls == 1
+    assert normalized(second) == normalized(first)
+
+
+def test_cache_invalidated(config_dir, monkeypatch):
+    counter = RasterizeCounter(monkeypatch)
+    font.get_font_data(font_config())
+    font.get_font_data(font_config(size=13))
+    assert counter.calls == 2
+    font.get_font_data(font_config(glyphs=[u'A', u'B']))
+    assert counter.calls == 3
+    # Still cached
+    font.get_font_data(font_config())
+    assert counter.calls == 3
+
+    # Same file name, different content
+    with open(str(config_dir.join('font.ttf')), 'ab') as f_handle:
+        f_handle.write(b'\0' * 4)
+    font.get_font_data(font_config())
+    assert counter.calls == 4
+
+
+def test_corrupt_cache_ignored(config_dir, monkeypatch):
+    counter = RasterizeCounter(monkeypatch)
+    expected = font.get_font_data(font_config())
+    for cache_file in config_dir.join('.esphome', 'font_cache').listdir():
+        cache_file.write(u'{"ascent": 1')
+    assert normalized(font.get_font_data(font_config())) == normalized(expected)
+    assert counter.calls == 2
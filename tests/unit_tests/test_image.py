@@ -0,0 +1,170 @@
+import re
+import struct
+
+import pytest
+
+pytest.importorskip('PIL')
+
+import esphome.codegen as cg  # noqa: E402 pylint: disable=wrong-import-position
+from esphome.components import image  # noqa: E402
+from esphome.const import CONF_FILE, CONF_ID, CONF_RESIZE, CONF_TYPE  # noqa: E402
+from esphome.core import CORE, ID  # noqa: E402
+
+# An odd number of pixels, a width that isn't a multiple of 8 and a few distinct colors
+PIXELS = [
+    [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255), (0, 0, 0), (0x12, 0x34, 0x56),
+     (200, 200, 200), (30, 30, 30), (128, 128, 128), (90, 160, 220), (250, 5, 128)],
+    [(0, 0, 0), (255, 255, 255)] * 5 + [(60, 70, 80)],
+    [(16 * i, 255 - 16 * i, 8 * i) for i in range(11)],
+]
+
+
+@pytest.fixture
+def config_dir(tmpdir):
+    from PIL import Image
+
+    height = len(PIXELS)
+    width = len(PIXELS[0])
+    png = Image.new('RGB', (width, height))
+    png.putdata([pixel for row in PIXELS for pixel in row])
+    png.save(str(tmpdir.join('image.png')))
+    CORE.config_path = str(tmpdir.join('node.yaml'))
+    yield tmpdir
+    CORE.reset()
+
+
+def image_config(image_type='BINARY', dither='NONE', resize=None):
+    config = {
+        CONF_ID: ID(u'img', is_declaration=True, type=image.Image_),
+        CONF_FILE: 'image.png',
+        CONF_TYPE: image_type,
+        image.CONF_DITHER: dither,
+        image.CONF_RAW_DATA_ID: ID(u'img_data', is_declaration=True, type=cg.uint8),
+    }
+    if resize is not None:
+        config[CONF_RESIZE] = resize
+    return config
+
+
+def gray(pixel):
+    from PIL import Image
+
+    return Image.new('RGB', (1, 1), pixel).convert('L').getpixel((0, 0))
+
+
+def flat_pixels():
+    return [pixel for row in PIXELS for pixel in row]
+
+
+def generated_image(config):
+    """Run the code generation, return the array bytes and the Image constructor call."""
+    image.to_code(config)
+    array = [str(cg.statement(exp)) for exp in CORE.main_statements
+             if u'PROGMEM' in str(cg.statement(exp))]
+    new = [str(cg.statement(exp)) for exp in CORE.main_statements
+           if u'new display::Image' in str(cg.statement(exp))]
+    assert len(array) == 1 and len(new) == 1
+    data = bytearray(int(x, 16) for x in re.findall(r'0x[0-9A-F]{2}', array[0]))
+    return data, new[0]
+
+
+def test_rgb565_big_endian(config_dir):
+    data, new = generated_image(image_config('RGB565'))
+    assert new == u'img = new display::Image(img_data, 11, 3, display::IMAGE_TYPE_RGB565);'
+    expected = b''.join(struct.pack('>H', ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3))
+                        for r, g, b in flat_pixels())
+    assert bytes(data) == expected
+    # Pure red is RRRRR000 00000000, first byte first
+    assert data[:6] == bytearray([0xF8, 0x00, 0x07, 0xE0, 0x00, 0x1F])
+
+
+def test_grayscale4_nibble_order(config_dir):
+    data, new = generated_image(image_config('GRAYSCALE4'))
+    assert new.endswith(u'display::IMAGE_TYPE_GRAYSCALE4);')
+    pixels = flat_pixels()
+    assert len(data) == (len(pixels) + 1) // 2
+    # Decoded like Image::get_grayscale_pixel(): even positions in the high nibble
+    for pos, pixel in enumerate(pixels):
+        byte = data[pos // 2]
+        value = (byte & 0x0F) if pos % 2 else (byte >> 4)
+        assert value == gray(pixel) >> 4
+    # The padding nibble of the odd pixel count is zero
+    assert data[-1] & 0x0F == 0
+
+
+def test_grayscale(config_dir):
+    data, new = generated_image(image_config('GRAYSCALE'))
+    assert new.endswith(u'display::IMAGE_TYPE_GRAYSCALE);')
+    assert list(data) == [gray(pixel) for pixel in flat_pixels()]
+
+
+def pack_binary_per_pixel(path):
+    """How binary images were packed before they were converted in C."""
+    from PIL import Image
+
+    converted = Image.open(path).convert('1', dither=Image.NONE)
+    width, height = converted.size
+    width8 = ((width + 7) // 8) * 8
+    data = [0 for _ in range(height * width8 // 8)]
+    for y in range(height):
+        for x in range(width):
+            if converted.getpixel((x, y)):
+                continue
+            pos = x + y * width8
+            data[pos // 8] |= 0x80 >> (pos % 8)
+    return bytearray(data)
+
+
+def test_binary_unchanged(config_dir):
+    data, new = generated_image(image_config())
+    assert new == u'img = new display::Image(img_data, 11, 3, display::IMAGE_TYPE_BINARY);'
+    assert data == pack_binary_per_pixel(str(config_dir.join('image.png')))
+
+
+class ConvertCounter(object):
+    def __init__(self, monkeypatch):
+        self.calls = 0
+        self._convert = image._convert_image
+        monkeypatch.setattr(image, '_convert_image', self)
+
+    def __call__(self, path, config):
+        self.calls += 1
+        return self._convert(path, config)
+
+
+def test_cache_hit(config_dir, monkeypatch):
+    counter = ConvertCounter(monkeypatch)
+    first = image.get_image_data(image_config('RGB565'))
+    second = image.get_image_data(image_config('RGB565'))
+    assert counter.calls == 1
+    assert second == first
+
+
+@pytest.mark.parametrize('options', [
+    {'image_type': 'GRAYSCALE'},
+    {'dither': 'FLOYDSTEINBERG'},
+    {'resize': (5, 5)},
+])
+def test_cache_invalidated_by_options(config_dir, monkeypatch, options):
+    counter = ConvertCounter(monkeypatch)
+    default = image.get_image_data(image_config())
+    changed = image.get_image_data(image_config(**options))
+    assert counter.calls == 2
+    if 'resize' in options:
+        assert changed[0] == 5
+    else:
+        assert changed[:2] == default[:2]
+    # Both stay cached
+    image.get_image_data(image_config())
+    image.get_image_data(image_config(**options))
+    assert counter.calls == 2
+
+
+def test_cache_invalidated_by_file(config_dir, monkeypatch):
+    from PIL import Image
+
+    counter = ConvertCounter(monkeypatch)
+    image.get_image_data(image_config())
+    Image.new('RGB', (4, 4), (0, 0, 0)).save(str(config_dir.join('image.png')))
+    assert image.get_image_data(image_config()) == (4, 4, bytearray([0xF0] * 4))
+    assert counter.calls == 2
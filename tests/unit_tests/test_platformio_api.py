@@ -0,0 +1,99 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+from esphome import platformio_api
+from esphome.core import CORE
+from esphome.util import run_external_process
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason="Uses a shell script")
+
+FAKE_PLATFORMIO = u"""\
+#!/bin/sh
+echo "$@" >> "{log}"
+if [ -n "{output}" ]; then
+  echo "Processing test"
+  echo '{output}'
+  exit 0
+fi
+echo "Error: unknown platform" >&2
+exit 1
+"""
+
+
+@pytest.fixture
+def build_dir(tmpdir, monkeypatch):
+    CORE.reset()
+    CORE.config_path = str(tmpdir.join('test.yaml'))
+    CORE.build_path = str(tmpdir.join('build'))
+    tmpdir.join('build', 'platformio.ini').write(u'[env:test]\n', ensure=True)
+    monkeypatch.setattr(platformio_api, 'IDE_DATA', None)
+    monkeypatch.setattr(platformio_api, '_IDE_DATA_REFRESH_STARTED', False)
+    monkeypatch.setattr(platformio_api, '_IDE_DATA_REFRESH_THREAD', None)
+    yield tmpdir
+    CORE.reset()
+
+
+def install_fake_platformio(tmpdir, monkeypatch, idedata, use_subprocess=True):
+    bin_dir = tmpdir.join('bin')
+    script = bin_dir.join('platformio')
+    output = json.dumps(idedata) if idedata is not None else u''
+    script.write(FAKE_PLATFORMIO.format(log=tmpdir.join('calls.log'), output=output), ensure=True)
+    os.chmod(str(script), os.stat(str(script)).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ.get('PATH', ''))
+    if use_subprocess:
+        monkeypatch.setenv('ESPHOME_USE_SUBPROCESS', '1')
+    else:
+        monkeypatch.delenv('ESPHOME_USE_SUBPROCESS', raising=False)
+
+
+def write_outdated_cache():
+    platformio_api._save_idedata_cache('outdated', platformio_api.IDEData({'prog_path': 'old'}))
+
+
+def test_run_external_process_captures_stdout():
+    assert run_external_process('echo', 'hello', capture_stdout=True) == b'hello\n'
+
+
+@pytest.mark.parametrize('use_subprocess', [True, False])
+def test_outdated_idedata_refreshed_in_background(build_dir, monkeypatch, use_subprocess):
+    # Without ESPHOME_USE_SUBPROCESS the refresh still runs the external platformio
+    install_fake_platformio(build_dir, monkeypatch, {'prog_path': 'new'}, use_subprocess)
+    write_outdated_cache()
+
+    assert platformio_api.get_idedata(None).firmware_elf_path == 'old'
+    assert platformio_api._IDE_DATA_REFRESH_STARTED
+    platformio_api._IDE_DATA_REFRESH_THREAD.join()
+    assert platformio_api.IDE_DATA.firmware_elf_path == 'new'
+    assert build_dir.join('calls.log').read().split() == [
+        'run', '-d', CORE.build_path, '-t', 'idedata']
+    # The refreshed data is cached for the next run
+    monkeypatch.setattr(platformio_api, 'IDE_DATA', None)
+    assert platformio_api.get_idedata(None).firmware_elf_path == 'new'
+
+
+def test_failed_refresh_logs_warning(build_dir, monkeypatch, caplog):
+    install_fake_platformio(build_dir, monkeypatch, None)
+    write_outdated_cache()
+
+    assert platformio_api.get_idedata(None).firmware_elf_path == 'old'
+    platformio_api._IDE_DATA_REFRESH_THREAD.join()
+    assert platformio_api.IDE_DATA is None
+    assert any(record.levelname == 'WARNING' and 'Refreshing platformio IDE-data failed'
+               in record.getMessage() for record in caplog.records)
+
+
+def test_refresh_started_once(build_dir, monkeypatch):
+    install_fake_platformio(build_dir, monkeypatch, None)
+    write_outdated_cache()
+
+    assert platformio_api.get_idedata(None).firmware_elf_path == 'old'
+    thread = platformio_api._IDE_DATA_REFRESH_THREAD
+    thread.join()
+    # The failed refresh isn't retried, the outdated cache keeps being used
+    assert platformio_api.get_idedata(None).firmware_elf_path == 'old'
+    assert platformio_api._IDE_DATA_REFRESH_THREAD is thread
+    assert len(build_dir.join('calls.log').readlines()) == 1
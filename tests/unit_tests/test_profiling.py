@@ -0,0 +1,25 @@
+from esphome import profiling
+
+
+def make_func(module):
+    def func():
+        pass
+    func.__module__ = module
+    return func
+
+
+def test_task_label_uses_domain_then_platform():
+    assert profiling._task_label(make_func('esphome.components.dht.sensor')) == u'sensor.dht'
+    assert profiling._task_label(make_func('esphome.components.wifi')) == u'wifi'
+    assert profiling._task_label(make_func('esphome.core_config')) == u'esphome'
+
+
+def test_validate_label_matches_to_code_label():
+    profiler = profiling.Profiler()
+    profiler.enabled = True
+    with profiler.domain('validate', u'sensor.dht'):
+        pass
+    func = make_func('esphome.components.dht.sensor')
+    with profiler.domain('to_code', profiling._task_label(func)):
+        pass
+    assert list(profiler.domains) == [('validate', u'sensor.dht'), ('to_code', u'sensor.dht')]
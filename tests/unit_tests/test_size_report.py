@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from esphome import __main__ as esphome_main
+from esphome import platformio_api, size_report
+from esphome.core import CORE
+from esphome.writer import CPP_AUTO_GENERATE_BEGIN, CPP_AUTO_GENERATE_END, \
+    CPP_INCLUDE_BEGIN, CPP_INCLUDE_END
+
+HEADER = u"""
+
+Symbols from {elf}:
+
+Name                  Value   Class        Type         Size     Line  Section
+
+"""
+
+MAIN_CPP = u"""\
+// Auto generated code by esphome
+{include_begin}
+#include "esphome.h"
+using namespace esphome;
+wifi::WiFiComponent *wifi_wificomponent;
+{include_end}
+
+void setup() {{
+  // ===== DO NOT EDIT ANYTHING BELOW THIS LINE =====
+  {code_begin}
+  App.pre_setup("test", __DATE__ ", " __TIME__);
+  {code_end}
+  // ========= YOU CAN EDIT AFTER THIS LINE =========
+}}
+
+void loop() {{
+  App.loop();
+}}
+"""
+
+
+def nm_line(name, value, symbol_type, size, section, source=None):
+    line = u'{:<20}|{:08x}|   T  |{:>18}|{:08x}|     |{}'.format(
+        name, value, symbol_type, size, section)
+    if source is not None:
+        line += u'\t' + source
+    return line
+
+
+@pytest.fixture
+def build_dir(tmpdir):
+    CORE.reset()
+    CORE.config_path = str(tmpdir.join('test.yaml'))
+    CORE.build_path = str(tmpdir.join('build'))
+    CORE.name = u'test'
+    src = tmpdir.join('build', 'src')
+    src.join('main.cpp').write(MAIN_CPP.format(
+        include_begin=CPP_INCLUDE_BEGIN, include_end=CPP_INCLUDE_END,
+        code_begin=CPP_AUTO_GENERATE_BEGIN, code_end=CPP_AUTO_GENERATE_END), ensure=True)
+    yield tmpdir
+    CORE.reset()
+
+
+def fake_nm(monkeypatch, lines):
+    calls = []
+
+    def check_output(command, **kwargs):
+        calls.append(command)
+        text = HEADER.format(elf=command[-1]) + u'\n'.join(lines) + u'\n'
+        return text.encode('utf-8')
+
+    monkeypatch.setattr(size_report.subprocess, 'check_output', check_output)
+    return calls
+
+
+def test_read_symbols(monkeypatch):
+    calls = fake_nm(monkeypatch, [
+        nm_line(u'esphome::Component::setup()', 0x40201000, u'FUNC', 0x20, u'.irom0.text',
+                u'/build/src/esphome/core/component.cpp:25'),
+        # Demangled names can contain the separator
+        nm_line(u'operator|(int, int)', 0x40201020, u'FUNC', 0x8, u'.irom0.text'),
+        # An alias (C1/C2 constructor) of a symbol that was already read
+        nm_line(u'esphome::Component::Component()', 0x40201040, u'FUNC', 0x10, u'.irom0.text'),
+        nm_line(u'esphome::Component::Component()', 0x40201040, u'FUNC', 0x10, u'.irom0.text'),
+        # Symbols without a size are skipped
+        u'_stext              |40100000|   T  |            NOTYPE|        |     |.text',
+        nm_line(u'unknown', 0x40100010, u'FUNC', 0x4, u'.text', u'??:?'),
+    ])
+    symbols = size_report.read_symbols('xtensa-lx106-elf-nm', 'firmware.elf')
+    assert calls[0][0] == 'xtensa-lx106-elf-nm' and calls[0][-1] == 'firmware.elf'
+    assert symbols == [
+        (u'esphome::Component::setup()', 0x20, u'.irom0.text',
+         u'/build/src/esphome/core/component.cpp', 25),
+        (u'operator|(int, int)', 0x8, u'.irom0.text', None, None),
+        (u'esphome::Component::Component()', 0x10, u'.irom0.text', None, None),
+        (u'unknown', 0x4, u'.text', u'??', None),
+    ]
+
+
+@pytest.mark.parametrize('section, region', [
+    # ESP8266
+    ('.text', 'iram'),
+    ('.irom0.text', 'flash'),
+    ('.data', 'dram'),
+    ('.rodata', 'dram'),
+    ('.bss', 'dram'),
+    # ESP32
+    ('.iram0.text', 'iram'),
+    ('.iram0.vectors', 'iram'),
+    ('.flash.text', 'flash'),
+    ('.flash.rodata', 'flash'),
+    ('.dram0.data', 'dram'),
+    ('.dram0.bss', 'dram'),
+    # Not loaded to the device
+    ('.debug_info', None),
+    ('.comment', None),
+])
+def test_memory_region(section, region):
+    assert size_report.memory_region(section) == region
+
+
+def test_owner(build_dir):
+    src = str(build_dir.join('build', 'src'))
+    report = size_report.SizeReport('firmware.elf', src)
+    component = os.path.join(src, 'esphome', 'components', 'wifi', 'wifi_component.cpp')
+    assert report.owner(component, 10) == u'wifi'
+    assert report.owner(os.path.join(src, 'esphome', 'core', 'log.cpp'), 1) == u'core'
+    # Relative paths are relative to the build directory platformio compiles in
+    assert report.owner(os.path.join('src', 'esphome', 'components', 'api', 'api.cpp'),
+                        1) == u'api'
+    assert report.owner(os.path.join('src', 'esphome', 'components', '..', 'core', 'a.cpp'),
+                        1) == u'core'
+    assert report.owner(os.path.join('src', 'main.cpp'), 5) == size_report.MAIN_CPP_GLOBALS
+    # Unknown files, libraries and the framework
+    assert report.owner(u'??', None) == size_report.OTHER
+    assert report.owner(None, None) == size_report.OTHER
+    assert report.owner(os.path.join('..', '..', 'xtensa', 'libgcc.c'), 1) == size_report.OTHER
+    assert report.owner(os.path.join('.piolibdeps', 'AsyncTCP', 'AsyncTCP.cpp'),
+                        1) == size_report.OTHER
+    assert report.owner(src + u'_other' + os.sep + u'x.cpp', 1) == size_report.OTHER
+    assert report.owner(os.path.join(src, 'lib.cpp'), 1) == size_report.OTHER
+
+
+def test_owner_main_cpp_sections(build_dir):
+    src = str(build_dir.join('build', 'src'))
+    report = size_report.SizeReport('firmware.elf', src)
+    main_cpp = os.path.join(src, 'main.cpp')
+    assert report.main_cpp_sections == [
+        (2, 6, size_report.MAIN_CPP_GLOBALS), (8, 12, size_report.MAIN_CPP_SETUP)]
+    assert report.owner(main_cpp, 5) == size_report.MAIN_CPP_GLOBALS
+    # setup() itself belongs to the generated code
+    assert report.owner(main_cpp, 8) == size_report.MAIN_CPP_SETUP
+    assert report.owner(main_cpp, 12) == size_report.MAIN_CPP_SETUP
+    assert report.owner(main_cpp, 13) == size_report.MAIN_CPP_USER
+    assert report.owner(main_cpp, 17) == size_report.MAIN_CPP_USER
+    assert report.owner(main_cpp, None) == size_report.MAIN_CPP_USER
+
+
+def esp32_symbols(src):
+    return [
+        nm_line(u'esphome::wifi::WiFiComponent::loop()', 0x400d1000, u'FUNC', 0x100,
+                u'.flash.text',
+                os.path.join(src, 'esphome', 'components', 'wifi', 'wifi_component.cpp:40')),
+        nm_line(u'esphome::wifi::global_wifi_component', 0x3ffb0000, u'OBJECT', 0x4,
+                u'.dram0.bss', u'src/esphome/components/wifi/wifi_component.cpp:12'),
+        nm_line(u'esphome::App', 0x3ffb0010, u'OBJECT', 0x80, u'.dram0.bss',
+                os.path.join(src, 'esphome', 'core', 'application.cpp:9')),
+        nm_line(u'esphome::HighFrequencyLoopRequester::is_high_frequency()', 0x40080000,
+                u'FUNC', 0x18, u'.iram0.text', u'src/esphome/core/helpers.cpp:200'),
+        nm_line(u'setup', 0x400d2000, u'FUNC', 0x200, u'.flash.text',
+                os.path.join(src, 'main.cpp:10')),
+        nm_line(u'loop', 0x400d2200, u'FUNC', 0x10, u'.flash.text', u'src/main.cpp:17'),
+        nm_line(u'esphome::wifi::WIFI_NAME', 0x3f400000, u'OBJECT', 0x20, u'.flash.rodata',
+                u'src/esphome/components/wifi/wifi_component.cpp:5'),
+        nm_line(u'xPortGetCoreID', 0x40081000, u'FUNC', 0x10, u'.iram0.text',
+                u'/home/user/esp-idf/components/freertos/port.c:300'),
+        nm_line(u'__divdi3', 0x40082000, u'FUNC', 0x30, u'.iram0.text', u'??:?'),
+        nm_line(u'abort_msg', 0x3ffb1000, u'OBJECT', 0x8, u'.dram0.data'),
+        nm_line(u'debug_info', 0x0, u'OBJECT', 0x1000, u'.debug_info'),
+    ]
+
+
+def test_size_report(build_dir, monkeypatch):
+    src = str(build_dir.join('build', 'src'))
+    fake_nm(monkeypatch, esp32_symbols(src))
+    report = size_report.SizeReport('firmware.elf', src)
+    report.add(size_report.read_symbols('xtensa-esp32-elf-nm', 'firmware.elf'))
+    assert report.totals == {'flash': 0x100 + 0x200 + 0x10 + 0x20,
+                             'iram': 0x18 + 0x10 + 0x30, 'dram': 0x4 + 0x80 + 0x8}
+    assert report.as_dict()['components'] == {
+        u'wifi': {'flash': 0x120, 'iram': 0, 'dram': 0x4},
+        u'core': {'flash': 0, 'iram': 0x18, 'dram': 0x80},
+        size_report.MAIN_CPP_SETUP: {'flash': 0x200, 'iram': 0, 'dram': 0},
+        size_report.MAIN_CPP_USER: {'flash': 0x10, 'iram': 0, 'dram': 0},
+        size_report.OTHER: {'flash': 0, 'iram': 0x40, 'dram': 0x8},
+    }
+    assert [name for name, _ in report.sorted_components()] == [
+        size_report.MAIN_CPP_SETUP, u'wifi', u'core', size_report.OTHER,
+        size_report.MAIN_CPP_USER]
+
+
+def test_size_command_json(build_dir, monkeypatch):
+    src = str(build_dir.join('build', 'src'))
+    elf_path = build_dir.join('firmware.elf')
+    elf_path.write(u'')
+    monkeypatch.setattr(platformio_api, 'get_idedata', lambda config: platformio_api.IDEData({
+        'prog_path': str(elf_path),
+        'cc_path': u'/toolchain/bin/xtensa-esp32-elf-gcc',
+    }))
+    calls = fake_nm(monkeypatch, esp32_symbols(src))
+    json_path = build_dir.join('size.json')
+    args = argparse.Namespace(json=str(json_path))
+
+    assert esphome_main.command_size(args, {}) == 0
+    assert calls[0][0] == u'/toolchain/bin/xtensa-esp32-elf-nm'
+    data = json.loads(json_path.read())
+    assert sorted(data) == ['components', 'elf', 'name', 'totals']
+    assert data['name'] == u'test'
+    assert data['elf'] == str(elf_path)
+    assert data['totals'] == {'flash': 816, 'iram': 88, 'dram': 140}
+    assert data['components'][u'wifi'] == {'flash': 288, 'iram': 0, 'dram': 4}
+    assert sorted(data['components']) == sorted([
+        u'core', u'wifi', size_report.MAIN_CPP_SETUP, size_report.MAIN_CPP_USER,
+        size_report.OTHER])
+
+
+def test_missing_elf(build_dir, monkeypatch):
+    monkeypatch.setattr(platformio_api, 'get_idedata', lambda config: platformio_api.IDEData({
+        'prog_path': str(build_dir.join('missing.elf')),
+    }))
+    with pytest.raises(size_report.EsphomeError):
+        size_report.create_size_report({})
@@ -0,0 +1,76 @@
+import logging
+
+import pytest
+
+from esphome.components.substitutions import do_substitution_pass
+from esphome.core import EsphomeError, Lambda
+from esphome.util import OrderedDict
+
+
+def substitute(substitutions, **config):
+    full = OrderedDict([('substitutions', OrderedDict(substitutions))])
+    full.update(config)
+    return do_substitution_pass(full)
+
+
+def test_plain_and_braced_names():
+    config = substitute([('name', 'kitchen')], a='$name light', b='${name}_light',
+                        c='no substitution', d=42)
+    assert config['a'] == 'kitchen light'
+    assert config['b'] == 'kitchen_light'
+    assert config['c'] == 'no substitution'
+    assert config['d'] == 42
+
+
+def test_nested_definitions_in_any_order():
+    config = substitute([('full', '${prefix} ${room}'), ('prefix', 'Node $room'),
+                         ('$room', 'kitchen')], name='$full')
+    assert config['name'] == 'Node kitchen kitchen'
+    assert config['substitutions'] == {'full': 'Node kitchen kitchen',
+                                       'prefix': 'Node kitchen', 'room': 'kitchen'}
+
+
+def test_cycle_is_an_error():
+    with pytest.raises(EsphomeError) as err:
+        substitute([('a', '${b}'), ('b', 'x $c'), ('c', '$b')], name='$a')
+    assert str(err.value) == u"Circular reference in substitutions: b -> c -> b"
+
+
+def test_undeclared_variable_warns(caplog):
+    caplog.set_level(logging.WARNING)
+    config = substitute([('name', 'kitchen')],
+                        sensor=[OrderedDict([('name', '$name $missing ${other}')])])
+    assert config['sensor'][0]['name'] == 'kitchen $missing ${other}'
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == [
+        u"Found '$name $missing ${other}' (see sensor->0->name) which looks like a "
+        u"substitution, but 'missing' was not declared",
+        u"Found '$name $missing ${other}' (see sensor->0->name) which looks like a "
+        u"substitution, but 'other' was not declared",
+    ]
+
+
+def test_undeclared_variable_in_definition_warns(caplog):
+    caplog.set_level(logging.WARNING)
+    config = substitute([('name', '$missing node')], a='$name')
+    assert config['a'] == '$missing node'
+    assert [record.getMessage() for record in caplog.records] == [
+        u"Found '$missing node' (see substitutions->name) which looks like a substitution, "
+        u"but 'missing' was not declared"]
+
+
+def test_keys_lists_and_lambdas():
+    config = substitute(
+        [('room', 'kitchen'), ('pin', 'GPIO5')],
+        sensor=['$room', 7, OrderedDict([('${room}_id', '$pin'), ('plain', 'x')])],
+        text_sensor=OrderedDict([('lambda', Lambda('return "$room";'))]),
+    )
+    assert config['sensor'][:2] == ['kitchen', 7]
+    assert list(config['sensor'][2].items()) == [('plain', 'x'), ('kitchen_id', 'GPIO5')]
+    assert config['text_sensor']['lambda'].value == 'return "kitchen";'
+
+
+def test_invalid_substitution_key():
+    with pytest.raises(EsphomeError) as err:
+        substitute([('1name', 'x')])
+    assert u"First character in substitutions cannot be a digit" in str(err.value)
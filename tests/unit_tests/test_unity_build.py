@@ -0,0 +1,173 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from esphome import writer
+
+SOURCE = u"""\
+#include "esphome/components/{component}/{component}.h"
+
+namespace esphome {{
+namespace {component} {{
+
+static const char *TAG = "{component}.{name}";
+{extra}
+const char *{name}_tag() {{ return TAG; }}
+
+}}  // namespace {component}
+}}  // namespace esphome
+"""
+
+
+def add_source(tmpdir, sources, component, name, extra=u''):
+    target = u'esphome/components/{0}/{1}.cpp'.format(component, name)
+    tmpdir.join(target).write(SOURCE.format(component=component, name=name, extra=extra),
+                              ensure=True)
+    header = u'esphome/components/{0}/{0}.h'.format(component)
+    tmpdir.join(header).write(u'#pragma once\n', ensure=True)
+    sources[target] = str(tmpdir.join(target))
+    return target
+
+
+def short(units):
+    return [[target.split('/', 2)[2] for target in unit] for unit in units]
+
+
+def test_files_grouped_by_component(tmpdir):
+    sources = {}
+    for name in ['a', 'b', 'c']:
+        add_source(tmpdir, sources, 'mqtt', name)
+    add_source(tmpdir, sources, 'adc', 'adc')
+    add_source(tmpdir, sources, 'wifi', 'wifi')
+    assert short(writer._unity_build_units(sources, 2)) == [
+        ['adc/adc.cpp', 'mqtt/a.cpp'], ['mqtt/b.cpp', 'mqtt/c.cpp'], ['wifi/wifi.cpp']]
+    assert short(writer._unity_build_units(sources, 10)) == [
+        ['adc/adc.cpp', 'mqtt/a.cpp', 'mqtt/b.cpp', 'mqtt/c.cpp', 'wifi/wifi.cpp']]
+
+
+def test_clashing_statics_in_component_split(tmpdir):
+    sources = {}
+    add_source(tmpdir, sources, 'remote_base', 'lg', u'static const uint32_t NBITS = 28;')
+    add_source(tmpdir, sources, 'remote_base', 'nec', u'static const uint32_t NBITS = 32;')
+    add_source(tmpdir, sources, 'remote_base', 'raw')
+    # Same static in another component's namespace doesn't clash
+    add_source(tmpdir, sources, 'sony', 'sony', u'static const uint32_t NBITS = 12;')
+    assert short(writer._unity_build_units(sources, 10)) == [
+        ['remote_base/lg.cpp', 'remote_base/raw.cpp'], ['remote_base/nec.cpp', 'sony/sony.cpp']]
+
+
+def test_clashing_macros_split(tmpdir):
+    sources = {}
+    add_source(tmpdir, sources, 'a', 'a', u'#define BUFFER_SIZE 32')
+    add_source(tmpdir, sources, 'b', 'b', u'#define BUFFER_SIZE 64')
+    assert short(writer._unity_build_units(sources, 10)) == [['a/a.cpp'], ['b/b.cpp']]
+
+
+def test_clashing_anonymous_namespace_members_split(tmpdir):
+    sources = {}
+    add_source(tmpdir, sources, 'a', 'a', u'namespace {\nconst int LIMIT = 3;\n}')
+    add_source(tmpdir, sources, 'a', 'b', u'static const int LIMIT = 4;')
+    add_source(tmpdir, sources, 'a', 'c', u'namespace {\nstruct Helper {};\n}')
+    add_source(tmpdir, sources, 'b', 'b', u'namespace {\nconst int LIMIT = 5;\n}')
+    # Same anonymous namespace member in another component's namespace doesn't clash
+    assert short(writer._unity_build_units(sources, 10)) == [
+        ['a/a.cpp', 'a/c.cpp'], ['a/b.cpp', 'b/b.cpp']]
+
+
+def test_scoped_names():
+    content = u"""\
+using namespace std;
+namespace {
+// namespace { in a comment
+const char *const NAMES[] = {"namespace {", "}"};
+int helper(int x) {
+  using namespace esphome;
+  int local = x;
+  return local;
+}
+template<typename T> struct Box : public Base {
+  T value;
+};
+enum class Mode { ON, OFF };
+}  // namespace
+namespace esphome {
+namespace a {
+using namespace esphome::sensor;
+namespace {
+static uint8_t counter = 0;
+}
+}  // namespace a
+}  // namespace esphome
+"""
+    assert writer._unity_scoped_names(content, 'a') == {
+        (None, writer._USING_NAMESPACE), (None, u'NAMES'), (None, u'helper'), (None, u'Box'),
+        (None, u'Mode'), ('a', writer._USING_NAMESPACE), ('a', u'counter')}
+
+
+def test_using_namespace_ends_unit(tmpdir):
+    sources = {}
+    add_source(tmpdir, sources, 'mqtt', 'a')
+    add_source(tmpdir, sources, 'mqtt', 'b', u'using namespace esphome::sensor;')
+    add_source(tmpdir, sources, 'mqtt', 'c')
+    add_source(tmpdir, sources, 'mqtt', 'd', u'using namespace esphome::cover;')
+    add_source(tmpdir, sources, 'wifi', 'wifi')
+    # Files with the directive go last, other components can still follow them
+    assert short(writer._unity_build_units(sources, 10)) == [
+        ['mqtt/a.cpp', 'mqtt/c.cpp', 'mqtt/b.cpp'], ['mqtt/d.cpp', 'wifi/wifi.cpp']]
+
+
+def test_global_using_namespace_ends_unit(tmpdir):
+    sources = {}
+    add_source(tmpdir, sources, 'a', 'a')
+    tmpdir.join('esphome/components/a/b.cpp').write(u'using namespace esphome;\n', ensure=True)
+    sources['esphome/components/a/b.cpp'] = str(tmpdir.join('esphome/components/a/b.cpp'))
+    add_source(tmpdir, sources, 'b', 'b')
+    assert short(writer._unity_build_units(sources, 10)) == [
+        ['a/a.cpp', 'a/b.cpp'], ['b/b.cpp']]
+
+
+def test_unit_content_renames_tag():
+    content = writer._unity_unit_content(['esphome/components/a/a.cpp', 'esphome/core/log.cpp'])
+    assert content == (u'// Auto generated code by esphome\n'
+                       u'#define TAG TAG_0\n#include "esphome/components/a/a.cpp"\n#undef TAG\n'
+                       u'#define TAG TAG_1\n#include "esphome/core/log.cpp"\n#undef TAG\n')
+
+
+def find_executable(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+@pytest.mark.skipif(sys.platform == 'win32' or find_executable('g++') is None,
+                    reason="Needs g++")
+def test_unit_compiles(tmpdir):
+    sources = {}
+    for name in ['a', 'b', 'c']:
+        add_source(tmpdir, sources, 'mqtt', name, u'static const int RETRIES = 3;'
+                   if name == 'b' else u'')
+    add_source(tmpdir, sources, 'api', 'api', u'static const int RETRIES = 5;')
+    units = writer._unity_build_units(sources, 10)
+    assert len(units) == 1
+    unit = tmpdir.join('unity_0.cpp')
+    unit.write(u'#include <cstdint>\n' + writer._unity_unit_content(units[0]))
+    subprocess.check_call(['g++', '-fsyntax-only', '-I', str(tmpdir), str(unit)])
+
+
+@pytest.mark.skipif(sys.platform == 'win32' or find_executable('g++') is None,
+                    reason="Needs g++")
+def test_units_with_anonymous_namespaces_compile(tmpdir):
+    sources = {}
+    add_source(tmpdir, sources, 'a', 'a', u'namespace {\nint helper() { return 1; }\n}')
+    add_source(tmpdir, sources, 'a', 'b', u'namespace {\nint helper() { return 2; }\n}')
+    add_source(tmpdir, sources, 'a', 'c', u'using namespace std;')
+    units = writer._unity_build_units(sources, 10)
+    assert len(units) == 2
+    for i, unit in enumerate(units):
+        path = tmpdir.join('unity_{}.cpp'.format(i))
+        path.write(u'#include <cstdint>\n' + writer._unity_unit_content(unit))
+        subprocess.check_call(['g++', '-fsyntax-only', '-I', str(tmpdir), str(path)])
@@ -0,0 +1,442 @@
+import collections
+import errno
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from esphome import config, writer
+from esphome.core import CORE, EsphomeError
+from esphome.cpp_generator import RawStatement
+from esphome.helpers import indent
+from esphome.storage_json import StorageJSON, storage_path
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+HASH_SCRIPT = """\
+import sys
+from esphome import config, writer
+from esphome.core import CORE
+CORE.config_path = sys.argv[1]
+CORE.config = config.read_config(False)
+sys.stdout.write(writer.get_config_hash())
+"""
+
+
+def config_hash_in_subprocess(config_path, hash_seed):
+    env = dict(os.environ)
+    env['PYTHONHASHSEED'] = str(hash_seed)
+    env['PYTHONPATH'] = ROOT
+    env['ESPHOME_DISABLE_YAML_CACHE'] = '1'
+    output = subprocess.check_output([sys.executable, '-c', HASH_SCRIPT, config_path],
+                                     env=env, cwd=ROOT)
+    return output.decode('utf-8').strip().splitlines()[-1]
+
+
+def test_config_hash_independent_of_hash_seed():
+    config_path = os.path.join(ROOT, 'tests', 'test1.yaml')
+    first = config_hash_in_subprocess(config_path, 1)
+    second = config_hash_in_subprocess(config_path, 2)
+    assert len(first) == 64
+    assert first == second
+
+
+def config_value_hash(value):
+    hasher = hashlib.sha256()
+    writer._hash_config_value(hasher, value)
+    return hasher.hexdigest()
+
+
+def test_config_hash_keeps_ordered_dict_order():
+    items = [(u'b', 1), (u'a', [2, 3])]
+    assert config_value_hash(dict(items)) == config_value_hash(dict(reversed(items)))
+    assert config_value_hash(collections.OrderedDict(items)) != \
+        config_value_hash(collections.OrderedDict(reversed(items)))
+    assert config_value_hash(collections.OrderedDict(items)) == \
+        config_value_hash(collections.OrderedDict(items))
+
+
+def test_storage_json_config_hash_defaults_to_none():
+    storage = StorageJSON(storage_version=1, name='test', esphome_version='1.13.0',
+                          src_version=1, arduino_version=None, address='test.local',
+                          esp_platform='ESP8266', board='nodemcuv2', build_path='/build',
+                          firmware_bin_path='/build/firmware.bin')
+    assert storage.config_hash is None
+    assert storage.as_dict()['config_hash'] is None
+
+
+@pytest.fixture
+def build_dir(tmpdir):
+    CORE.config_path = str(tmpdir.join('node.yaml'))
+    CORE.build_path = str(tmpdir.join('build'))
+    yield tmpdir.join('build')
+    CORE.reset()
+
+
+def test_code_up_to_date_checks_copied_sources(build_dir):
+    StorageJSON(storage_version=1, name='node', esphome_version='1.13.0', src_version=1,
+                arduino_version=None, address='node.local', esp_platform='ESP8266',
+                board='nodemcuv2', build_path=str(build_dir), firmware_bin_path='firmware.bin',
+                config_hash='abc').save(storage_path())
+    build_dir.join('platformio.ini').write(u'', ensure=True)
+    build_dir.join('src', 'main.cpp').write(u'', ensure=True)
+    build_dir.join('src', 'esphome', 'core', 'defines.h').write(u'', ensure=True)
+    copied = build_dir.join('src', 'esphome', 'core', 'log.h')
+    copied.write(u'#pragma once\n', ensure=True)
+    # No manifest, nothing is known about the copied sources
+    assert not writer.is_code_up_to_date('abc')
+
+    build_dir.join(os.path.basename(writer.src_manifest_path())).write(json.dumps({
+        'version': writer.SRC_MANIFEST_VERSION,
+        'files': {'esphome/core/log.h': {'stat': writer._file_stat(str(copied))}},
+    }))
+    assert writer.is_code_up_to_date('abc')
+    assert not writer.is_code_up_to_date('def')
+
+    copied.write(u'#pragma once\n// changed\n')
+    assert not writer.is_code_up_to_date('abc')
+    copied.remove()
+    assert not writer.is_code_up_to_date('abc')
+
+
+@pytest.fixture
+def sample_code(tmpdir, monkeypatch):
+    """Run the code generation of a sample config with the build directory in tmpdir."""
+    monkeypatch.setenv('ESPHOME_DISABLE_YAML_CACHE', '1')
+    CORE.config_path = os.path.join(ROOT, 'tests', 'test3.yaml')
+    CORE.config = config.read_config(False)
+    CORE.build_path = str(tmpdir.join('build'))
+    for _, component, conf in config.iter_components(CORE.config):
+        if component.to_code is not None:
+            CORE.add_job(component.to_code, conf)
+    CORE.flush_tasks()
+    # Statements with line breaks other than \n and text that isn't ASCII
+    CORE.add(RawStatement(u'// windows\r\nline endings\r\n'))
+    CORE.add(RawStatement(u'// unicode \u00b0C \u2028 separator'))
+    yield tmpdir.join('build', 'src', 'main.cpp')
+    CORE.reset()
+
+
+def old_main_cpp(path):
+    """How main.cpp was built before it was streamed, as one string in memory."""
+    if os.path.isfile(path):
+        with io.open(path, 'r', encoding='utf-8', newline='') as f_handle:
+            text = f_handle.read()
+        code_format = writer.find_begin_end(text, writer.CPP_AUTO_GENERATE_BEGIN,
+                                            writer.CPP_AUTO_GENERATE_END)
+        code_format_ = writer.find_begin_end(code_format[0], writer.CPP_INCLUDE_BEGIN,
+                                             writer.CPP_INCLUDE_END)
+        code_format = (code_format_[0], code_format_[1], code_format[1])
+    else:
+        code_format = writer.CPP_BASE_FORMAT
+    global_s = writer.copy_src_tree() + u'\n' + CORE.cpp_global_section
+    code_s = indent(CORE.cpp_main_section)
+    full_file = code_format[0] + writer.CPP_INCLUDE_BEGIN + u'\n' + global_s + \
+        writer.CPP_INCLUDE_END
+    full_file += code_format[1] + writer.CPP_AUTO_GENERATE_BEGIN + u'\n' + code_s + \
+        writer.CPP_AUTO_GENERATE_END
+    full_file += code_format[2]
+    return full_file.encode('utf-8')
+
+
+def test_main_cpp_same_as_string_building(sample_code):
+    expected = old_main_cpp(str(sample_code))
+    writer.write_cpp()
+    assert sample_code.read_binary() == expected
+
+    # Again with the user code of an existing main.cpp
+    text = sample_code.read_text('utf-8')
+    text = text.replace(writer.CPP_INCLUDE_END, writer.CPP_INCLUDE_END + u'\n// between \u00e4\n')
+    text = u'// before\r\n' + text
+    sample_code.write_text(text + u'\n// after\n', 'utf-8')
+    expected = old_main_cpp(str(sample_code))
+    writer.write_cpp()
+    assert sample_code.read_binary() == expected
+
+
+def test_user_code_survives_regeneration(sample_code):
+    writer.write_cpp()
+    text = sample_code.read_text('utf-8')
+    text = text.replace(writer.CPP_INCLUDE_BEGIN, u'#include "mine.h"\n' +
+                        writer.CPP_INCLUDE_BEGIN)
+    text = text.replace(u'void setup() {', u'int counter = 0;\n\nvoid setup() {')
+    text = text.replace(writer.CPP_AUTO_GENERATE_END, writer.CPP_AUTO_GENERATE_END +
+                        u'\n  counter++;')
+    sample_code.write_text(text, 'utf-8')
+
+    CORE.add(RawStatement(u'// new statement'))
+    writer.write_cpp()
+    result = sample_code.read_text('utf-8')
+    assert result.startswith(u'// Auto generated code by esphome\n#include "mine.h"\n' +
+                             writer.CPP_INCLUDE_BEGIN)
+    assert u'int counter = 0;\n\nvoid setup() {' in result
+    assert writer.CPP_AUTO_GENERATE_END + u'\n  counter++;' in result
+    assert u'  // new statement\n' in result
+
+
+def swap(text, first, second):
+    return text.replace(first, u'\0').replace(second, first).replace(u'\0', second)
+
+
+def swap_blocks(text):
+    text = swap(text, writer.CPP_INCLUDE_BEGIN, writer.CPP_AUTO_GENERATE_BEGIN)
+    return swap(text, writer.CPP_INCLUDE_END, writer.CPP_AUTO_GENERATE_END)
+
+
+@pytest.mark.parametrize('change, message', [
+    (lambda text: text.replace(writer.CPP_INCLUDE_BEGIN, u''),
+     u"Could not find auto generated code begin"),
+    (lambda text: text.replace(writer.CPP_AUTO_GENERATE_END, u''),
+     u"Could not find auto generated code end"),
+    (lambda text: text.replace(writer.CPP_AUTO_GENERATE_BEGIN,
+                               writer.CPP_AUTO_GENERATE_BEGIN * 2),
+     u"Found multiple auto generate code begins"),
+    (lambda text: writer.CPP_INCLUDE_END + text,
+     u"Found multiple auto generate code endings"),
+    # The include block after the code block
+    (swap_blocks, u"Could not find auto generated code begin"),
+    (lambda text: text.replace(writer.CPP_INCLUDE_END, u'').replace(
+        writer.CPP_AUTO_GENERATE_END, writer.CPP_AUTO_GENERATE_END + writer.CPP_INCLUDE_END),
+     u"Could not find auto generated code end"),
+])
+def test_broken_markers(sample_code, change, message):
+    writer.write_cpp()
+    text = change(sample_code.read_text('utf-8'))
+    sample_code.write_text(text, 'utf-8')
+
+    with pytest.raises(EsphomeError) as old_err:
+        old_main_cpp(str(sample_code))
+    with pytest.raises(EsphomeError) as err:
+        writer.write_cpp()
+    assert str(err.value) == str(old_err.value)
+    assert str(err.value).startswith(message)
+    assert sample_code.read_text('utf-8') == text
+
+
+def test_markers_in_user_code_after_blocks(sample_code):
+    # Only the part before the code block is searched for the include block
+    writer.write_cpp()
+    sample_code.write_text(sample_code.read_text('utf-8') + u'\n' + writer.CPP_INCLUDE_BEGIN +
+                           writer.CPP_INCLUDE_END + u'\n', 'utf-8')
+    expected = old_main_cpp(str(sample_code))
+    writer.write_cpp()
+    assert sample_code.read_binary() == expected
+
+
+def test_swapped_markers(sample_code):
+    # The old string splitting didn't notice, and duplicated parts of the file
+    writer.write_cpp()
+    text = swap(sample_code.read_text('utf-8'), writer.CPP_INCLUDE_BEGIN,
+                writer.CPP_INCLUDE_END)
+    sample_code.write_text(text, 'utf-8')
+    with pytest.raises(EsphomeError) as err:
+        writer.write_cpp()
+    assert u"out of order" in str(err.value)
+    assert sample_code.read_text('utf-8') == text
+
+
+def test_unchanged_main_cpp_not_rewritten(sample_code):
+    writer.write_cpp()
+    past = time.time() - 100
+    os.utime(str(sample_code), (past, past))
+    writer.write_cpp()
+    assert sample_code.mtime() == pytest.approx(past)
+
+    CORE.add(RawStatement(u'// changed'))
+    writer.write_cpp()
+    assert sample_code.mtime() > past + 50
+
+
+def test_no_temporary_file_after_error(sample_code, monkeypatch):
+    writer.write_cpp()
+    before = sample_code.read_binary()
+
+    def fail(writer_):
+        writer_.write(u'partial')
+        raise ValueError("Broken statement")
+
+    CORE.add(RawStatement(u'// changed'))
+    monkeypatch.setattr(writer, '_write_main_section', fail)
+    with pytest.raises(ValueError):
+        writer.write_cpp()
+    assert sample_code.read_binary() == before
+    assert not os.path.exists(str(sample_code) + u'.tmp')
+
+
+def test_no_temporary_file_after_failed_replace(sample_code, monkeypatch):
+    writer.write_cpp()
+    before = sample_code.read_binary()
+
+    def fail_replace(src, dst):
+        raise OSError(13, "Permission denied")
+
+    CORE.add(RawStatement(u'// changed'))
+    monkeypatch.setattr(writer, 'replace_file', fail_replace)
+    with pytest.raises(EsphomeError) as err:
+        writer.write_cpp()
+    assert str(err.value).startswith(u"Could not write file at")
+    assert sample_code.read_binary() == before
+    assert not os.path.exists(str(sample_code) + u'.tmp')
+
+
+class FakeComponent(object):
+    def __init__(self, source_files):
+        self.source_files = source_files
+
+
+@pytest.fixture
+def src_tree(build_dir, tmpdir, monkeypatch):
+    """Components with source files in tmpdir, returns the components and the copy calls."""
+    monkeypatch.delenv('ESPHOME_UNITY_BUILD', raising=False)
+    sources = tmpdir.join('components')
+    components = {}
+    for name in ['sensor', 'wifi']:
+        files = {}
+        for ext in ['.h', '.cpp']:
+            source = sources.join(name, name + ext)
+            source.write(u'// {}{}\n'.format(name, ext), ensure=True)
+            files[u'esphome/components/{0}/{0}{1}'.format(name, ext)] = str(source)
+        components[name] = FakeComponent(files)
+    defines = sources.join('core', 'defines.h')
+    defines.write(u'#pragma once\n', ensure=True)
+    components['core'] = FakeComponent({writer.DEFINES_H_TARGET: str(defines)})
+    monkeypatch.setattr(writer, 'iter_components',
+                        lambda config: [(name, comp, {}) for name, comp in components.items()])
+
+    copies = []
+    copy_file = writer._copy_file
+
+    def counting_copy_file(src_path, dst_path):
+        copies.append(os.path.relpath(dst_path, CORE.relative_src_path()).replace(os.sep, '/'))
+        copy_file(src_path, dst_path)
+
+    monkeypatch.setattr(writer, '_copy_file', counting_copy_file)
+    return components, copies
+
+
+def test_first_copy_writes_manifest(build_dir, src_tree):
+    components, copies = src_tree
+    include_s = writer.copy_src_tree()
+    assert u'#include "esphome/components/sensor/sensor.h"' in include_s
+    assert sorted(copies) == sorted(target for name in ['sensor', 'wifi']
+                                    for target in components[name].source_files)
+    manifest = json.loads(build_dir.join('.esphome_src_manifest.json').read())
+    assert manifest['version'] == writer.SRC_MANIFEST_VERSION
+    assert sorted(manifest['files']) == sorted(copies)
+    for target, entry in manifest['files'].items():
+        dst = build_dir.join('src', *target.split('/'))
+        assert dst.read() == u'// {}\n'.format(os.path.basename(target))
+        assert entry['stat'] == writer._file_stat(str(dst))
+
+
+def test_second_run_copies_nothing(build_dir, src_tree):
+    _, copies = src_tree
+    writer.copy_src_tree()
+    manifest = build_dir.join('.esphome_src_manifest.json').read()
+    del copies[:]
+    writer.copy_src_tree()
+    assert copies == []
+    assert build_dir.join('.esphome_src_manifest.json').read() == manifest
+
+
+def test_touched_source_recopied(build_dir, src_tree):
+    components, copies = src_tree
+    writer.copy_src_tree()
+    del copies[:]
+    source = components['sensor'].source_files[u'esphome/components/sensor/sensor.cpp']
+    with open(source, 'w') as f_handle:
+        f_handle.write(u'// changed\n')
+    os.utime(source, (time.time() + 10, time.time() + 10))
+    # Touched without a change, the content is compared and nothing is copied
+    header = components['wifi'].source_files[u'esphome/components/wifi/wifi.h']
+    os.utime(header, (time.time() + 10, time.time() + 10))
+    writer.copy_src_tree()
+    assert copies == [u'esphome/components/sensor/sensor.cpp']
+    assert build_dir.join('src', 'esphome', 'components', 'sensor', 'sensor.cpp').read() == \
+        u'// changed\n'
+
+
+def test_removed_component_deleted(build_dir, src_tree):
+    components, _ = src_tree
+    writer.copy_src_tree()
+    wifi_dir = build_dir.join('src', 'esphome', 'components', 'wifi')
+    assert wifi_dir.join('wifi.cpp').check()
+    del components['wifi']
+    writer.copy_src_tree()
+    assert not wifi_dir.join('wifi.cpp').check()
+    assert not wifi_dir.join('wifi.h').check()
+    assert build_dir.join('src', 'esphome', 'components', 'sensor', 'sensor.cpp').check()
+    manifest = json.loads(build_dir.join('.esphome_src_manifest.json').read())
+    assert sorted(manifest['files']) == [u'esphome/components/sensor/sensor.cpp',
+                                         u'esphome/components/sensor/sensor.h']
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="Reflinks are Linux only")
+@pytest.mark.parametrize('error', [errno.EOPNOTSUPP, errno.EXDEV])
+def test_reflink_failure_falls_back_to_copy(tmpdir, monkeypatch, error):
+    import fcntl
+
+    calls = []
+
+    def failing_ioctl(fd, request, arg):
+        calls.append(request)
+        raise IOError(error, os.strerror(error))
+
+    monkeypatch.setattr(fcntl, 'ioctl', failing_ioctl)
+    src = tmpdir.join('src.cpp')
+    src.write(u'int x = 1;\n')
+    dst = tmpdir.join('out', 'dst.cpp')
+    writer._copy_file(str(src), str(dst))
+    assert calls == [writer.FICLONE]
+    assert dst.read() == u'int x = 1;\n'
+
+
+def find_executable(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def test_object_cache_disabled_by_default(monkeypatch):
+    monkeypatch.delenv('ESPHOME_OBJECT_CACHE', raising=False)
+    assert writer.get_object_cache_dir() is None
+    monkeypatch.setenv('ESPHOME_OBJECT_CACHE', '/tmp/cache')
+    assert writer.get_object_cache_dir() == os.path.abspath('/tmp/cache')
+
+
+SCONSTRUCT = """\
+env = Environment(CPPPATH=['include'])
+SConscript('{}', exports='env')
+VariantDir('build', '../src', duplicate=0)
+env.Program('build/firmware', Glob('build/*.c'))
+""".format(writer.OBJECT_CACHE_SCRIPT_NAME)
+
+
+@pytest.mark.skipif(find_executable('scons') is None or find_executable('gcc') is None,
+                    reason="Needs scons and gcc")
+def test_object_cache_script_shares_objects(tmpdir):
+    """Build two projects through the generated script, the second one reuses shared objects."""
+    for i in range(3):
+        tmpdir.join('src', 'shared{}.c'.format(i)).write(
+            u'int shared{0}(void) {{ return {0}; }}\n'.format(i), ensure=True)
+    tmpdir.join('src', 'main.c').write(u'#include "node.h"\nint main(void) { return NODE; }\n')
+    cache_dir = str(tmpdir.join('cache'))
+    stats = []
+    for node in range(2):
+        project = tmpdir.join('node{}'.format(node))
+        project.join('include', 'node.h').write(u'#define NODE {}\n'.format(node), ensure=True)
+        project.join('SConstruct').write(SCONSTRUCT)
+        stats_path = str(project.join('stats.json'))
+        project.join(writer.OBJECT_CACHE_SCRIPT_NAME).write(writer.OBJECT_CACHE_SCRIPT.format(
+            cache_dir=json.dumps(cache_dir), stats_path=json.dumps(stats_path)))
+        subprocess.check_call([find_executable('scons'), '-Q'], cwd=str(project))
+        with open(stats_path) as f_handle:
+            stats.append(json.load(f_handle))
+    assert stats == [{'hits': 0, 'misses': 4}, {'hits': 3, 'misses': 1}]
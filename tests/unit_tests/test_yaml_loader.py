@@ -0,0 +1,80 @@
+import io
+import os
+
+import pytest
+import yaml
+
+from esphome import yaml_util
+from esphome.core import Lambda
+
+TESTS_DIR = os.path.join(os.path.dirname(__file__), os.pardir)
+
+pytestmark = pytest.mark.skipif(len(yaml_util._LOADERS) < 2,
+                                reason="PyYAML is built without libyaml")
+
+CONFIG = u"""\
+base: &base
+  platform: gpio
+  pin: 4
+sensor:
+- <<: *base
+  name: "Merged"
+  filters:
+  - lambda: return x * 2;
+- platform: template
+  name: !secret sensor_name
+  lambda: !lambda |-
+    return 42.0;
+  values: [1, 2.5, "3", ~, true]
+"""
+
+
+def _normalize(item):
+    """Convert a loaded tree to plain values, including the line info of every node."""
+    if isinstance(item, dict):
+        return ('dict', getattr(item, '__config_file__', None), getattr(item, '__line__', None),
+                [(_normalize(key), _normalize(value)) for key, value in item.items()])
+    if isinstance(item, list):
+        return ('list', getattr(item, '__config_file__', None), getattr(item, '__line__', None),
+                [_normalize(value) for value in item])
+    if isinstance(item, yaml_util.SecretReference):
+        return ('secret', item.secrets_path, item.name)
+    if isinstance(item, Lambda):
+        return ('lambda', item.value)
+    return (type(item).__name__, item)
+
+
+def _load(content, name, loader):
+    stream = io.StringIO(content)
+    stream.name = name
+    return yaml.load(stream, Loader=loader)
+
+
+def test_c_loader_matches_python_loader(tmpdir):
+    tmpdir.join('secrets.yaml').write(u"sensor_name: Secret\n")
+    fname = str(tmpdir.join('test.yaml'))
+    c_tree = _load(CONFIG, fname, yaml_util.CSafeLineLoader)
+    py_tree = _load(CONFIG, fname, yaml_util.SafeLineLoader)
+    assert _normalize(c_tree) == _normalize(py_tree)
+    assert c_tree['sensor'][1].__line__ == 8
+    assert c_tree['sensor'][0]['name'] == u'Merged'
+    assert c_tree['sensor'][0]['pin'] == 4
+
+
+@pytest.mark.parametrize('name', ['test1.yaml', 'test2.yaml', 'test3.yaml'])
+def test_c_loader_matches_on_test_configs(name):
+    fname = os.path.join(TESTS_DIR, name)
+    with io.open(fname, encoding='utf-8') as f_handle:
+        content = f_handle.read()
+    c_tree = _load(content, fname, yaml_util.CSafeLineLoader)
+    py_tree = _load(content, fname, yaml_util.SafeLineLoader)
+    assert _normalize(c_tree) == _normalize(py_tree)
+
+
+def test_c_loader_reports_duplicate_keys(tmpdir):
+    fname = str(tmpdir.join('test.yaml'))
+    with pytest.raises(yaml_util.EsphomeError) as c_err:
+        _load(u"a: 1\na: 2\n", fname, yaml_util.CSafeLineLoader)
+    with pytest.raises(yaml_util.EsphomeError) as py_err:
+        _load(u"a: 1\na: 2\n", fname, yaml_util.SafeLineLoader)
+    assert str(c_err.value) == str(py_err.value)
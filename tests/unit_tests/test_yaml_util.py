@@ -0,0 +1,157 @@
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+from esphome import yaml_util
+
+CONFIG = u"""\
+esphome:
+  name: test
+wifi:
+  password: !secret wifi_password
+  networks:
+  - ssid: !secret ssid
+"""
+
+
+@pytest.fixture
+def config_dir(tmpdir, monkeypatch):
+    monkeypatch.delenv('ESPHOME_DISABLE_YAML_CACHE', raising=False)
+    tmpdir.join('test.yaml').write(CONFIG)
+    tmpdir.join('secrets.yaml').write(u"wifi_password: hunter22\nssid: MySSID\n")
+    return tmpdir
+
+
+def cache_file(config_dir):
+    return config_dir.join('.esphome', 'yaml_cache', 'test.yaml.json')
+
+
+def test_secrets_resolved(config_dir):
+    config = yaml_util.load_yaml(str(config_dir.join('test.yaml')))
+    assert config['wifi']['password'] == 'hunter22'
+    assert config['wifi']['networks'][0]['ssid'] == 'MySSID'
+    assert yaml_util.is_secret('hunter22') == 'wifi_password'
+
+
+def test_cache_hit_reads_secrets(config_dir):
+    fname = str(config_dir.join('test.yaml'))
+    yaml_util.load_yaml(fname)
+    assert cache_file(config_dir).check()
+
+    config = yaml_util.load_yaml(fname)
+    assert config['wifi']['password'] == 'hunter22'
+    assert yaml_util.is_secret('hunter22') == 'wifi_password'
+
+
+def test_cache_does_not_contain_secrets(config_dir):
+    yaml_util.load_yaml(str(config_dir.join('test.yaml')))
+    content = cache_file(config_dir).read_binary()
+    assert b'hunter22' not in content
+    assert b'MySSID' not in content
+
+
+def test_changed_secret(config_dir):
+    fname = str(config_dir.join('test.yaml'))
+    yaml_util.load_yaml(fname)
+    config_dir.join('secrets.yaml').write(u"wifi_password: correcthorse\nssid: MySSID\n")
+    assert yaml_util.load_yaml(fname)['wifi']['password'] == 'correcthorse'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="No POSIX permissions")
+def test_cache_only_readable_by_user(config_dir):
+    yaml_util.load_yaml(str(config_dir.join('test.yaml')))
+    mode = os.stat(str(cache_file(config_dir))).st_mode
+    assert stat.S_IMODE(mode) == 0o600
+
+
+def test_cache_disabled(config_dir, monkeypatch):
+    monkeypatch.setenv('ESPHOME_DISABLE_YAML_CACHE', '1')
+    config = yaml_util.load_yaml(str(config_dir.join('test.yaml')))
+    assert config['wifi']['password'] == 'hunter22'
+    assert not cache_file(config_dir).check()
+
+
+def test_cache_keeps_types_and_lines(config_dir):
+    config_dir.join('test.yaml').write(CONFIG + u"""\
+sensor:
+- platform: template
+  lambda: !lambda return 1.0;
+  update_interval: 10s
+  accuracy_decimals: 2
+  filters: !include filters.yaml
+""")
+    config_dir.join('filters.yaml').write(u"- offset: 2.5\n- multiply: 1.2\n")
+    fname = str(config_dir.join('test.yaml'))
+    parsed = yaml_util.load_yaml(fname)
+    assert cache_file(config_dir).check()
+    cached = yaml_util.load_yaml(fname)
+    assert list(cached) == list(parsed)
+    sensor = cached['sensor'][0]
+    assert isinstance(cached, yaml_util.OrderedDict)
+    assert isinstance(cached['sensor'], yaml_util.NodeListClass)
+    assert isinstance(sensor['lambda'], yaml_util.Lambda)
+    assert sensor['lambda'].value == u'return 1.0;'
+    assert sensor['accuracy_decimals'] == 2
+    assert sensor['filters'][0]['offset'] == 2.5
+    assert sensor.__line__ == parsed['sensor'][0].__line__ == 7
+    assert sensor['filters'].__config_file__ == fname
+    assert sensor['filters'][0].__config_file__ == str(config_dir.join('filters.yaml'))
+
+
+def test_cache_is_json(config_dir):
+    # The cache directory can be written by others (dashboard, add-on), it must never be
+    # loaded with pickle
+    yaml_util.load_yaml(str(config_dir.join('test.yaml')))
+    entry = json.loads(cache_file(config_dir).read())
+    assert entry['version'] == yaml_util.YAML_CACHE_VERSION
+    assert not config_dir.join('.esphome', 'yaml_cache', 'test.yaml.pickle').check()
+
+
+def test_invalid_cache_ignored(config_dir):
+    fname = str(config_dir.join('test.yaml'))
+    yaml_util.load_yaml(fname)
+    entry = json.loads(cache_file(config_dir).read())
+    entry['data'] = {'t': 'unknown', 'v': 1}
+    cache_file(config_dir).write(json.dumps(entry))
+    assert yaml_util.load_yaml(fname)['esphome']['name'] == 'test'
+    cache_file(config_dir).write(u'garbage')
+    assert yaml_util.load_yaml(fname)['esphome']['name'] == 'test'
+
+
+def test_uncacheable_values_not_cached(config_dir):
+    # Dates are constructed as datetime.date, the cache doesn't store them
+    config_dir.join('test.yaml').write(CONFIG + u"substitutions:\n  built: 2019-01-01\n")
+    config = yaml_util.load_yaml(str(config_dir.join('test.yaml')))
+    assert str(config['substitutions']['built']) == '2019-01-01'
+    assert not cache_file(config_dir).check()
+
+
+def test_secret_references_equal_by_name(config_dir):
+    path = str(config_dir.join('secrets.yaml'))
+    ref = yaml_util.SecretReference(path, 'ssid')
+    assert ref == yaml_util.SecretReference(path, 'ssid')
+    assert ref != yaml_util.SecretReference(path, 'wifi_password')
+    assert ref != yaml_util.SecretReference(str(config_dir.join('sub', 'secrets.yaml')), 'ssid')
+    assert {ref: 1}[yaml_util.SecretReference(path, 'ssid')] == 1
+
+
+def test_secret_as_key(config_dir):
+    config_dir.join('test.yaml').write(u"""\
+substitutions:
+  !secret ssid: value
+""")
+    config = yaml_util.load_yaml(str(config_dir.join('test.yaml')))
+    assert config['substitutions'] == {'MySSID': 'value'}
+
+
+def test_duplicate_secret_key(config_dir):
+    config_dir.join('test.yaml').write(u"""\
+substitutions:
+  !secret ssid: a
+  !secret ssid: b
+""")
+    with pytest.raises(yaml_util.EsphomeError, match=u'duplicate key "!secret ssid"'):
+        yaml_util.load_yaml(str(config_dir.join('test.yaml')))